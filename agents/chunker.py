@@ -0,0 +1,196 @@
+import re
+from typing import Dict, List, Optional
+
+from common.exception import AppException
+
+# Markdown headings (emitted by the layout backend), numbered section titles
+# like "3.2 Results", and short ALL-CAPS lines
+_HEADING = re.compile(r"^(#{1,6}\s+\S.*|\d+(\.\d+)*\.?\s+[A-Z][^.!?]{0,80}|[A-Z][A-Z0-9 \-:&]{2,60})$")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_TERMINAL = (".", "!", "?", ":", ";", "|")
+# A wrapped line this short that ends a sentence usually ends its paragraph
+_SHORT_LINE = 60
+
+
+class DocumentChunker:
+    """
+    Token-budgeted chunker that runs over the page stream of a whole
+    document rather than page by page.
+
+    Page text is split into headings and paragraphs, and a paragraph cut by
+    a page break is rejoined with its continuation. Paragraphs are split into
+    sentences whose sizes are measured with the embedding model's own
+    tokenizer, then packed into chunks of at most `max_tokens`:
+
+      * a heading always starts a new chunk (and is repeated on follow-up
+        chunks of the same section when it fits),
+      * a paragraph that would not fit starts a new chunk once the current one
+        is at least half full, otherwise the chunk is filled sentence by
+        sentence,
+      * consecutive chunks share up to `overlap_tokens` of trailing sentences,
+      * a final chunk under `min_tokens` is folded into its predecessor.
+    """
+
+    def __init__(self, tokenizer, max_tokens: int = 254, overlap_tokens: int = 32, min_tokens: int = 48):
+        if overlap_tokens >= max_tokens:
+            raise AppException("DocumentChunker: overlap_tokens must be smaller than max_tokens")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+
+    def _token_ids(self, texts: List[str]) -> List[List[int]]:
+        if not texts:
+            return []
+        return self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._token_ids([text])[0])
+
+    def _blocks(self, pages: List[Dict]) -> List[Dict]:
+        """
+        Flatten a document's pages into heading/paragraph blocks tagged with
+        the page range they span.
+        """
+        blocks: List[Dict] = []
+        for page in pages:
+            page_no = page.get("page")
+            lines = [line.strip() for line in (page.get("text") or "").split("\n")]
+            paragraph: List[str] = []
+            start_page = page_no
+
+            first = next((line for line in lines if line), "")
+            if first and not _HEADING.match(first) and blocks and blocks[-1]["kind"] == "text" \
+                    and not blocks[-1]["text"].endswith(_TERMINAL):
+                # The previous page ended mid-paragraph: continue it here
+                carried = blocks.pop()
+                paragraph.append(carried["text"])
+                start_page = carried["page_start"]
+
+            def flush():
+                nonlocal start_page
+                if paragraph:
+                    blocks.append({"kind": "text", "text": " ".join(paragraph),
+                                   "page_start": start_page, "page_end": page_no})
+                    paragraph.clear()
+                start_page = page_no
+
+            for line in lines:
+                if not line:
+                    flush()
+                elif len(line) < 100 and _HEADING.match(line):
+                    flush()
+                    blocks.append({"kind": "heading", "text": line.lstrip("#").strip(),
+                                   "page_start": page_no, "page_end": page_no})
+                else:
+                    paragraph.append(line)
+                    if line.endswith(_TERMINAL) and len(line) < _SHORT_LINE:
+                        flush()
+            flush()
+        return blocks
+
+    def _pieces(self, blocks: List[Dict]) -> List[Dict]:
+        """
+        Split blocks into sentence pieces of at most `max_tokens`, sized with
+        one batched tokenizer call. Each piece remembers its paragraph.
+        """
+        pieces = []
+        for para, block in enumerate(blocks):
+            parts = [block["text"]] if block["kind"] == "heading" else _SENTENCE_END.split(block["text"])
+            for part in parts:
+                if part.strip():
+                    pieces.append(dict(block, text=part.strip(), para=para))
+
+        sized = []
+        for piece, ids in zip(pieces, self._token_ids([p["text"] for p in pieces])):
+            if len(ids) <= self.max_tokens:
+                sized.append(dict(piece, tokens=len(ids)))
+                continue
+            # A single "sentence" longer than the window: split on tokens
+            step = self.max_tokens - self.overlap_tokens
+            for start in range(0, len(ids), step):
+                window = ids[start:start + self.max_tokens]
+                sized.append(dict(piece, text=self.tokenizer.decode(window), tokens=len(window)))
+                if start + self.max_tokens >= len(ids):
+                    break
+        return sized
+
+    def chunk_document(self, pages: List[Dict]) -> List[Dict]:
+        """
+        Chunk one document's pages (in page order). Returns dicts with
+        text, page_start, page_end and token_count, plus overlap_chars /
+        overlap_tokens: the size of the leading text repeated from earlier
+        chunks (carried sentences, a repeated heading), which consecutive
+        chunks drop when they are stitched back together.
+        """
+        pieces = self._pieces(self._blocks(pages))
+        para_tokens: Dict[int, int] = {}
+        for piece in pieces:
+            para_tokens[piece["para"]] = para_tokens.get(piece["para"], 0) + piece["tokens"]
+
+        chunks: List[List[Dict]] = []
+        current: List[Dict] = []
+        heading: Optional[Dict] = None
+
+        def size(items: List[Dict]) -> int:
+            return sum(p["tokens"] for p in items)
+
+        def emit():
+            if not current or all(p["kind"] == "heading" for p in current):
+                return
+            chunks.append(list(current))
+
+        def carry_over() -> List[Dict]:
+            tail: List[Dict] = []
+            for piece in reversed(current):
+                if piece["kind"] == "heading" or size(tail) + piece["tokens"] > self.overlap_tokens:
+                    break
+                tail.insert(0, piece)
+            if heading is not None and size(tail) + heading["tokens"] < self.max_tokens // 2:
+                tail.insert(0, heading)
+            return tail
+
+        for i, piece in enumerate(pieces):
+            if piece["kind"] == "heading":
+                emit()
+                current = [piece]
+                heading = piece
+                continue
+
+            starts_paragraph = i == 0 or pieces[i - 1]["para"] != piece["para"]
+            fits_sentence = size(current) + piece["tokens"] <= self.max_tokens
+            fits_paragraph = size(current) + para_tokens[piece["para"]] <= self.max_tokens
+            half_full = size(current) >= self.max_tokens // 2
+            if current and (not fits_sentence or (starts_paragraph and not fits_paragraph and half_full)):
+                emit()
+                current = carry_over()
+                if size(current) + piece["tokens"] > self.max_tokens:
+                    current = []
+            current.append(piece)
+        emit()
+
+        if len(chunks) > 1 and size(chunks[-1]) < self.min_tokens:
+            # Fold the short tail into its predecessor, minus the shared overlap
+            merged = chunks[-2] + [p for p in chunks[-1] if not any(p is q for q in chunks[-2])]
+            if size(merged) <= self.max_tokens:
+                chunks[-2:] = [merged]
+
+        def join(items: List[Dict]) -> str:
+            return "".join(p["text"] + ("\n" if p["kind"] == "heading" else " ") for p in items)
+
+        result = []
+        seen = set()
+        for items in chunks:
+            shared = 0
+            while shared < len(items) and id(items[shared]) in seen:
+                shared += 1
+            seen.update(id(p) for p in items)
+            result.append({
+                "text": join(items).strip(),
+                "page_start": min(p["page_start"] for p in items),
+                "page_end": max(p["page_end"] for p in items),
+                "token_count": size(items),
+                "overlap_chars": len(join(items[:shared])),
+                "overlap_tokens": size(items[:shared]),
+            })
+        return result
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from common.exception import AppException
+from common.logging import logger
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "torch" (SentenceTransformer, fp32) or "onnx" (int8-quantized export on onnxruntime)
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+# Intra-op threads for either runtime; 0 keeps the runtime's default
+ENCODER_THREADS = int(os.getenv("ENCODER_THREADS", "0"))
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join("models", f"{EMBEDDING_MODEL}-onnx"))
+ONNX_FILE = "model.int8.onnx"
+# `parity` fails when any sampled chunk drifts below this cosine similarity
+PARITY_MIN_COSINE = float(os.getenv("ENCODER_PARITY_MIN_COSINE", "0.99"))
+
+
+class OnnxEncoder:
+    """
+    Runs the int8-quantized ONNX export of the SentenceTransformer with
+    onnxruntime. Mirrors the subset of the SentenceTransformer API the agents
+    use (`encode`, `tokenizer`, `max_seq_length`,
+    `get_sentence_embedding_dimension`) and reproduces its
+    Transformer -> mean pooling -> L2 normalize pipeline, without importing
+    torch.
+    """
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, threads: int = ENCODER_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(model_dir, ONNX_FILE)
+        if not os.path.exists(model_path):
+            raise AppException(
+                f"OnnxEncoder: '{model_path}' not found; run `python -m agents.encoders export` first",
+                status_code=500
+            )
+        with open(os.path.join(model_dir, "encoder.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = meta["max_seq_length"]
+        self.dimension = meta["dimension"]
+        self.normalize = meta.get("normalize", True)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        # Sort by length so each batch pads to a similar size
+        order = np.argsort([-len(t) for t in texts])
+        out = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            enc = self.tokenizer(
+                [texts[i] for i in idx],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out[idx] = pooled
+        return out[0] if single else out
+
+
+def _load_torch(model_name: str, threads: int):
+    from sentence_transformers import SentenceTransformer
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    return SentenceTransformer(model_name)
+
+
+def load_encoder(backend: Optional[str] = None, threads: int = ENCODER_THREADS):
+    """
+    Return the embedding model for `backend` ("torch" or "onnx"). Both expose
+    the same encode/tokenizer interface to the agents.
+    """
+    backend = backend or ENCODER_BACKEND
+    try:
+        if backend == "torch":
+            return _load_torch(EMBEDDING_MODEL, threads)
+        if backend == "onnx":
+            return OnnxEncoder(threads=threads)
+    except AppException:
+        raise
+    except Exception as e:
+        raise AppException(f"Unable to load '{backend}' encoder for {EMBEDDING_MODEL}", status_code=500, error_detail=e)
+    raise AppException(f"Unknown encoder backend '{backend}', expected 'torch' or 'onnx'", status_code=500)
+
+
+def export_onnx(model_name: str = EMBEDDING_MODEL, out_dir: str = ONNX_MODEL_DIR, opset: int = 17) -> str:
+    """
+    Export the SentenceTransformer's transformer to ONNX and quantize its
+    weights to int8 (dynamic quantization). Pooling and normalization are
+    done by OnnxEncoder, so only the token embeddings are exported.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    class TokenEmbeddings(torch.nn.Module):
+        # Positional signature for the tracer; newer transformers releases
+        # no longer take these inputs positionally
+        def __init__(self, model, names):
+            super().__init__()
+            self.model = model
+            self.names = names
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(self.names, inputs))).last_hidden_state
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    tokenizer = st_model.tokenizer
+    os.makedirs(out_dir, exist_ok=True)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    transformer = TokenEmbeddings(st_model[0].auto_model.eval(), input_names)
+    fp32_path = os.path.join(out_dir, "model.fp32.onnx")
+    torch.onnx.export(
+        transformer,
+        tuple(sample[n] for n in input_names),
+        fp32_path,
+        input_names=input_names,
+        output_names=["token_embeddings"],
+        dynamic_axes={n: {0: "batch", 1: "sequence"} for n in input_names + ["token_embeddings"]},
+        opset_version=opset,
+        dynamo=False,
+    )
+    quantize_dynamic(fp32_path, os.path.join(out_dir, ONNX_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    tokenizer.save_pretrained(out_dir)
+    normalize = any(type(module).__name__ == "Normalize" for module in st_model)
+    with open(os.path.join(out_dir, "encoder.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "model": model_name,
+            "max_seq_length": st_model.max_seq_length,
+            "dimension": st_model.get_sentence_embedding_dimension(),
+            "normalize": normalize,
+        }, f, indent=2)
+    logger.info(f"Exported int8 ONNX encoder for {model_name} to '{out_dir}'")
+    return out_dir
+
+
+def parity_check(candidate, texts: List[str], reference_vectors: np.ndarray) -> Dict:
+    """
+    Cosine similarity between `candidate` embeddings of `texts` and the
+    reference vectors (stored Qdrant vectors or PyTorch embeddings).
+    """
+    if not texts:
+        raise AppException("parity_check: no texts to compare")
+    ref = np.asarray(reference_vectors, dtype=np.float32)
+    got = np.asarray(candidate.encode(texts), dtype=np.float32)
+    ref /= np.clip(np.linalg.norm(ref, axis=1, keepdims=True), 1e-12, None)
+    got /= np.clip(np.linalg.norm(got, axis=1, keepdims=True), 1e-12, None)
+    cosine = (ref * got).sum(axis=1)
+    return {
+        "samples": len(texts),
+        "mean_cosine": float(cosine.mean()),
+        "p01_cosine": float(np.percentile(cosine, 1)),
+        "min_cosine": float(cosine.min()),
+        "max_drift": float(1.0 - cosine.min()),
+    }
+
+
+def _stored_samples(limit: int):
+    """Chunk texts and their stored (PyTorch-made) vectors from Qdrant."""
+    from qdrant_client import QdrantClient
+    from common.config import COLLECTION_NAME
+
+    host = os.getenv("QDRANT_HOST", "localhost")
+    port = int(os.getenv("QDRANT_PORT", "6334"))
+    client = QdrantClient(host=host, port=port, prefer_grpc=True)
+    points, _ = client.scroll(COLLECTION_NAME, limit=limit, with_payload=["text"], with_vectors=True)
+    points = [p for p in points if (p.payload or {}).get("text")]
+    return [p.payload["text"] for p in points], np.array([p.vector for p in points], dtype=np.float32)
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python -m agents.encoders export
+    #   python -m agents.encoders parity [--samples 500] [--against torch]
+    parser = argparse.ArgumentParser(description="ONNX/int8 encoder export and parity check")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--against", choices=["stored", "torch"], default="stored",
+                        help="Compare with vectors stored in Qdrant or with fresh PyTorch embeddings")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Exported to {export_onnx()}")
+    else:
+        onnx_encoder = load_encoder("onnx")
+        texts, vectors = _stored_samples(args.samples)
+        if args.against == "torch" or not texts:
+            torch_encoder = load_encoder("torch")
+            texts = texts or ["What is self attention in a transformer?", "Neural Turing machines"]
+            vectors = torch_encoder.encode(texts)
+        report = parity_check(onnx_encoder, texts, vectors)
+        print(json.dumps(report, indent=2))
+        if report["min_cosine"] < PARITY_MIN_COSINE:
+            print(f"FAIL: min cosine {report['min_cosine']:.4f} < {PARITY_MIN_COSINE}")
+            raise SystemExit(1)
+        print("OK: ONNX encoder is within parity threshold")
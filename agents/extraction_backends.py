@@ -0,0 +1,186 @@
+import os
+import statistics
+import threading
+from typing import Dict, List, Optional
+
+import pdfplumber
+import pypdfium2 as pdfium
+
+from common.exception import AppException
+
+# pdfium is not thread-safe; every call into it goes through this lock
+_PDFIUM_LOCK = threading.Lock()
+
+
+class ExtractionBackend:
+    """
+    Page-level text extraction from a PDF. `open` returns a backend-specific
+    document handle that is passed back to `page_count`, `extract_page` and
+    `close`. Handles are not shared between threads.
+    """
+
+    name = "base"
+
+    def open(self, pdf_path: str):
+        raise NotImplementedError
+
+    def page_count(self, doc) -> int:
+        raise NotImplementedError
+
+    def extract_page(self, doc, index: int) -> str:
+        """Return the text of the 0-based page `index` ("" if blank)."""
+        raise NotImplementedError
+
+    def close(self, doc) -> None:
+        raise NotImplementedError
+
+
+class PdfiumBackend(ExtractionBackend):
+    """Fast plain-text extraction through pdfium's native text layer."""
+
+    name = "pdfium"
+
+    def open(self, pdf_path: str):
+        with _PDFIUM_LOCK:
+            return pdfium.PdfDocument(pdf_path)
+
+    def page_count(self, doc) -> int:
+        with _PDFIUM_LOCK:
+            return len(doc)
+
+    def extract_page(self, doc, index: int) -> str:
+        with _PDFIUM_LOCK:
+            page = doc[index]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range()
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+    def close(self, doc) -> None:
+        with _PDFIUM_LOCK:
+            doc.close()
+
+
+class PdfPlumberBackend(ExtractionBackend):
+    """The original pdfplumber `extract_text()` path."""
+
+    name = "pdfplumber"
+
+    def open(self, pdf_path: str):
+        return pdfplumber.open(pdf_path)
+
+    def page_count(self, doc) -> int:
+        return len(doc.pages)
+
+    def extract_page(self, doc, index: int) -> str:
+        page = doc.pages[index]
+        try:
+            return page.extract_text() or ""
+        finally:
+            # Drop pdfplumber's per-page object caches as we go
+            page.close()
+
+    def close(self, doc) -> None:
+        doc.close()
+
+
+class LayoutBackend(PdfPlumberBackend):
+    """
+    pdfplumber with structure kept: lines set in a noticeably larger font are
+    emitted as markdown headings and detected tables as pipe-delimited rows,
+    so the chunker can split on them.
+    """
+
+    name = "layout"
+    heading_ratio = 1.2
+
+    def extract_page(self, doc, index: int) -> str:
+        page = doc.pages[index]
+        try:
+            tables = page.find_tables()
+            table_boxes = [t.bbox for t in tables]
+            body = page.filter(lambda obj: not _inside_any(obj, table_boxes)) if table_boxes else page
+
+            lines = body.extract_text_lines()
+            sizes = [c["size"] for line in lines for c in line["chars"]]
+            body_size = statistics.median(sizes) if sizes else 0
+
+            blocks = []
+            for line in lines:
+                line_size = statistics.mean(c["size"] for c in line["chars"]) if line["chars"] else 0
+                text = line["text"].strip()
+                if not text:
+                    continue
+                if body_size and line_size >= body_size * self.heading_ratio and len(text) < 120:
+                    blocks.append((line["top"], f"\n## {text}\n"))
+                else:
+                    blocks.append((line["top"], text))
+            for table in tables:
+                rows = [
+                    "| " + " | ".join((cell or "").replace("\n", " ").strip() for cell in row) + " |"
+                    for row in table.extract()
+                ]
+                blocks.append((table.bbox[1], "\n" + "\n".join(rows) + "\n"))
+
+            blocks.sort(key=lambda block: block[0])
+            return "\n".join(text for _, text in blocks).strip()
+        finally:
+            page.close()
+
+
+def _inside_any(obj: Dict, boxes: List[tuple]) -> bool:
+    x0, top, x1, bottom = obj.get("x0"), obj.get("top"), obj.get("x1"), obj.get("bottom")
+    if x0 is None or top is None:
+        return False
+    return any(bx0 <= x0 and x1 <= bx1 and btop <= top and bottom <= bbottom
+               for bx0, btop, bx1, bbottom in boxes)
+
+
+BACKENDS: Dict[str, ExtractionBackend] = {
+    backend.name: backend for backend in (PdfiumBackend(), PdfPlumberBackend(), LayoutBackend())
+}
+
+
+def get_backend(name: str) -> ExtractionBackend:
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise AppException(
+            f"Unknown extraction backend '{name}', expected 'auto' or one of {sorted(BACKENDS)}"
+        )
+
+
+# --- auto-dispatch heuristics -------------------------------------------------
+
+# Documents longer than this go straight to the fast backend
+AUTO_FAST_PAGE_THRESHOLD = int(os.getenv("EXTRACT_FAST_PAGE_THRESHOLD", "150"))
+# Sampled pages averaging fewer characters than this are treated as scans
+AUTO_MIN_CHARS_PER_PAGE = int(os.getenv("EXTRACT_MIN_CHARS_PER_PAGE", "200"))
+AUTO_SAMPLE_PAGES = 3
+
+
+def choose_backend(pdf_path: str, fast: Optional[ExtractionBackend] = None) -> str:
+    """
+    Pick a backend for `pdf_path` from cheap signals gathered with the fast
+    backend: long documents and image-only (scanned) documents use it
+    directly, where structure recovery would be slow and gain nothing;
+    everything else gets the layout-aware backend.
+    """
+    fast = fast or BACKENDS["pdfium"]
+    doc = fast.open(pdf_path)
+    try:
+        pages = fast.page_count(doc)
+        if pages > AUTO_FAST_PAGE_THRESHOLD:
+            return fast.name
+        sample = [fast.extract_page(doc, i) for i in range(min(pages, AUTO_SAMPLE_PAGES))]
+    finally:
+        fast.close(doc)
+    chars = sum(len(text.strip()) for text in sample) / max(len(sample), 1)
+    if chars < AUTO_MIN_CHARS_PER_PAGE:
+        return fast.name
+    return "layout"
@@ -1,20 +1,39 @@
 from agno.agent import Agent
-import pdfplumber
 import os
-from typing import List, Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import List, Dict, Optional, Tuple
 import uuid
+from agents.extraction_backends import BACKENDS, choose_backend, get_backend
 from common.exception import AppException
 from common.logging import logger
 
+# Cap for one page in the pure-Python backends; the page is then
+# re-extracted with the fast backend instead of stalling the document.
+# Best-effort: a thread cannot be killed, so the hung call keeps its worker
+# (and the document it opened) until it returns on its own
+PAGE_TIMEOUT_S = float(os.getenv("EXTRACT_PAGE_TIMEOUT_S", "20"))
+# In auto mode, a document whose pages average slower than this (after the
+# first few) is finished with the fast backend
+PAGE_TIME_BUDGET_S = float(os.getenv("EXTRACT_PAGE_BUDGET_S", "1.0"))
+BUDGET_WARMUP_PAGES = 3
+
 class IngestionAgent(Agent):
 
-    def __init__(self):
+    def __init__(self, backend: str = os.getenv("EXTRACT_BACKEND", "auto")):
+        if backend != "auto":
+            get_backend(backend)
+        self.backend = backend
+        # Cumulative {backend: {"pages": int, "seconds": float}}
+        self.backend_stats: Dict[str, Dict[str, float]] = {}
+        self._stats_lock = threading.Lock()
         super().__init__(
             name="PDF Ingestion Agent",
             role="Given a list of PDF file paths, extract text from each page "
                  "and record page-number and source filename.",
             instructions=[
-                "For each valid PDF path, open with pdfplumber.",
+                "For each valid PDF path, pick an extraction backend (pdfium, pdfplumber or layout).",
                 "Iterate pages in order, extract text, and append a dict:",
                 "  {text: str, page_number: int, source: str}.",
                 "Skip pages with no text.",
@@ -22,45 +41,132 @@ class IngestionAgent(Agent):
             ]
         )
 
-    def run(self, file_paths: List[str]) -> Dict:
+    def run(
+        self,
+        file_paths: List[str],
+        doc_ids: Optional[List[str]] = None,
+        source_names: Optional[List[str]] = None,
+        backend: Optional[str] = None,
+    ) -> Dict:
         # 1. Check existence & readability
-        
+        # `doc_ids` lets callers keep a document's identity when re-ingesting it;
+        # `source_names` carries the original filename when the file on disk is
+        # stored under another name (e.g. its content hash)
+        if doc_ids is not None and len(doc_ids) != len(file_paths):
+            raise AppException("IngestionAgent.run: doc_ids must match file_paths one-to-one")
+        if source_names is not None and len(source_names) != len(file_paths):
+            raise AppException("IngestionAgent.run: source_names must match file_paths one-to-one")
+
         pages_data = []
-        for pdf_path in file_paths:
-            filename = os.path.basename(pdf_path)
-            print(filename)
+        for file_idx, pdf_path in enumerate(file_paths):
+            filename = source_names[file_idx] if source_names else os.path.basename(pdf_path)
+            logger.debug(f"IngestionAgent: extracting '{filename}'")
             if not os.path.exists(pdf_path):
                 msg = f"File not found: {pdf_path}"
                 raise AppException(msg)
             if not pdf_path.lower().endswith(".pdf"):
                 raise AppException(f"IngestionAgent.run: Invalid file extension, expected .pdf: '{pdf_path}'")
             
-            doc_id=str(uuid.uuid4())
+            doc_id = doc_ids[file_idx] if doc_ids else str(uuid.uuid4())
 
 
             try:
-                # 2. Open the PDF with pdfplumber
-                with pdfplumber.open(pdf_path) as pdf:
-                    # 3. Iterate over each page (pdfplumber pages are 0-indexed under the hood)
-                    for i, page in enumerate(pdf.pages, start=1):
-                        # Extract text for this page (returns None if blank)
-                        txt = page.extract_text() or ""
-                        if not txt.strip():
-                            continue
-                        pages_data.append({
-                            "page": i, 
-                            "text": txt,
-                            "source":filename,
-                            "doc_id":doc_id
-                        })
-
-                
+                # 2. Extract every page with the selected backend
+                for page_no, txt, extractor in self._extract_document(pdf_path, backend or self.backend):
+                    if not txt.strip():
+                        continue
+                    pages_data.append({
+                        "page": page_no,
+                        "text": txt,
+                        "source":filename,
+                        "doc_id":doc_id,
+                        "extractor": extractor
+                    })
+
+            except AppException:
+                raise
             except Exception as e:
                 logger.error("failed to parse the file")
                 raise AppException(f"IngestionAgent.run: Error parsing '{pdf_path}'", error_detail=e)
         
         return {"documents": pages_data}
 
+    def _extract_document(self, pdf_path: str, backend_name: str) -> List[Tuple[int, str, str]]:
+        """
+        Return (page_number, text, backend_name) for every page of `pdf_path`.
+        Pure-Python backends run page by page on a worker thread so a single
+        page can be timed out and re-extracted with the fast backend.
+        """
+        auto = backend_name == "auto"
+        primary = get_backend(choose_backend(pdf_path) if auto else backend_name)
+        fast = BACKENDS["pdfium"]
+        timings: Dict[str, List[float]] = {}
+        results = []
+
+        def timed(backend, doc, index):
+            started = time.perf_counter()
+            text = backend.extract_page(doc, index)
+            timings.setdefault(backend.name, []).append(time.perf_counter() - started)
+            return text
+
+        fast_doc = fast.open(pdf_path)
+        try:
+            page_count = fast.page_count(fast_doc)
+            if primary is fast:
+                results = [(i + 1, timed(fast, fast_doc, i), fast.name) for i in range(page_count)]
+            else:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"extract-{primary.name}")
+                doc = primary.open(pdf_path)
+                downgraded = False
+                try:
+                    for i in range(page_count):
+                        if not downgraded:
+                            future = executor.submit(timed, primary, doc, i)
+                            try:
+                                results.append((i + 1, future.result(timeout=PAGE_TIMEOUT_S), primary.name))
+                                spent = timings[primary.name]
+                                if auto and len(spent) >= BUDGET_WARMUP_PAGES and sum(spent) / len(spent) > PAGE_TIME_BUDGET_S:
+                                    logger.info(
+                                        f"IngestionAgent: {primary.name} averaging {sum(spent) / len(spent):.2f}s/page "
+                                        f"on '{os.path.basename(pdf_path)}', switching to {fast.name}"
+                                    )
+                                    downgraded = True
+                                continue
+                            except FutureTimeout:
+                                logger.warning(
+                                    f"IngestionAgent: page {i + 1} of '{os.path.basename(pdf_path)}' exceeded "
+                                    f"{PAGE_TIMEOUT_S:g}s with {primary.name}; using {fast.name} for it"
+                                )
+                                # The stuck worker still owns `doc`: queue its close behind
+                                # the hung call and let that thread exit once it returns
+                                executor.submit(primary.close, doc)
+                                executor.shutdown(wait=False)
+                                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"extract-{primary.name}")
+                                doc = primary.open(pdf_path)
+                        results.append((i + 1, timed(fast, fast_doc, i), fast.name))
+                finally:
+                    executor.submit(primary.close, doc)
+                    executor.shutdown(wait=False)
+        finally:
+            fast.close(fast_doc)
+
+        self._record_throughput(pdf_path, timings)
+        return results
+
+    def _record_throughput(self, pdf_path: str, timings: Dict[str, List[float]]):
+        for name, spent in timings.items():
+            pages, seconds = len(spent), sum(spent)
+            with self._stats_lock:
+                stats = self.backend_stats.setdefault(name, {"pages": 0, "seconds": 0.0})
+                stats["pages"] += pages
+                stats["seconds"] += seconds
+                total_rate = stats["pages"] / stats["seconds"] if stats["seconds"] else 0.0
+            rate = pages / seconds if seconds else 0.0
+            logger.info(
+                f"IngestionAgent: {name} extracted {pages} pages of '{os.path.basename(pdf_path)}' "
+                f"in {seconds:.2f}s ({rate:.1f} pages/s; {total_rate:.1f} pages/s overall)"
+            )
+
 
 if __name__ == "__main__":
     # CLI interface: python agents/pdf/pdf_upload_agent.py path/to/file.pdf
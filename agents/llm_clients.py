@@ -0,0 +1,394 @@
+import argparse
+import contextvars
+import hashlib
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from common.deadline import MAX_QUERY_DEADLINE_S
+from common.exception import AppException
+from common.logging import logger
+
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env"))
+
+# "groq" (hosted Llama-4) or "stub" (local, deterministic; for offline and load testing)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+LLM_MODEL = os.getenv("LLM_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")
+# Connections kept open to the Groq API, shared by all concurrent generations
+LLM_POOL_CONNECTIONS = int(os.getenv("LLM_POOL_CONNECTIONS", "32"))
+LLM_POOL_KEEPALIVE_S = float(os.getenv("LLM_POOL_KEEPALIVE_S", "60"))
+# Hedging: when the first token hasn't arrived after the backend's recent
+# LLM_HEDGE_PERCENTILE time-to-first-token, send the same request again and
+# stream whichever answers first. Costs ~(100 - percentile)% extra calls.
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Floor on the hedge delay, and the samples needed before hedging starts
+LLM_HEDGE_MIN_DELAY_S = float(os.getenv("LLM_HEDGE_MIN_DELAY_S", "0.25"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Recent calls kept per backend for latency percentiles
+LLM_LATENCY_WINDOW = 500
+# Stub backend: time to first token, streaming rate, answer length, and a
+# share of calls that take LLM_STUB_SLOW_S longer (to exercise hedging)
+LLM_STUB_LATENCY_S = float(os.getenv("LLM_STUB_LATENCY_S", "0.2"))
+LLM_STUB_TOKENS_PER_S = float(os.getenv("LLM_STUB_TOKENS_PER_S", "50"))
+LLM_STUB_TOKENS = int(os.getenv("LLM_STUB_TOKENS", "40"))
+LLM_STUB_SLOW_RATE = float(os.getenv("LLM_STUB_SLOW_RATE", "0"))
+LLM_STUB_SLOW_S = float(os.getenv("LLM_STUB_SLOW_S", "2"))
+
+
+class LatencyStats:
+    """Rolling time-to-first-token / total latency of a backend's recent calls."""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self._first_token: deque = deque(maxlen=window)
+        self._total: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.tokens = 0
+
+    def record(self, first_token_s: Optional[float], total_s: Optional[float], tokens: int, error: bool = False):
+        with self._lock:
+            self.calls += 1
+            self.tokens += tokens
+            if error:
+                self.errors += 1
+                return
+            if first_token_s is not None:
+                self._first_token.append(first_token_s)
+            if total_s is not None:
+                self._total.append(total_s)
+
+    def samples(self) -> int:
+        with self._lock:
+            return len(self._first_token)
+
+    def percentile(self, p: float, metric: str = "first_token") -> Optional[float]:
+        with self._lock:
+            values = sorted(self._first_token if metric == "first_token" else self._total)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    def snapshot(self) -> Dict:
+        ms = lambda s: None if s is None else round(s * 1000, 1)
+        with self._lock:
+            counters = {"calls": self.calls, "errors": self.errors, "tokens": self.tokens}
+        return {
+            **counters,
+            "first_token_ms": {"p50": ms(self.percentile(50)), "p95": ms(self.percentile(95))},
+            "total_ms": {"p50": ms(self.percentile(50, "total")), "p95": ms(self.percentile(95, "total"))},
+        }
+
+
+class LLMClient:
+    """
+    A chat-completion backend. `stream` yields the answer text for one
+    system + user prompt and records the call's latency; subclasses
+    implement `_stream`.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self.latency = LatencyStats()
+
+    def stream(self, prompt: str, system: Optional[str] = None, timeout: Optional[float] = None) -> Iterator[str]:
+        """`timeout` (seconds) bounds the backend request, where it supports one."""
+        started = time.monotonic()
+        first_token, tokens, outcome = None, 0, "error"
+        try:
+            for text in self._stream(prompt, system, timeout):
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                tokens += 1
+                yield text
+            outcome = "ok"
+        except GeneratorExit:
+            # A caller that stops early (deadline, lost hedge) isn't an error,
+            # but its total time says nothing about the backend either
+            outcome = "abandoned"
+            raise
+        finally:
+            total = time.monotonic() - started if outcome == "ok" else None
+            self.latency.record(first_token, total, tokens, error=outcome == "error")
+
+    def _stream(self, prompt: str, system: Optional[str], timeout: Optional[float] = None) -> Iterator[str]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {"backend": self.name, **self.latency.snapshot()}
+
+    def close(self):
+        pass
+
+
+class GroqClient(LLMClient):
+    """
+    Groq chat completions over one long-lived httpx connection pool, so
+    concurrent and consecutive generations reuse warm TLS connections.
+    Without GROQ_API_KEY the client still constructs (the API can start
+    offline); each call then fails with 503.
+    """
+
+    name = "groq"
+
+    def __init__(self, model_name: str = LLM_MODEL, temperature: float = 0.5,
+                 pool_connections: int = LLM_POOL_CONNECTIONS, keepalive_s: float = LLM_POOL_KEEPALIVE_S):
+        super().__init__()
+        self.model_name = model_name
+        self.temperature = temperature
+        self.api_key = os.getenv("GROQ_API_KEY")
+        self._client = None
+        if not self.api_key:
+            logger.warning("GroqClient: GROQ_API_KEY not set; LLM calls will fail until it is (or use LLM_BACKEND=stub)")
+            return
+
+        import httpx
+        from groq import Groq
+        # No call needs to outlive the longest allowed request deadline
+        self._http = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=pool_connections,
+                max_keepalive_connections=pool_connections,
+                keepalive_expiry=keepalive_s,
+            ),
+            timeout=MAX_QUERY_DEADLINE_S,
+        )
+        # No SDK retries: a timed-out call is bounded by the caller's deadline,
+        # and re-sending it after the caller gave up only burns quota
+        self._client = Groq(
+            api_key=self.api_key, http_client=self._http, timeout=MAX_QUERY_DEADLINE_S, max_retries=0
+        )
+
+    def _stream(self, prompt: str, system: Optional[str], timeout: Optional[float] = None) -> Iterator[str]:
+        if self._client is None:
+            raise AppException("LLM backend not configured: GROQ_API_KEY not set", status_code=503)
+        messages = ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": prompt}]
+        stream = self._client.chat.completions.create(
+            model=self.model_name, messages=messages, temperature=self.temperature, stream=True,
+            timeout=MAX_QUERY_DEADLINE_S if timeout is None else min(timeout, MAX_QUERY_DEADLINE_S),
+        )
+        try:
+            for chunk in stream:
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if content:
+                    yield content
+        finally:
+            # Returns the connection to the pool even when abandoned mid-answer
+            stream.close()
+
+    def close(self):
+        if self._client is not None:
+            self._http.close()
+
+
+class StubLLMClient(LLMClient):
+    """
+    Offline stand-in that answers with the opening words of the passages
+    in the prompt. The answer depends only on the prompt; timing follows the
+    configured first-token latency and token rate, plus a seeded share of
+    slow calls.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency_s: float = LLM_STUB_LATENCY_S, tokens_per_s: float = LLM_STUB_TOKENS_PER_S,
+                 tokens: int = LLM_STUB_TOKENS, slow_rate: float = LLM_STUB_SLOW_RATE,
+                 slow_s: float = LLM_STUB_SLOW_S, seed: int = 0):
+        super().__init__()
+        self.latency_s = latency_s
+        self.tokens_per_s = tokens_per_s
+        self.tokens = tokens
+        self.slow_rate = slow_rate
+        self.slow_s = slow_s
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def answer(self, prompt: str) -> List[str]:
+        """The answer's tokens (words with their leading space)."""
+        passages = prompt.split("Passages:", 1)[-1].rsplit("Question:", 1)[0]
+        words = [
+            word
+            for line in passages.splitlines()
+            if not line.startswith("[Source:") and line.strip() != "---"
+            for word in line.split()
+        ]
+        if not words:
+            words = ["I", "don't", "know."]
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        words = [f"[stub {digest}]"] + words[: max(0, self.tokens - 1)]
+        return [words[0]] + [" " + w for w in words[1:]]
+
+    def _stream(self, prompt: str, system: Optional[str], timeout: Optional[float] = None) -> Iterator[str]:
+        with self._rng_lock:
+            slow = self._rng.random() < self.slow_rate
+        time.sleep(self.latency_s + (self.slow_s if slow else 0.0))
+        interval = 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+        for i, token in enumerate(self.answer(prompt)):
+            if i and interval:
+                time.sleep(interval)
+            yield token
+
+
+class HedgedClient(LLMClient):
+    """
+    Wraps a backend: if the first token hasn't arrived after the backend's
+    recent p`percentile` time-to-first-token, the same request is sent once
+    more and the answer comes from whichever attempt starts streaming
+    first; the other is abandoned. Until `min_samples` calls are recorded
+    nothing is hedged.
+    """
+
+    def __init__(self, backend: LLMClient, percentile: float = LLM_HEDGE_PERCENTILE,
+                 min_delay_s: float = LLM_HEDGE_MIN_DELAY_S, min_samples: int = LLM_HEDGE_MIN_SAMPLES):
+        super().__init__()
+        self.backend = backend
+        self.name = backend.name
+        self.percentile = percentile
+        self.min_delay_s = min_delay_s
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._hedged = 0
+        self._hedge_wins = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait for a first token before hedging, or None (don't)."""
+        if self.backend.latency.samples() < self.min_samples:
+            return None
+        return max(self.min_delay_s, self.backend.latency.percentile(self.percentile))
+
+    def stream(self, prompt: str, system: Optional[str] = None, timeout: Optional[float] = None) -> Iterator[str]:
+        # Latency is recorded per attempt by the backend
+        return self._stream(prompt, system, timeout)
+
+    def _stream(self, prompt: str, system: Optional[str], timeout: Optional[float] = None) -> Iterator[str]:
+        delay = self.hedge_delay()
+        if delay is None:
+            yield from self.backend.stream(prompt, system, timeout)
+            return
+        # Both attempts are bounded by the caller's deadline
+        expires_at = None if timeout is None else time.monotonic() + timeout
+
+        events: queue.Queue = queue.Queue()
+        cancelled = [threading.Event(), threading.Event()]
+        self._start(0, prompt, system, events, cancelled[0], expires_at)
+        winner, attempts, failures = None, 1, 0
+        try:
+            try:
+                attempt, kind, value = events.get(timeout=delay)
+            except queue.Empty:
+                with self._lock:
+                    self._hedged += 1
+                logger.info(f"HedgedClient: no first token from '{self.name}' after {delay:.2f}s; hedging")
+                self._start(1, prompt, system, events, cancelled[1], expires_at)
+                attempts = 2
+                attempt, kind, value = events.get()
+            while True:
+                if winner is None:
+                    if kind == "error":
+                        # Wait for the other attempt, if there is one
+                        failures += 1
+                        if failures == attempts:
+                            raise value
+                        attempt, kind, value = events.get()
+                        continue
+                    winner = attempt
+                    cancelled[1 - attempt].set()
+                    if attempt == 1:
+                        with self._lock:
+                            self._hedge_wins += 1
+                if attempt == winner:
+                    if kind == "text":
+                        yield value
+                    elif kind == "error":
+                        raise value
+                    else:
+                        return
+                attempt, kind, value = events.get()
+        finally:
+            for event in cancelled:
+                event.set()
+
+    def _start(self, attempt: int, prompt: str, system: Optional[str], events: queue.Queue,
+               cancelled: threading.Event, expires_at: Optional[float]):
+        # Run in the caller's context so the attempt logs under its trace
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._pump, attempt, prompt, system, events, cancelled, expires_at),
+            name=f"llm-hedge-{attempt}", daemon=True,
+        ).start()
+
+    def _pump(self, attempt: int, prompt: str, system: Optional[str], events: queue.Queue,
+              cancelled: threading.Event, expires_at: Optional[float]):
+        timeout = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+        stream = self.backend.stream(prompt, system, timeout)
+        try:
+            for text in stream:
+                if cancelled.is_set():
+                    return
+                events.put((attempt, "text", text))
+            events.put((attempt, "end", None))
+        except Exception as e:
+            events.put((attempt, "error", e))
+        finally:
+            stream.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hedging = {"hedged": self._hedged, "hedge_wins": self._hedge_wins}
+        delay = self.hedge_delay()
+        hedging["delay_ms"] = None if delay is None else round(delay * 1000, 1)
+        return {**self.backend.stats(), "hedging": hedging}
+
+    def close(self):
+        self.backend.close()
+
+
+def load_llm_client(backend: Optional[str] = None, model_name: str = LLM_MODEL, temperature: float = 0.5,
+                    hedge: bool = LLM_HEDGE) -> LLMClient:
+    """
+    Return the LLM client for `backend` ("groq" or "stub"), wrapped in a
+    HedgedClient when `hedge` is set.
+    """
+    backend = backend or LLM_BACKEND
+    if backend == "groq":
+        client = GroqClient(model_name=model_name, temperature=temperature)
+    elif backend == "stub":
+        client = StubLLMClient()
+    else:
+        raise AppException(f"Unknown LLM backend '{backend}', expected 'groq' or 'stub'", status_code=500)
+    return HedgedClient(client) if hedge else client
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python -m agents.llm_clients bench --backend stub --calls 50 --concurrency 8 [--hedge]
+    from concurrent.futures import ThreadPoolExecutor
+    import json
+
+    parser = argparse.ArgumentParser(description="Measure an LLM backend's latency")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--backend", default=LLM_BACKEND)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--hedge", action="store_true", default=LLM_HEDGE)
+    parser.add_argument("--prompt", default="Passages:\nThe quick brown fox jumps over the lazy dog.\n\nQuestion: What jumps?\nAnswer:")
+    args = parser.parse_args()
+
+    llm = load_llm_client(args.backend, hedge=args.hedge)
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda _: "".join(llm.stream(args.prompt)), range(args.calls)))
+    except AppException as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    print(json.dumps({**llm.stats(), "seconds": round(time.monotonic() - started, 2)}, indent=2))
+    llm.close()
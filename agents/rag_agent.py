@@ -1,33 +1,46 @@
-from typing import List, Dict
+from typing import Dict, Iterator, List, Optional
 from agno.agent import Agent
-from agno.models.groq import Groq 
+from agents.llm_clients import LLM_MODEL, LLMClient, load_llm_client
 from agents.retrieval_agent import RetrievalAgent
+from common.deadline import DeadlineExceeded
 from common.exception import AppException
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import os
-from dotenv import load_dotenv
+import queue
+import threading
+import time
 from common.logging import logger
 
+# Budget for passage text in the prompt, in embedding-tokenizer tokens (the
+# chunks' stored token_count); WordPiece and the LLM's tokenizer are close
+# enough in size for budgeting purposes
+MAX_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "3000"))
+# Allowance for each passage's "[Source: ... | Page: ...]" header and separator
+CONTEXT_HEADER_TOKENS = 16
+# Threads that consume LLM streams for deadline-bound calls; an abandoned
+# call frees its thread at the next streamed chunk, or at the client timeout
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "16"))
+_GENERATION_POOL = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+
 class LLMAgent(Agent):
     def __init__(
         self,
-        model_name: str = "meta-llama/llama-4-scout-17b-16e-instruct",
+        model_name: str = LLM_MODEL,
         temperature: float = 0.5,
-        
+        max_context_tokens: int = MAX_CONTEXT_TOKENS,
+        backend: Optional[str] = None,
+        llm_client: Optional[LLMClient] = None,
     ):
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        env_path = os.path.join(base_dir, ".env")
-        print(base_dir)
-        load_dotenv(env_path) 
-        
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise ValueError("GROQ_API_KEY not set in environment.")
-
-        print(groq_api_key)
+        """
+        Generation goes through `llm_client`, by default the LLM_BACKEND
+        client ("groq", or "stub" to run without network or API key).
+        """
+        self.max_context_tokens = max_context_tokens
+        self.llm_client = llm_client or load_llm_client(backend, model_name=model_name, temperature=temperature)
 
         super().__init__(
             name="LLM Answer Agent",
-            model= Groq(id=model_name, temperature=temperature,api_key=groq_api_key),
             role="Generate a concise answer to the user query based on provided contexts.",
             markdown=True,
             instructions=[
@@ -38,7 +51,7 @@ class LLMAgent(Agent):
             ]
         )
 
-    def run(self, query: str, contexts: List[Dict]) -> Dict:
+    def _build_prompt(self, query: str, contexts: List[Dict], history: Optional[str] = None) -> str:
         if not query.strip():
             raise AppException("Query must be a non-empty string.")
         
@@ -46,34 +59,128 @@ class LLMAgent(Agent):
             raise AppException("No context provided for LLM generation", status_code=400)
 
         context_blocks = []
-        for c in contexts:
+        for c in self._pack(contexts):
             source = c.get('source', 'Unknown Source')
             page_number = c.get('page_number', 'Unknown Page')
+            page_end = c.get('page_end')
+            if page_end and page_end != page_number:
+                page_number = f"{page_number}-{page_end}"
             text = c.get('text', '')
             header = f"[Source: {source} | Page: {page_number}]"
             context_blocks.append(f"{header}\n{text}")
 
-        prompt = (
+        # Earlier turns only help resolve what a follow-up refers to
+        conversation = (
+            "Conversation so far (use it only to understand what the question refers to):\n"
+            f"{history}\n\n"
+        ) if history else ""
+        return (
             "You are a helpful assistant. Use the following extracted passages to answer the user's question."
             "If the answer is not contained within the passages, reply with “I don't know.”\n\n"
-            "Passages:\n"
+            + conversation
+            + "Passages:\n"
             + "\n\n---\n\n".join(context_blocks)
             + f"\n\nQuestion: {query}\nAnswer:"
         )
 
-        # 2. Call LLM
+    def run(self, query: str, contexts: List[Dict], timeout: Optional[float] = None,
+            history: Optional[str] = None) -> Dict:
+        """
+        Answer `query` from `contexts`, with `history` (earlier turns of a
+        chat session, already compacted) as conversational context. With a
+        `timeout` (seconds), raises DeadlineExceeded when the answer isn't
+        complete in time.
+        """
+        return {"answer": "".join(self.generate_stream(query, contexts, timeout=timeout, history=history)).strip()}
+
+    def generate_stream(self, query: str, contexts: List[Dict], timeout: Optional[float] = None,
+                        history: Optional[str] = None) -> Iterator[str]:
+        """
+        Same prompt as `run`, but yields the answer text as the model
+        produces it. With a `timeout`, the model is consumed on a worker
+        thread and DeadlineExceeded is raised once it runs out; the worker
+        then stops reading and closes the model stream, as it also does when
+        the caller stops iterating early.
+        """
+        prompt = self._build_prompt(query, contexts, history)
+        if timeout is None:
+            yield from self._stream_prompt(prompt)
+            return
+
+        expires_at = time.monotonic() + timeout
+        events: queue.Queue = queue.Queue()
+        cancelled = threading.Event()
+        # Run in the caller's context so the worker logs under its trace
+        _GENERATION_POOL.submit(contextvars.copy_context().run, self._pump, prompt, events, cancelled, expires_at)
         try:
-            response = super().run(prompt)
-            answer = response.content.strip()
+            while True:
+                try:
+                    kind, value = events.get(timeout=max(0.0, expires_at - time.monotonic()))
+                except queue.Empty:
+                    raise DeadlineExceeded(f"LLM generation did not finish within {timeout:g}s")
+                if kind == "text":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            cancelled.set()
+
+    def _system_prompt(self) -> str:
+        return "\n".join([self.role] + [f"- {line}" for line in self.instructions])
+
+    def _stream_prompt(self, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        try:
+            yield from self.llm_client.stream(prompt, system=self._system_prompt(), timeout=timeout)
+        except AppException:
+            raise
         except Exception as e:
-            logger.error("Failed to generate a response", e)
+            logger.error(f"Failed to stream a response: {e}")
             raise AppException(
-                message="Failed to generate answer", 
+                message="Failed to generate answer",
                 status_code=500,
                 error_detail=e
-        )
+            )
 
-        return {"answer": answer}
+    def _pump(self, prompt: str, events: queue.Queue, cancelled: threading.Event, expires_at: float):
+        # The call may have waited in the pool for a free worker; don't send
+        # a request nobody is waiting for anymore
+        remaining = expires_at - time.monotonic()
+        if cancelled.is_set() or remaining <= 0:
+            logger.info("LLMAgent: caller gave up while queued, skipping generation")
+            return
+        # Bound the HTTP request itself by what is left of the deadline
+        stream = self._stream_prompt(prompt, timeout=remaining)
+        try:
+            for text in stream:
+                if cancelled.is_set():
+                    logger.info("LLMAgent: caller gave up, abandoning generation")
+                    return
+                events.put(("text", text))
+            events.put(("end", None))
+        except Exception as e:
+            events.put(("error", e))
+        finally:
+            stream.close()
+
+    def _pack(self, contexts: List[Dict]) -> List[Dict]:
+        """
+        Keep contexts, in ranked order, while they fit the prompt budget. Sizes
+        come from the token_count stored at ingestion, so nothing is
+        re-tokenized here; legacy chunks without it fall back to ~4 chars/token.
+        """
+        packed, used = [], 0
+        for c in contexts:
+            tokens = c.get('token_count') or len(c.get('text', '')) // 4
+            tokens += CONTEXT_HEADER_TOKENS
+            if packed and used + tokens > self.max_context_tokens:
+                continue
+            packed.append(c)
+            used += tokens
+        if len(packed) < len(contexts):
+            logger.info(f"LLMAgent: packed {len(packed)}/{len(contexts)} contexts into {used} tokens")
+        return packed
 
 
 if __name__ == "__main__":
@@ -1,18 +1,50 @@
 import logging
-from typing import List, Dict, Optional
+import math
+import os
+import time
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 from agno.agent import Agent
-from sentence_transformers import SentenceTransformer
 from qdrant_client import QdrantClient
+from agents.encoders import load_encoder
+from common.cache import TTLCache
+from common.config import COLLECTION_NAME
 from common.exception import AppException
-from common.logging import logger
+from common.logging import hot_logger
+from common.qdrant_utils import build_filter, chunk_point_id
+from common.scheduler import INTERACTIVE, PriorityScheduler, slot
+
+# Most hits a search may return, whatever the caller asks for; adaptive
+# searches (no top_k) fetch this many and cut the list down
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "10"))
+# Similarity floor, pushed down to Qdrant as score_threshold (cosine; 0 = off)
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.25"))
+# Adaptive mode stops at the first hit scoring this much (relative) below
+# the one before it, but always keeps RETRIEVAL_MIN_K hits that passed the floor
+RETRIEVAL_SCORE_GAP = float(os.getenv("RETRIEVAL_SCORE_GAP", "0.25"))
+RETRIEVAL_MIN_K = int(os.getenv("RETRIEVAL_MIN_K", "1"))
+# Small-to-big retrieval: each hit is widened to this many neighbouring
+# chunks on either side (0 = return the matched chunks only) ...
+EXPAND_WINDOW = int(os.getenv("RETRIEVAL_EXPAND_WINDOW", "1"))
+# ... or, with "page", to every chunk of the page(s) it sits on
+EXPAND_MODE = os.getenv("RETRIEVAL_EXPAND_MODE", "chunks")
+# Payload needed to stitch neighbours together
+_STITCH_FIELDS = ["text", "page_number", "page_end", "token_count", "chunk_index", "overlap_chars", "overlap_tokens"]
+
 
 class RetrievalAgent(Agent):
     def __init__(self, 
-                collection_name: str = "pdf_chunks",
+                collection_name: str = COLLECTION_NAME,
                 qdrant_client: Optional[QdrantClient] = None,
-                 
+                embedding_model=None,
+                scheduler: Optional[PriorityScheduler] = None,
+                embedding_cache: Optional[TTLCache] = None,
     ):
         self.collection_name = collection_name
+        # Encoder + Qdrant work is admitted as interactive when a scheduler is shared
+        self.scheduler = scheduler
+        # Query vectors by whitespace-normalized text, when the caller keeps a cache
+        self.embedding_cache = embedding_cache
 
         
 
@@ -20,8 +52,8 @@ class RetrievalAgent(Agent):
             name="Semantic Retrieval Agent",
             role="Encode user query and fetch top-K similar text chunks from Qdrant.",
             instructions=[
-                "Encode the free‑form query via the same SentenceTransformer model used for embedding.",
-                "Call QdrantClient.search with the query vector and limit=top_k.",
+                "Encode the free‑form query via the same encoder used for embedding.",
+                "Call QdrantClient.search with the query vector, limit=top_k, the minimum score and any tenant/doc_id/source filter.",
                 "Extract `payload` and `score` from each hit, returning structured results."
             ]
         )
@@ -42,34 +74,74 @@ class RetrievalAgent(Agent):
                     status_code=500
                 )
         # 2. Initialize embedding model (same as VectorEmbeddingAgent)
-        try:
-            self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-        except Exception as e:
-            raise AppException("RetrievalAgent: Unable to load SentenceTransformer model", error_detail=e)
+        self.embedding_model = embedding_model if embedding_model is not None else load_encoder()
+
+    def run(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        tenant: Optional[str] = None,
+        doc_ids: Optional[List[str]] = None,
+        sources: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        window: Optional[int] = None,
+        work_class: str = INTERACTIVE,
+    ) -> Dict:
+        """
+        `timeout` (seconds) bounds the wait for a scheduler slot plus the
+        Qdrant search; Qdrant takes whole seconds, so it is rounded up.
+        Raises Overloaded when no slot frees up in time.
+
+        Hits scoring under RETRIEVAL_MIN_SCORE are never returned. With
+        `top_k` the best `top_k` (at most RETRIEVAL_MAX_K) of the rest are;
+        without it, retrieval is adaptive: the list is cut at the first large
+        relative drop in score (see `_cutoff`), so easy questions carry fewer
+        passages into the prompt.
 
-    def run(self, query: str, top_k: int = 5) -> Dict:
+        `window` overrides RETRIEVAL_EXPAND_WINDOW for this call (see `expand`).
+        `work_class` is the scheduler class the work is admitted under
+        (BULK for background cache warm-up).
+        """
         if not isinstance(query, str) or not query.strip():
             raise AppException("RetrievalAgent.run: Query must be a non-empty string")
 
-        # 1. Compute the query embedding
-        try:
-            query_vector = self.embedding_model.encode(query).tolist()
-        except Exception as e:
-            raise AppException("RetrievalAgent: Embedding computation failed", error_detail=e)
+        # Restrict the search to the requested tenant / documents (payload-indexed)
+        query_filter = build_filter(tenant=tenant, doc_ids=doc_ids, sources=sources)
 
-        # 2. Perform search in Qdrant
-        try:
-            hits = self.qdrant_client.search(
-                collection_name=self.collection_name,
-                query_vector=query_vector,
-                limit=top_k,
-                with_payload=True,
-                
-            )
-        except Exception as e:
-            raise AppException("RetrievalAgent: Qdrant search failed", error_detail=e)
+        limit = RETRIEVAL_MAX_K if top_k is None else max(1, min(top_k, RETRIEVAL_MAX_K))
+
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        with slot(self.scheduler, work_class, timeout=timeout):
+            # 1. Compute the query embedding (or reuse a cached one)
+            query_vector = self._embed(query)
+
+            # 2. Perform search in Qdrant
+            search_timeout = None
+            if expires_at is not None:
+                search_timeout = max(1, math.ceil(expires_at - time.monotonic()))
+            try:
+                hits = self.qdrant_client.search(
+                    collection_name=self.collection_name,
+                    query_vector=query_vector,
+                    query_filter=query_filter,
+                    limit=limit,
+                    with_payload=True,
+                    score_threshold=RETRIEVAL_MIN_SCORE or None,
+                    timeout=search_timeout,
+                )
+            except Exception as e:
+                raise AppException("RetrievalAgent: Qdrant search failed", error_detail=e)
+            if top_k is None:
+                hits = _cutoff(hits, RETRIEVAL_SCORE_GAP, RETRIEVAL_MIN_K)
+
+            # 3. Widen the matched chunks to their neighbours: overlapping
+            #    spans are merged first, then every chunk they cover is
+            #    fetched in one lookup by point ID (no further searches)
+            window = EXPAND_WINDOW if window is None else window
+            spans = _spans(hits, window) if window > 0 else []
+            chunks = self._fetch_chunks(spans, expires_at) if spans else {}
 
-        # 3. Parse hits into list of dicts
+        # 4. Parse hits into list of dicts
         results = []
         for hit in hits:
             payload = hit.payload or {}
@@ -77,16 +149,195 @@ class RetrievalAgent(Agent):
             results.append({
                 "text": payload.get("text", ""),
                 "page_number": payload.get("page_number"),
+                "page_end": payload.get("page_end", payload.get("page_number")),
+                "token_count": payload.get("token_count"),
                 "chunk_index": payload.get("chunk_index"),
                 "score": score,
                 "chunk_id": payload.get("chunk_id"),
                 "doc_id": payload.get("doc_id"),
                 "source":payload.get("source"),
+                "point_id": str(hit.id),
             })
 
-        logger.info(f"RetrievalAgent: Retrieved {len(results)} results for query '{query}'")
+        if spans:
+            results = _expand(results, spans, chunks)
+
+        # Runs on every query: sampled, and without the query text itself
+        hot_logger.debug(
+            f"RetrievalAgent: retrieved {len(results)} results",
+            extra={"query_chars": len(query), "hits": len(hits), "scores": [round(r["score"], 3) for r in results]},
+        )
         return {"results":results}
 
+    def rerank(
+        self,
+        query: str,
+        contexts: List[Dict],
+        timeout: Optional[float] = None,
+        work_class: str = INTERACTIVE,
+    ) -> List[Dict]:
+        """
+        Re-score earlier results against a new `query` without searching:
+        the vectors of their matched chunks are fetched in one lookup by
+        point ID and compared with the query's. Results whose chunk is gone
+        (document deleted or replaced since) are dropped; the rest come back
+        best first, with `score` replaced.
+        """
+        ids = [c["point_id"] for c in contexts if c.get("point_id")]
+        if not ids:
+            return []
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        with slot(self.scheduler, work_class, timeout=timeout):
+            query_vector = np.asarray(self._embed(query), dtype=np.float32)
+            fetch_timeout = None
+            if expires_at is not None:
+                fetch_timeout = max(1, math.ceil(expires_at - time.monotonic()))
+            try:
+                records = self.qdrant_client.retrieve(
+                    collection_name=self.collection_name,
+                    ids=ids,
+                    with_payload=False,
+                    with_vectors=True,
+                    timeout=fetch_timeout,
+                )
+            except Exception as e:
+                raise AppException("RetrievalAgent: Chunk vector lookup failed", error_detail=e)
+
+        vectors = {str(record.id): np.asarray(record.vector, dtype=np.float32) for record in records}
+        query_norm = float(np.linalg.norm(query_vector)) or 1.0
+        rescored = []
+        for c in contexts:
+            vector = vectors.get(c.get("point_id"))
+            if vector is None:
+                continue
+            score = float(vector @ query_vector) / ((float(np.linalg.norm(vector)) or 1.0) * query_norm)
+            rescored.append(dict(c, score=score))
+        rescored.sort(key=lambda r: r["score"], reverse=True)
+        return rescored
+
+    def _embed(self, query: str) -> List[float]:
+        """The query's embedding, from the cache when the caller keeps one."""
+        cache_key = " ".join(query.split())
+        query_vector = self.embedding_cache.get(cache_key) if self.embedding_cache is not None else None
+        if query_vector is None:
+            try:
+                query_vector = self.embedding_model.encode(query).tolist()
+            except Exception as e:
+                raise AppException("RetrievalAgent: Embedding computation failed", error_detail=e)
+            if self.embedding_cache is not None:
+                self.embedding_cache.put(cache_key, query_vector)
+        return query_vector
+
+    def _fetch_chunks(self, spans: List[Dict], expires_at: Optional[float]) -> Dict[str, Dict]:
+        """Payloads of every chunk covered by `spans`, keyed by point ID."""
+        ids = [
+            chunk_point_id(span["doc_id"], span["revision"], index)
+            for span in spans for index in range(span["lo"], span["hi"] + 1)
+        ]
+        fetch_timeout = None
+        if expires_at is not None:
+            fetch_timeout = max(1, math.ceil(expires_at - time.monotonic()))
+        try:
+            records = self.qdrant_client.retrieve(
+                collection_name=self.collection_name,
+                ids=ids,
+                with_payload=_STITCH_FIELDS,
+                with_vectors=False,
+                timeout=fetch_timeout,
+            )
+        except Exception as e:
+            raise AppException("RetrievalAgent: Neighbour chunk lookup failed", error_detail=e)
+        return {str(record.id): record.payload or {} for record in records}
+
+
+def _cutoff(hits, gap: float, min_k: int):
+    """
+    Keep hits (best first) until one scores more than `gap`, relative to
+    the hit before it, below that hit; everything from there on is filler.
+    The first `min_k` hits are always kept.
+    """
+    for i in range(max(1, min_k), len(hits)):
+        previous = hits[i - 1].score
+        if previous > 0 and (previous - hits[i].score) / previous > gap:
+            hot_logger.debug(f"RetrievalAgent: score cutoff after {i}/{len(hits)} hits")
+            return hits[:i]
+    return hits
+
+
+def _spans(hits, window: int) -> List[Dict]:
+    """
+    Chunk index ranges the hits widen to, with ranges of the same document
+    revision that overlap or touch merged into one. Each span lists the
+    hits it covers (by position). Points ingested before chunk adjacency
+    was stored have no span and are returned as they are.
+    """
+    by_doc: Dict[Tuple[str, str], List[Dict]] = {}
+    for position, hit in enumerate(hits):
+        payload = hit.payload or {}
+        index, count = payload.get("chunk_index"), payload.get("chunk_count")
+        if index is None or count is None or not payload.get("revision"):
+            continue
+        if EXPAND_MODE == "page" and payload.get("page_chunks"):
+            lo, hi = payload["page_chunks"]
+        else:
+            lo, hi = max(0, index - window), min(count - 1, index + window)
+        by_doc.setdefault((payload["doc_id"], payload["revision"]), []).append(
+            {"lo": lo, "hi": hi, "hits": [position]}
+        )
+
+    spans = []
+    for (doc_id, revision), ranges in by_doc.items():
+        ranges.sort(key=lambda r: r["lo"])
+        current = ranges[0]
+        for r in ranges[1:]:
+            if r["lo"] <= current["hi"] + 1:
+                current["hi"] = max(current["hi"], r["hi"])
+                current["hits"].extend(r["hits"])
+            else:
+                spans.append(dict(current, doc_id=doc_id, revision=revision))
+                current = r
+        spans.append(dict(current, doc_id=doc_id, revision=revision))
+    return spans
+
+
+def _expand(results: List[Dict], spans: List[Dict], chunks: Dict[str, Dict]) -> List[Dict]:
+    """
+    One result per span: the best-scoring hit in it, with its text replaced
+    by the span's chunks stitched in order (overlap between consecutive
+    chunks dropped). Hits merged into another's span are not repeated.
+    """
+    expanded = [r for position, r in enumerate(results) if not any(position in s["hits"] for s in spans)]
+    for span in spans:
+        best = max(span["hits"], key=lambda position: results[position]["score"])
+        parts, tokens, pages, previous = [], 0, [], None
+        for index in range(span["lo"], span["hi"] + 1):
+            chunk = chunks.get(chunk_point_id(span["doc_id"], span["revision"], index))
+            if not chunk:
+                # Gone since the search (document replaced or deleted)
+                previous = None
+                continue
+            text, chunk_tokens = chunk.get("text", ""), chunk.get("token_count") or 0
+            if previous == index - 1:
+                text = text[chunk.get("overlap_chars") or 0:]
+                chunk_tokens -= chunk.get("overlap_tokens") or 0
+            parts.append(text.strip())
+            tokens += chunk_tokens
+            pages += [chunk.get("page_number"), chunk.get("page_end", chunk.get("page_number"))]
+            previous = index
+        pages = [p for p in pages if p is not None]
+        if not parts:
+            expanded.append(results[best])
+            continue
+        expanded.append(dict(
+            results[best],
+            text=" ".join(p for p in parts if p),
+            page_number=min(pages) if pages else results[best]["page_number"],
+            page_end=max(pages) if pages else results[best]["page_end"],
+            token_count=tokens,
+            chunk_span=[span["lo"], span["hi"]],
+        ))
+    expanded.sort(key=lambda r: r["score"], reverse=True)
+    return expanded
 
 if __name__ == "__main__":
   
@@ -3,27 +3,46 @@ import uuid
 from typing import List, Dict,Optional
 from agno.agent import Agent
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import PointStruct, VectorParams
-from sentence_transformers import SentenceTransformer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from qdrant_client.http.models import PointStruct
 
+from agents.chunker import DocumentChunker
+from agents.encoders import load_encoder
+from common.config import COLLECTION_NAME, DEFAULT_TENANT
 from common.exception import AppException
 from common.logging import logger
+from common.qdrant_utils import chunk_point_id, ensure_collection, ensure_payload_indexes
+from common.scheduler import BULK, PriorityScheduler, slot
+from common.write_gate import WriteGate, writing
 
 
 class VectorEmbeddingAgent(Agent):
 
-    def __init__(self, collection_name: str = "pdf_chunks",qdrant_client: Optional[QdrantClient] = None,):
+    def __init__(
+        self,
+        collection_name: str = COLLECTION_NAME,
+        qdrant_client: Optional[QdrantClient] = None,
+        embedding_model=None,
+        scheduler: Optional[PriorityScheduler] = None,
+        encode_batch_size: int = 64,
+        write_gate: Optional[WriteGate] = None,
+    ):
         self.collection_name = collection_name
+        # With a shared scheduler, each encode/upsert batch is admitted as bulk
+        # work, so queries can run between the batches of a large ingestion
+        self.scheduler = scheduler
+        # Upserts wait while a re-index switches collections
+        self.write_gate = write_gate
+        self.encode_batch_size = encode_batch_size
         self._collection_checked = False
         
         super().__init__(
             name="Vector Embedding Agent",
             role="Chunk text and embed with SentenceTransformer, then store in Qdrant.",
             instructions=[
-                "Use RecursiveCharacterTextSplitter to split each page.text into overlapping chunks.",
-                "Embed each chunk via SentenceTransformer.",
-                "Prepare Qdrant PointStructs with vector and payload {text, page_number, source, chunk_id}.",
+                "Use DocumentChunker to split each document's page stream into token-sized, structure-aware chunks.",
+                "Embed the chunks in batches via the configured encoder (PyTorch or int8 ONNX).",
+                "Prepare Qdrant PointStructs with vector and payload {text, page_number, page_end, token_count, source, tenant, chunk_id}.",
+                "Derive point IDs from (doc_id, revision, chunk_index) so neighbouring chunks can be fetched by ID.",
                 "Recreate the Qdrant collection to ensure idempotency."
             ]
         )
@@ -43,28 +62,24 @@ class VectorEmbeddingAgent(Agent):
                     status_code=500
                 )
             
-        try:
-            self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-        except Exception as e:
-            raise AppException(
-                "VectorEmbeddingAgent: Unable to load SentenceTransformer model",
-                error_detail=e,
-                status_code=500
-            )
+        # Shared with RetrievalAgent when passed in; ENCODER_BACKEND picks torch or onnx
+        self.embedding_model = embedding_model if embedding_model is not None else load_encoder()
+
+        # Chunks are sized in the model's own tokens; the window includes [CLS]/[SEP]
+        self.chunker = DocumentChunker(
+            self.embedding_model.tokenizer,
+            max_tokens=self.embedding_model.max_seq_length - 2,
+        )
 
     def _ensure_collection(self):
         if not self._collection_checked:
             # Attempt to create or verify the collection, with a try/except
             try:
-                exists = self.qdrant_client.collection_exists(self.collection_name)
-                if not exists:
-                    self.qdrant_client.create_collection(
-                        collection_name=self.collection_name,
-                        vectors_config=VectorParams(size=384, distance="Cosine"),
-                        )
-                    logger.info(f"Created Qdrant collection '{self.collection_name}' with 384 dim, Cosine.")
-                else:
-                    logger.info(f"Qdrant collection '{self.collection_name}' already exists.")
+                target = ensure_collection(self.qdrant_client, self.collection_name)
+                logger.info(f"Qdrant collection '{self.collection_name}' resolves to '{target}'.")
+                ensure_payload_indexes(self.qdrant_client, target)
+            except AppException:
+                raise
             except Exception as e:
                 raise AppException(
                     f"VectorEmbeddingAgent: Error ensuring Qdrant collection '{self.collection_name}'", status_code=500 ,error_detail=e
@@ -74,71 +89,115 @@ class VectorEmbeddingAgent(Agent):
 
 
 
-    def run(self, pages_data: List[Dict], batch_size: int = 64) -> Dict:
-        self._ensure_collection()
+    def build_points(
+        self,
+        pages_data: List[Dict],
+        tenant: Optional[str] = None,
+        revision: Optional[str] = None,
+    ) -> List[PointStruct]:
+        """
+        Chunk and embed `pages_data` into PointStructs without writing them.
+        Every point carries `revision`, which identifies this ingestion of the
+        document and lets a replace drop the previous revision's points.
+        """
         if not isinstance(pages_data, list) or len(pages_data) == 0:
-            raise AppException("VectorEmbeddingAgent.run: pages_data must be a non-empty list")
-
-        all_points = []
-        try:
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        except Exception as e:
-            raise AppException("VectorEmbeddingAgent: Failed to initialize text splitter", error_detail=e)
+            raise AppException("VectorEmbeddingAgent.build_points: pages_data must be a non-empty list")
+        tenant = tenant or DEFAULT_TENANT
+        revision = revision or str(uuid.uuid4())
 
-        total_chunks = 0
-
-        # 4. Iterate over each page's text
+        # 4. Group pages per document, keeping page order
+        documents: Dict[str, List[Dict]] = {}
         for page_dict in pages_data:
-            page_num = page_dict.get("page")
-            page_text = page_dict.get("text", "")
-            doc_name = page_dict.get("source")
-            doc_id = page_dict.get("doc_id")
-
-            # Skip pages with empty text
-            if not page_text.strip():
-                logger.debug(f"Page {page_num} is blank. Skipping.")
+            if not (page_dict.get("text") or "").strip():
+                logger.debug(f"Page {page_dict.get('page')} is blank. Skipping.")
                 continue
+            documents.setdefault(page_dict.get("doc_id"), []).append(page_dict)
 
-            # 5. Split page_text into documents/chunks
+        # 5. Chunk each document over its whole page stream
+        chunks = []
+        for doc_id, pages in documents.items():
+            pages.sort(key=lambda p: p.get("page") or 0)
+            doc_name = pages[0].get("source")
             try:
-                docs = text_splitter.create_documents([page_text])
+                doc_chunks = self.chunker.chunk_document(pages)
             except Exception as e:
-                raise AppException(f"VectorEmbeddingAgent: Text splitting failed on page {page_num}", error_detail=e)
-
-            # 6. For each chunk, generate an embedding and prepare a PointStruct
-            for idx, doc in enumerate(docs):
-                chunk_text = doc.page_content
-                try:
-                    vector = self.embedding_model.encode(chunk_text).tolist()
-                except Exception as e:
-                    raise AppException("VectorEmbeddingAgent: Embedding computation failed", error_detail=e)
-
-                point = PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=vector,
-                    payload={
-                        "text": chunk_text,
-                        "page_number": page_num,
-                        "source": doc_name,
-                        "doc_id": doc_id,
-                        "chunk_id": f"{doc_name}_p{page_num}_c{idx}",
-                        "chunk_index": idx
-                    },
-                )
-                all_points.append(point)
-                total_chunks += 1
+                raise AppException(f"VectorEmbeddingAgent: Chunking failed for '{doc_name}'", error_detail=e)
+            # Per page, the first and last chunk touching it, so a hit can be
+            # widened to whole pages at query time
+            page_chunks: Dict[int, List[int]] = {}
+            for idx, chunk in enumerate(doc_chunks):
+                for page in range(chunk["page_start"], chunk["page_end"] + 1):
+                    page_chunks.setdefault(page, [idx, idx])[1] = idx
+            for idx, chunk in enumerate(doc_chunks):
+                pages_span = [page_chunks[page] for page in range(chunk["page_start"], chunk["page_end"] + 1)]
+                chunks.append({
+                    "text": chunk["text"],
+                    "page_number": chunk["page_start"],
+                    "page_end": chunk["page_end"],
+                    "token_count": chunk["token_count"],
+                    "source": doc_name,
+                    "doc_id": doc_id,
+                    "tenant": tenant,
+                    "revision": revision,
+                    "chunk_id": f"{doc_name}_p{chunk['page_start']}_c{idx}",
+                    "chunk_index": idx,
+                    "chunk_count": len(doc_chunks),
+                    "page_chunks": [min(lo for lo, _ in pages_span), max(hi for _, hi in pages_span)],
+                    "overlap_chars": chunk["overlap_chars"],
+                    "overlap_tokens": chunk["overlap_tokens"],
+                })
+
+        if not chunks:
+            return []
+
+        # 6. Embed all chunks in batches and prepare PointStructs
+        texts = [c["text"] for c in chunks]
+        vectors = []
+        try:
+            for i in range(0, len(texts), self.encode_batch_size):
+                with slot(self.scheduler, BULK):
+                    vectors.extend(self.embedding_model.encode(
+                        texts[i : i + self.encode_batch_size], batch_size=self.encode_batch_size
+                    ))
+        except AppException:
+            raise
+        except Exception as e:
+            raise AppException("VectorEmbeddingAgent: Embedding computation failed", error_detail=e)
+
+        all_points = [
+            PointStruct(
+                id=chunk_point_id(payload["doc_id"], revision, payload["chunk_index"]),
+                vector=vector.tolist(),
+                payload=payload,
+            )
+            for payload, vector in zip(chunks, vectors)
+        ]
+        return all_points
+
+    def run(
+        self,
+        pages_data: List[Dict],
+        batch_size: int = 64,
+        tenant: Optional[str] = None,
+        revision: Optional[str] = None,
+    ) -> Dict:
+        self._ensure_collection()
+        all_points = self.build_points(pages_data, tenant=tenant, revision=revision)
 
         # 7. Upsert points in batches into Qdrant
         inserted = 0
         try:
             for i in range(0, len(all_points), batch_size):
                 batch = all_points[i : i + batch_size]
-                self.qdrant_client.upsert(
-                    collection_name=self.collection_name,
-                    points=batch
-                )
+                with writing(self.write_gate), slot(self.scheduler, BULK):
+                    self.qdrant_client.upsert(
+                        collection_name=self.collection_name,
+                        points=batch
+                    )
                 inserted += len(batch)
                 logger.info(f"Upserted batch {i // batch_size + 1} ({len(batch)} points).")
+        except AppException:
+            raise
         except Exception as e:
             raise AppException("VectorEmbeddingAgent: Qdrant upsert failed", error_detail=e)
 
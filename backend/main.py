@@ -1,14 +1,25 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, status, Query, Request
-from fastapi.responses import JSONResponse
-from backend.schemas import IngestResponse, QueryResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from backend.schemas import (
+    IngestResponse, QueryResponse, DocumentListResponse, DeleteResponse,
+    ChatResponse, SessionResponse, SessionDeleteResponse,
+)
 from context.context_manager import ContextManager
-import os, shutil
+from context.reindex import Reindexer, DEFAULT_MAX_POINTS_PER_SEC
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Dict, Iterator, List, Optional
 from common.exception import AppException
+from common.scheduler import Overloaded
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from common.logging import logger
+from backend.storage import UploadStore, UPLOAD_GC_INTERVAL_MIN
+from common.logging import dropped_records, logger, new_trace_id, trace
 from qdrant_client import QdrantClient
 from contextlib import asynccontextmanager
-from qdrant_client.http.exceptions import ResponseHandlingException
 
 
 qdrant_host = os.getenv("QDRANT_HOST", "localhost")
@@ -16,27 +27,34 @@ qdrant_port = os.getenv("QDRANT_PORT", "6334")
 
 qdrant = QdrantClient(host=qdrant_host, port=qdrant_port, prefer_grpc=True)
 manager = ContextManager(qdrant_client=qdrant)
+upload_store = UploadStore()
+
+async def _collect_uploads_periodically():
+    while True:
+        try:
+            await asyncio.to_thread(upload_store.gc)
+        except Exception as e:
+            logger.warning(f"Upload store GC failed: {e}")
+        await asyncio.sleep(UPLOAD_GC_INTERVAL_MIN * 60)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     app.state.context_manager = manager
     logger.info("Application startup complete; ContextManager ready.")
-    global vector_count
     try:
-        # Attempt to fetch collection info (replace 'pdf_chunks' with your actual collection name)
-        collection_info = qdrant.get_collection("pdf_chunks")
-
-        # CollectionInfo.points_count is the number of points currently stored
-        vector_count = collection_info.points_count
+        # Prime the cached vector count; afterwards it is maintained by ingestion
+        vector_count = await run_in_threadpool(manager.refresh_vector_count)
         logger.info(f"Startup: loaded initial vector_count = {vector_count}")
-
     except Exception as e:
-        # If Qdrant is not reachable (or the collection doesn’t exist yet), default to 0
-        vector_count = 0
-        logger.warning(f"Startup: failed to load vector_count from Qdrant ({e}), defaulting to 0.")
+        # If Qdrant is not reachable, the count is re-read on first use
+        logger.warning(f"Startup: failed to load vector_count from Qdrant ({e}); will retry lazily.")
 
+    # Replay frequent questions from the query log in the background
+    manager.warmer.trigger("startup", delay=0)
+    gc_task = asyncio.create_task(_collect_uploads_periodically())
     yield
     #cleanup on shutdown
+    gc_task.cancel()
     logger.info("Application shutdown: cleanup complete.")
 
 app = FastAPI(title="Multi-Agentic RAG",lifespan=lifespan)
@@ -45,9 +63,12 @@ app = FastAPI(title="Multi-Agentic RAG",lifespan=lifespan)
 async def app_exception_handler(request, exc: AppException):
     logger.info("Handling AppException: %s (status code: %s)", exc.message, exc.status_code)
     code = getattr(exc, "status_code", status.HTTP_500_INTERNAL_SERVER_ERROR)
+    # Capacity rejections tell the client when to come back
+    headers = {"Retry-After": str(exc.retry_after)} if isinstance(exc, Overloaded) else None
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.message}
+        content={"detail": exc.message},
+        headers=headers
     )
 
 #catch-all 500 handler for anything else
@@ -62,48 +83,76 @@ async def general_exception_handler(request: Request, exc: Exception):
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],             
-    allow_methods=["POST", "GET"],
+    allow_methods=["POST", "GET", "PUT", "DELETE"],
     allow_headers=["*"],
 )
 
+# Caller-supplied request ids are reused as trace ids when they look sane
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Every log record written while handling the request carries its trace
+    # id, which is also returned to the caller
+    request_id = request.headers.get("X-Request-ID", "")
+    with trace(request_id if _REQUEST_ID.match(request_id) else new_trace_id()) as trace_id:
+        started = time.perf_counter()
+        response = await call_next(request)
+        response.headers["X-Trace-Id"] = trace_id
+        logger.info(
+            f"{request.method} {request.url.path} -> {response.status_code}",
+            extra={"method": request.method, "path": request.url.path, "status": response.status_code,
+                   "duration_ms": round((time.perf_counter() - started) * 1000, 1)},
+        )
+    return response
+
+async def _save_uploads(files: list[UploadFile]) -> list[dict]:
+    """
+    Stream each upload into the content-addressed store; on failure, nothing
+    from this request is ingested.
+    """
+    return [await upload_store.save(file) for file in files]
+
 @app.post(
     "/upload",
     response_model=IngestResponse,
     status_code=status.HTTP_200_OK,
     summary="Upload and ingest one or more PDF files"
 )
-async def upload_pdfs(files: list[UploadFile] = File(...)):
+async def upload_pdfs(
+    files: list[UploadFile] = File(...),
+    tenant: Optional[str] = Query(None, description="Tenant/workspace the documents belong to"),
+    backend: Optional[str] = Query(None, description="Extraction backend: auto, pdfium, pdfplumber or layout")
+):
     """
-    Save uploaded PDFs to disk, then invoke the ContextManager.ingest() pipeline.
+    Stream uploaded PDFs into the content-addressed upload store, then invoke
+    the ContextManager.ingest() pipeline on the stored files.
     Returns total pages and chunks indexed.
     """
-    upload_dir = "data/temp_pdfs"
-    os.makedirs(upload_dir, exist_ok=True)
-    saved_paths = []
-
-    # 1. Save files locally
-    for file in files:
-        dest_path = os.path.join(upload_dir, file.filename)
-        with open(dest_path, "wb") as out_file:
-            shutil.copyfileobj(file.file, out_file)
-        saved_paths.append(dest_path)
-
-    # 2. Ingest via ContextManager
-    try:
-        result = manager.ingest(saved_paths)
-        updated_info = qdrant.get_collection("pdf_chunks")
-        global vector_count
-        vector_count = updated_info.points_count
-        return IngestResponse(**result)
-    except AppException as ae:
-        # Handled by @app.exception_handler
-        raise ae
-    except Exception as e:
-        # Unexpected
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Unexpected ingestion error."
-        )
+    # Admit the job before storing or parsing anything, so overload is rejected fast (429)
+    with manager.scheduler.job():
+        # 1. Stream files into the upload store
+        stored = await _save_uploads(files)
+
+        # 2. Ingest via ContextManager (off the event loop)
+        try:
+            result = await run_in_threadpool(
+                manager.ingest,
+                [f["path"] for f in stored],
+                tenant=tenant,
+                source_names=[f["filename"] for f in stored],
+                backend=backend,
+            )
+            return IngestResponse(**result)
+        except AppException as ae:
+            # Handled by @app.exception_handler
+            raise ae
+        except Exception as e:
+            # Unexpected
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Unexpected ingestion error."
+            )
 
 @app.get(
     "/query",
@@ -113,13 +162,24 @@ async def upload_pdfs(files: list[UploadFile] = File(...)):
 )
 async def query(
     q: str = Query(..., description="Natural language question about your PDFs"),
-    top_k: int = Query(None, alias="top_k", ge=1, le=10, description="How many contexts to retrieve (max 10)")
+    top_k: Optional[int] = Query(None, alias="top_k", ge=1, le=10, description="How many contexts to retrieve (max 10; omit to pick adaptively by score)"),
+    tenant: Optional[str] = Query(None, description="Only search documents of this tenant/workspace (defaults to DEFAULT_TENANT)"),
+    doc_id: Optional[List[str]] = Query(None, description="Only search these documents (repeatable)"),
+    source: Optional[List[str]] = Query(None, description="Only search these source filenames (repeatable)"),
+    deadline: Optional[float] = Query(None, gt=0, description="End-to-end time budget in seconds (capped server-side)"),
+    window: Optional[int] = Query(None, ge=0, le=5, description="Neighbouring chunks returned around each match (0 = matches only)")
 ):
     """
     Given a user question, retrieve top-K chunks and generate an answer via LLM.
+    When the deadline runs out during generation, the contexts are returned
+    with status "generation timed out"; during retrieval, the request fails
+    with 504.
     """
     try:
-        result = manager.query(q, top_k)
+        # Off the event loop, so concurrent identical questions can coalesce
+        result = await run_in_threadpool(
+            manager.query, q, top_k, tenant=tenant, doc_ids=doc_id, sources=source, deadline=deadline, window=window
+        )
         return QueryResponse(**result)
     except AppException as ae:
         logger.warning("AppException in /query: %s", ae.message, exc_info=ae.error_detail)
@@ -130,7 +190,195 @@ async def query(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Unexpected query error."
         )
-    
+
+def _ndjson(events: Iterator[Dict]) -> Iterator[str]:
+    # Errors after the first byte can't change the status code anymore,
+    # so they are reported as a final event instead
+    try:
+        for event in events:
+            yield json.dumps(event) + "\n"
+    except AppException as ae:
+        logger.warning("AppException in /query/stream: %s", ae.message, exc_info=ae.error_detail)
+        yield json.dumps({"type": "error", "detail": ae.message}) + "\n"
+    except Exception:
+        logger.exception("Unexpected error in /query/stream")
+        yield json.dumps({"type": "error", "detail": "Unexpected query error."}) + "\n"
+
+@app.get(
+    "/query/stream",
+    status_code=status.HTTP_200_OK,
+    summary="Ask a question and stream the answer as newline-delimited JSON events"
+)
+async def query_stream(
+    q: str = Query(..., description="Natural language question about your PDFs"),
+    top_k: Optional[int] = Query(None, alias="top_k", ge=1, le=10, description="How many contexts to retrieve (max 10; omit to pick adaptively by score)"),
+    tenant: Optional[str] = Query(None, description="Only search documents of this tenant/workspace (defaults to DEFAULT_TENANT)"),
+    doc_id: Optional[List[str]] = Query(None, description="Only search these documents (repeatable)"),
+    source: Optional[List[str]] = Query(None, description="Only search these source filenames (repeatable)"),
+    deadline: Optional[float] = Query(None, gt=0, description="End-to-end time budget in seconds (capped server-side)"),
+    window: Optional[int] = Query(None, ge=0, le=5, description="Neighbouring chunks returned around each match (0 = matches only)")
+):
+    """
+    Events: {"type": "contexts", "contexts": [...]}, then {"type": "token",
+    "text": ...} per generated piece, then {"type": "done", "answer": ...,
+    "status": "ok" | "generation timed out"} (or {"type": "error", "detail": ...}).
+    Admission and retrieval finish before the response starts, so overload
+    and retrieval failures get a proper status code (503 with Retry-After,
+    504, ...); only generation errors arrive as an "error" event.
+    """
+    try:
+        events = await run_in_threadpool(
+            manager.query_stream, q, top_k, tenant=tenant, doc_ids=doc_id, sources=source, deadline=deadline, window=window
+        )
+    except AppException as ae:
+        logger.warning("AppException in /query/stream: %s", ae.message, exc_info=ae.error_detail)
+        raise ae
+    return StreamingResponse(_ndjson(events), media_type="application/x-ndjson")
+
+
+@app.post(
+    "/sessions",
+    response_model=SessionResponse,
+    status_code=status.HTTP_201_CREATED,
+    summary="Start a multi-turn chat session"
+)
+async def create_session(
+    tenant: Optional[str] = Query(None, description="Only search documents of this tenant/workspace (defaults to DEFAULT_TENANT)"),
+    doc_id: Optional[List[str]] = Query(None, description="Only search these documents (repeatable)"),
+    source: Optional[List[str]] = Query(None, description="Only search these source filenames (repeatable)")
+):
+    """Every turn of the session searches within these filters."""
+    return SessionResponse(**manager.create_session(tenant=tenant, doc_ids=doc_id, sources=source))
+
+@app.get(
+    "/sessions/{session_id}",
+    response_model=SessionResponse,
+    status_code=status.HTTP_200_OK,
+    summary="A session's turns, with the chunk ids each was answered from"
+)
+async def get_session(session_id: str):
+    return SessionResponse(**manager.get_session(session_id))
+
+@app.delete(
+    "/sessions/{session_id}",
+    response_model=SessionDeleteResponse,
+    status_code=status.HTTP_200_OK,
+    summary="End a chat session"
+)
+async def delete_session(session_id: str):
+    return SessionDeleteResponse(**manager.delete_session(session_id))
+
+@app.post(
+    "/sessions/{session_id}/turns",
+    response_model=ChatResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Ask the next question of a chat session"
+)
+async def chat_turn(
+    session_id: str,
+    q: str = Query(..., description="Natural language question (may refer to earlier turns)"),
+    top_k: Optional[int] = Query(None, alias="top_k", ge=1, le=10, description="How many contexts to use (max 10; omit to pick adaptively by score)"),
+    deadline: Optional[float] = Query(None, gt=0, description="End-to-end time budget in seconds (capped server-side)"),
+    window: Optional[int] = Query(None, ge=0, le=5, description="Neighbouring chunks returned around each match (0 = matches only)")
+):
+    """
+    Follow-ups are answered from the previous turn's contexts when they are
+    still relevant (`reused_contexts`), otherwise from a fresh search; the
+    conversation so far is passed to the LLM within a token budget.
+    """
+    try:
+        result = await run_in_threadpool(
+            manager.chat, session_id, q, top_k=top_k, deadline=deadline, window=window
+        )
+        return ChatResponse(**result)
+    except AppException as ae:
+        logger.warning("AppException in /sessions/{id}/turns: %s", ae.message, exc_info=ae.error_detail)
+        raise ae
+    except Exception:
+        logger.exception("Unexpected error in /sessions/{id}/turns")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unexpected query error."
+        )
+
+
+@app.get(
+    "/documents",
+    response_model=DocumentListResponse,
+    status_code=status.HTTP_200_OK,
+    summary="List indexed documents with their page and chunk counts"
+)
+async def list_documents(
+    tenant: Optional[str] = Query(None, description="Only list documents of this tenant/workspace (defaults to DEFAULT_TENANT)")
+):
+    # Qdrant scrolls and deletes run off the event loop, like queries
+    documents = await run_in_threadpool(manager.list_documents, tenant=tenant)
+    return DocumentListResponse(documents=documents)
+
+@app.delete(
+    "/documents/{doc_id}",
+    response_model=DeleteResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Delete a document and all of its chunks"
+)
+async def delete_document(
+    doc_id: str,
+    tenant: Optional[str] = Query(None, description="Tenant/workspace the document belongs to (defaults to DEFAULT_TENANT)")
+):
+    result = await run_in_threadpool(manager.delete_document, doc_id, tenant=tenant)
+    return DeleteResponse(**result)
+
+@app.put(
+    "/documents/{doc_id}",
+    response_model=IngestResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Replace a document's chunks with a re-ingested PDF"
+)
+async def replace_document(
+    doc_id: str,
+    file: UploadFile = File(...),
+    tenant: Optional[str] = Query(None, description="Tenant/workspace the document belongs to (defaults to DEFAULT_TENANT)")
+):
+    """
+    Re-ingest `file` under `doc_id`; the old chunks are swapped out in the
+    same Qdrant update that inserts the new ones.
+    """
+    with manager.scheduler.job():
+        stored = (await _save_uploads([file]))[0]
+        result = await run_in_threadpool(
+            manager.replace_document, doc_id, stored["path"], tenant=tenant, source_name=stored["filename"]
+        )
+    return IngestResponse(**result)
+
+@app.post(
+    "/reindex",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Rebuild the index into a new collection and switch the alias when done"
+)
+async def start_reindex(
+    mode: str = Query("vectors", description="'vectors' copies stored vectors, 'text' re-embeds chunk text"),
+    max_points_per_sec: float = Query(DEFAULT_MAX_POINTS_PER_SEC, ge=0, description="Copy rate limit (0 = unthrottled)")
+):
+    if mode not in Reindexer.MODES:
+        raise AppException(f"Unknown re-index mode '{mode}'", status_code=422)
+    return await run_in_threadpool(manager.reindexer.start, mode=mode, max_points_per_sec=max_points_per_sec)
+
+@app.get(
+    "/reindex",
+    status_code=status.HTTP_200_OK,
+    summary="Progress of the current or last re-index"
+)
+async def reindex_status():
+    return await run_in_threadpool(manager.reindexer.status)
+
+@app.post(
+    "/reindex/rollback",
+    status_code=status.HTTP_200_OK,
+    summary="Point the collection alias back at the previous version"
+)
+async def reindex_rollback():
+    result = await run_in_threadpool(manager.reindexer.rollback)
+    return result
 
 @app.get(
     "/status",
@@ -138,20 +386,25 @@ async def query(
     summary="Return how many vectors are currently indexed"
 )
 async def get_status():
-    try:
-        collection_info = qdrant.get_collection("pdf_chunks")
-        count = collection_info.points_count
-        return {"count": count}
-    except ResponseHandlingException as e:
-        # Qdrant raised NOT_FOUND because the collection doesn't exist → treat as zero
-        if "Collection `pdf_chunks` doesn't exist" in str(e):
-            return {"count": 0}
-        # Other Qdrant errors should still surface as HTTP 500
-        logger.error("Unexpected Qdrant error in /status: %s", e)
-        raise AppException("Error fetching Qdrant status", status_code=500)
-    except Exception as e:
-        text = str(e)
-        if "Collection `pdf_chunks` doesn't exist" in text:
-            return {"count": 0}
-        logger.error("Error fetching Qdrant status: %s", e)
-        raise AppException("Error fetching Qdrant status", status_code=500)
\ No newline at end of file
+    """
+    Served from ContextManager's cached count, which ingestion, deletion and
+    re-indexing keep current; Qdrant is not contacted per request.
+    """
+    return {"count": await run_in_threadpool(lambda: manager.vector_count)}
+
+@app.get(
+    "/metrics",
+    status_code=status.HTTP_200_OK,
+    summary="In-process counters (query coalescing, scheduler queue depth per class, caches, warm-up, LLM latency)"
+)
+async def get_metrics():
+    return {
+        "query_coalescing": manager.query_flights.stats(),
+        "scheduler": manager.scheduler.stats(),
+        "caches": manager.cache_stats(),
+        "warmup": manager.warmer.stats(),
+        "query_log": manager.query_log.stats(),
+        "sessions": manager.sessions.stats(),
+        "llm": manager.llm_agent.llm_client.stats(),
+        "logging": {"dropped_records": dropped_records()},
+    }
@@ -1,20 +1,70 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 class IngestResponse(BaseModel):
     status: str = Field(..., example="ingested")
     pages: int = Field(..., example=12)
     chunks: int = Field(..., example=48)
+    doc_ids: List[str] = Field(default_factory=list, example=["3f1c2a9e-8d4b-4c1e-9f0a-2b7d5e6c1a23"])
 
 class SourceContext(BaseModel):
     text: str
     score: float
     page_number: int
+    page_end: Optional[int] = None
+    token_count: Optional[int] = None
     source: str
     chunk_id: str
     chunk_index: int
     doc_id: str
+    # First/last chunk index when neighbouring chunks were merged in
+    chunk_span: Optional[List[int]] = None
 
 class QueryResponse(BaseModel):
     answer: str
     contexts: List[SourceContext]
+    status: str = Field("ok", example="ok")
+
+
+class DocumentInfo(BaseModel):
+    doc_id: str
+    source: Optional[str] = None
+    tenant: Optional[str] = None
+    pages: int
+    chunks: int
+
+class DocumentListResponse(BaseModel):
+    documents: List[DocumentInfo]
+
+class DeleteResponse(BaseModel):
+    status: str = Field(..., example="Deleted")
+    doc_id: str
+    chunks: int = Field(..., example=48)
+
+
+class SessionTurn(BaseModel):
+    question: str
+    answer: str
+    status: str = Field("ok", example="ok")
+    chunk_ids: List[str] = Field(default_factory=list)
+    # Answered from the previous turn's contexts (re-ranked) without a search
+    reused_contexts: bool = False
+    ts: float
+
+class SessionResponse(BaseModel):
+    session_id: str
+    tenant: Optional[str] = None
+    doc_ids: Optional[List[str]] = None
+    sources: Optional[List[str]] = None
+    created_at: float
+    turn_count: int = 0
+    turns: List[SessionTurn] = Field(default_factory=list)
+
+class ChatResponse(QueryResponse):
+    session_id: str
+    turn: int = Field(..., example=2)
+    reused_contexts: bool = False
+
+class SessionDeleteResponse(BaseModel):
+    status: str = Field(..., example="Deleted")
+    session_id: str
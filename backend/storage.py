@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Tuple
+
+from fastapi import UploadFile
+
+from common.exception import AppException
+from common.logging import logger
+
+MB = 1024 * 1024
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "data/uploads")
+# Per-file size limit and total size of the upload store
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "100")) * MB)
+UPLOAD_QUOTA_BYTES = int(float(os.getenv("UPLOAD_QUOTA_MB", "2048")) * MB)
+# Stored PDFs untouched for longer than this are removed by gc()
+UPLOAD_RETENTION_HOURS = float(os.getenv("UPLOAD_RETENTION_HOURS", "72"))
+UPLOAD_GC_INTERVAL_MIN = float(os.getenv("UPLOAD_GC_INTERVAL_MIN", "30"))
+
+CHUNK_SIZE = 1 * MB
+PDF_MAGIC = b"%PDF-"
+
+
+class UploadStore:
+    """
+    Content-addressed store for uploaded PDFs: `<root>/blobs/<sha[:2]>/<sha>.pdf`.
+
+    Uploads are streamed to a temporary `.part` file in fixed-size chunks,
+    hashed on the way, and only then moved into place, so identical files are
+    stored once and concurrent uploads with the same filename never collide.
+    Disk writes run in worker threads to keep the event loop responsive.
+
+    Store usage is a running counter (measured once at startup): each upload
+    reserves its bytes chunk by chunk before writing them, so concurrent
+    uploads cannot together overshoot the quota, and gives them back when it
+    fails, turns out to be a duplicate or is garbage-collected.
+    """
+
+    def __init__(self, root: str = UPLOAD_DIR,
+                 max_file_bytes: int = MAX_UPLOAD_BYTES,
+                 quota_bytes: int = UPLOAD_QUOTA_BYTES,
+                 retention_hours: float = UPLOAD_RETENTION_HOURS):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.max_file_bytes = max_file_bytes
+        self.quota_bytes = quota_bytes
+        self.retention_seconds = retention_hours * 3600
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._usage = self._measure_usage()
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], f"{sha256}.pdf")
+
+    def usage_bytes(self) -> int:
+        with self._lock:
+            return self._usage
+
+    def _measure_usage(self) -> int:
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+        return total
+
+    def _reserve(self, size: int) -> bool:
+        with self._lock:
+            if self._usage + size > self.quota_bytes:
+                return False
+            self._usage += size
+            return True
+
+    def _release(self, size: int):
+        with self._lock:
+            self._usage -= size
+
+    async def save(self, upload: UploadFile) -> Dict:
+        """
+        Stream `upload` into the store and return
+        {path, sha256, size, filename}. Raises AppException with 413 when the
+        file exceeds the size limit, 415 when it is not a PDF and 507 when the
+        store quota would be exceeded.
+        """
+        filename = os.path.basename(upload.filename or "upload.pdf")
+        tmp_path = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.part")
+        hasher = hashlib.sha256()
+        # Bytes written so far, all of them reserved against the quota
+        size = 0
+
+        out = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            try:
+                while True:
+                    chunk = await upload.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if size == 0 and not chunk.startswith(PDF_MAGIC):
+                        raise AppException(f"'{filename}' is not a PDF file", status_code=415)
+                    if size + len(chunk) > self.max_file_bytes:
+                        raise AppException(
+                            f"'{filename}' exceeds the {self.max_file_bytes // MB} MB upload limit",
+                            status_code=413
+                        )
+                    if not self._reserve(len(chunk)):
+                        raise AppException("Upload storage quota exceeded, try again later", status_code=507)
+                    size += len(chunk)
+                    hasher.update(chunk)
+                    await asyncio.to_thread(out.write, chunk)
+            finally:
+                await asyncio.to_thread(out.close)
+
+            if size == 0:
+                raise AppException(f"'{filename}' is empty", status_code=400)
+
+            sha256 = hasher.hexdigest()
+            path, stored = await asyncio.to_thread(self._commit, tmp_path, sha256)
+        except BaseException:
+            await asyncio.to_thread(_remove_quietly, tmp_path)
+            self._release(size)
+            raise
+        if not stored:
+            # Duplicate of a stored blob: the partial file is gone
+            self._release(size)
+        logger.info(f"UploadStore: stored '{filename}' as {sha256[:12]} ({size} bytes)")
+        return {"path": path, "sha256": sha256, "size": size, "filename": filename}
+
+    def _commit(self, tmp_path: str, sha256: str) -> Tuple[str, bool]:
+        """Move the upload into place; returns (path, whether it was new)."""
+        dest = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.exists(dest):
+            # Same content already stored: keep one copy, refresh its age
+            _remove_quietly(tmp_path)
+            os.utime(dest)
+            return dest, False
+        os.replace(tmp_path, dest)
+        return dest, True
+
+    def gc(self) -> int:
+        """
+        Delete stored PDFs and abandoned partial uploads older than the
+        retention window. Returns the number of files removed.
+        """
+        cutoff = time.time() - self.retention_seconds
+        removed = freed = 0
+        for base in (self.blob_dir, self.tmp_dir):
+            for dirpath, _, filenames in os.walk(base):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                        if stat.st_mtime < cutoff:
+                            os.remove(path)
+                            removed += 1
+                            freed += stat.st_size
+                    except OSError:
+                        continue
+        self._release(freed)
+        if removed:
+            logger.info(f"UploadStore: garbage-collected {removed} expired files")
+        return removed
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,10 @@
+import os
+
+# Qdrant collection every agent reads from and writes to
+COLLECTION_NAME = os.getenv("QDRANT_COLLECTION", "pdf_chunks")
+
+# all-MiniLM-L6-v2 output dimension
+EMBEDDING_DIM = 384
+
+# Tenant recorded on points ingested without an explicit tenant
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
@@ -0,0 +1,44 @@
+import os
+import time
+from typing import Optional
+
+from common.exception import AppException
+
+# End-to-end budget for a query when the client doesn't ask for one, and the
+# most a client may ask for
+DEFAULT_QUERY_DEADLINE_S = float(os.getenv("QUERY_DEADLINE_S", "30"))
+MAX_QUERY_DEADLINE_S = float(os.getenv("QUERY_DEADLINE_MAX_S", "60"))
+# Share of the deadline that query embedding + vector search may use; the
+# LLM gets whatever is left
+RETRIEVAL_BUDGET_SHARE = float(os.getenv("QUERY_RETRIEVAL_SHARE", "0.3"))
+
+
+class DeadlineExceeded(AppException):
+    def __init__(self, message: str, error_detail: Exception = None):
+        super().__init__(message, status_code=504, error_detail=error_detail)
+
+
+class Deadline:
+    """
+    A point in time by which a request must finish. Stages take a slice of
+    what is left with `stage`, and pass `remaining()` on as their timeout.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_request(cls, requested: Optional[float] = None) -> "Deadline":
+        """The requested deadline (or the default), capped server-side."""
+        return cls(min(requested or DEFAULT_QUERY_DEADLINE_S, MAX_QUERY_DEADLINE_S))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def stage(self, share: float) -> "Deadline":
+        """A sub-deadline of `share` of the total budget, never past this one."""
+        return Deadline(min(self.seconds * share, self.remaining()))
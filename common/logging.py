@@ -1,8 +1,17 @@
+import atexit
+import contextvars
+import json
 import os
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import queue
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Optional
 
-# get the project root directory 
+# get the project root directory
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # Create logs directory in project root
@@ -12,10 +21,122 @@ os.makedirs(LOG_DIR, exist_ok=True)
 # Base log file path (active log)
 BASE_LOG_FILE = os.path.join(LOG_DIR, 'app.log')
 
-# Log formatter with timestamp
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Level of the app's own logger; third-party libraries stay at INFO or above
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Console output: "text" for development, "json" for log shippers (the file is always JSON)
+LOG_CONSOLE_FORMAT = os.getenv("LOG_CONSOLE_FORMAT", "text")
+# Records waiting for the writer thread; beyond this they are dropped (and
+# counted) rather than blocking the request that logged them
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Share of hot-path debug records (`hot_logger`) that are kept
+LOG_HOT_SAMPLE_RATE = float(os.getenv("LOG_HOT_SAMPLE_RATE", "0.01"))
+
+# Trace id of the request being handled; set by the API middleware (or by
+# `trace()` for work started elsewhere) and stamped on every record
+_trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id"}
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def get_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id: Optional[str] = None):
+    """
+    Run the block under `trace_id`, or under the current trace (a fresh one
+    when there is none). Yields the id in effect.
+    """
+    trace_id = trace_id or _trace_id.get() or new_trace_id()
+    token = _trace_id.set(trace_id)
+    try:
+        yield trace_id
+    finally:
+        _trace_id.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including the trace id and any `extra=` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "trace_id": getattr(record, "trace_id", None),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    """The classic one-line format, with the trace id appended when there is one."""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        trace_id = getattr(record, "trace_id", None)
+        return f"{line} [trace={trace_id}]" if trace_id else line
+
+
+class _TraceFilter(logging.Filter):
+    """Stamps the caller's trace id on the record before it changes threads."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get()
+        return True
+
+
+class _SampleFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1 or random.random() < self.rate:
+            record.sample_rate = self.rate
+            return True
+        return False
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Never waits on a full queue: the record is dropped and counted instead."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message and traceback here, so the record stays valid
+        # after the objects it references change, but keep it structured
+        # (the base class would fold the traceback into the message)
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
 
 # File handler: rotate logs daily at midnight, keep 7 days of logs
 file_handler = TimedRotatingFileHandler(
@@ -26,20 +147,40 @@ file_handler = TimedRotatingFileHandler(
     encoding='utf-8'
 )
 file_handler.suffix = "%Y-%m-%d"
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(formatter)
+file_handler.setFormatter(JsonFormatter())
 
 # Console (stream) handler for development
 console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-console_handler.setFormatter(formatter)
+console_handler.setFormatter(
+    JsonFormatter() if LOG_CONSOLE_FORMAT == "json"
+    else _TextFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+)
+
+# Callers only pay for a queue put; file and console I/O happen on the
+# listener's thread
+queue_handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+queue_handler.addFilter(_TraceFilter())
+listener = QueueListener(queue_handler.queue, file_handler, console_handler, respect_handler_level=True)
 
 # Configure the root logger explicitly
 root_logger = logging.getLogger()
 # Prevent duplicate handlers if re-imported
 if not root_logger.handlers:
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    root_logger.setLevel(max(logging.INFO, logging.getLevelName(LOG_LEVEL)))
+    root_logger.addHandler(queue_handler)
+    listener.start()
+    # Flush what is still queued on interpreter exit
+    atexit.register(listener.stop)
 
 logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+
+# For debug records emitted on every query (per-hit, per-batch detail):
+# only LOG_HOT_SAMPLE_RATE of them are kept, each tagged with the rate
+hot_logger = logging.getLogger(f"{__name__}.hot")
+hot_logger.addFilter(_SampleFilter(LOG_HOT_SAMPLE_RATE))
+
+
+def dropped_records() -> int:
+    """Records discarded because the log queue was full."""
+    return queue_handler.dropped
@@ -0,0 +1,151 @@
+import re
+import uuid
+from typing import List, Optional, Tuple
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    CreateAlias,
+    CreateAliasOperation,
+    Distance,
+    FieldCondition,
+    Filter,
+    IsEmptyCondition,
+    MatchAny,
+    KeywordIndexParams,
+    MatchValue,
+    PayloadField,
+    PayloadSchemaType,
+    VectorParams,
+)
+from common.config import DEFAULT_TENANT, EMBEDDING_DIM
+from common.exception import AppException
+from common.logging import logger
+
+# Payload keys used for query-time filtering; each gets a keyword index
+INDEXED_PAYLOAD_FIELDS = ("tenant", "doc_id", "source")
+
+
+def ensure_payload_indexes(client: QdrantClient, collection_name: str) -> None:
+    """
+    Create keyword payload indexes for the filterable fields. Qdrant treats
+    re-creating an existing index as a no-op, so this is safe on every startup.
+    The tenant index is marked `is_tenant` so Qdrant co-locates each tenant's
+    points, as every search is scoped to one.
+    """
+    for field in INDEXED_PAYLOAD_FIELDS:
+        if field == "tenant":
+            schema = KeywordIndexParams(type="keyword", is_tenant=True)
+        else:
+            schema = PayloadSchemaType.KEYWORD
+        try:
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field,
+                field_schema=schema,
+            )
+        except Exception as e:
+            raise AppException(
+                f"Failed to create payload index '{field}' on '{collection_name}'",
+                status_code=500,
+                error_detail=e
+            )
+    logger.info(f"Payload indexes ensured on '{collection_name}': {', '.join(INDEXED_PAYLOAD_FIELDS)}")
+
+
+def versioned_name(alias: str, version: int) -> str:
+    return f"{alias}_v{version}"
+
+
+def collection_versions(client: QdrantClient, alias: str) -> List[Tuple[int, str]]:
+    """
+    Return the (version, collection_name) pairs of every `<alias>_v<N>`
+    collection, oldest first.
+    """
+    pattern = re.compile(rf"^{re.escape(alias)}_v(\d+)$")
+    versions = []
+    for collection in client.get_collections().collections:
+        match = pattern.match(collection.name)
+        if match:
+            versions.append((int(match.group(1)), collection.name))
+    return sorted(versions)
+
+
+def resolve_collection(client: QdrantClient, name: str) -> Optional[str]:
+    """
+    Return the concrete collection behind `name`, which may be an alias or a
+    plain collection, or None if neither exists.
+    """
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == name:
+            return alias.collection_name
+    names = {c.name for c in client.get_collections().collections}
+    return name if name in names else None
+
+
+def ensure_collection(client: QdrantClient, name: str) -> str:
+    """
+    Make sure `name` resolves to a collection and return the concrete one.
+    Fresh installs get `<name>_v1` behind an alias called `name`, so later
+    re-indexes can swap the alias instead of rebuilding in place. Collections
+    created before aliases were introduced are used as-is.
+    """
+    target = resolve_collection(client, name)
+    if target is not None:
+        return target
+
+    target = versioned_name(name, 1)
+    if not client.collection_exists(target):
+        client.create_collection(
+            collection_name=target,
+            vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE),
+        )
+    client.update_collection_aliases(
+        change_aliases_operations=[
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=name))
+        ]
+    )
+    logger.info(f"Created Qdrant collection '{target}' behind alias '{name}'.")
+    return target
+
+
+def chunk_point_id(doc_id: str, revision: str, chunk_index: int) -> str:
+    """
+    Point ID of a chunk, derived from its position in the document so the
+    neighbours of any hit can be fetched by ID without another search.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"chunk://{doc_id}/{revision}/{chunk_index}"))
+
+
+def _match(field: str, values: List[str]) -> FieldCondition:
+    if len(values) == 1:
+        return FieldCondition(key=field, match=MatchValue(value=values[0]))
+    return FieldCondition(key=field, match=MatchAny(any=list(values)))
+
+
+def build_filter(
+    tenant: Optional[str] = None,
+    doc_ids: Optional[List[str]] = None,
+    sources: Optional[List[str]] = None,
+    all_tenants: bool = False,
+) -> Optional[Filter]:
+    """
+    Build a Qdrant filter restricting a search to a tenant (DEFAULT_TENANT
+    when none is given) and optionally a set of documents or source
+    filenames. Only `all_tenants=True` lifts the tenant restriction, for
+    maintenance jobs such as re-indexing; it returns None when nothing else
+    is restricted either.
+    """
+    must = []
+    if not all_tenants and (tenant or DEFAULT_TENANT) == DEFAULT_TENANT:
+        # Points ingested before tenants were stored have no tenant field;
+        # they belong to the default tenant
+        must.append(Filter(should=[
+            _match("tenant", [DEFAULT_TENANT]),
+            IsEmptyCondition(is_empty=PayloadField(key="tenant")),
+        ]))
+    elif not all_tenants:
+        must.append(_match("tenant", [tenant]))
+    if doc_ids:
+        must.append(_match("doc_id", doc_ids))
+    if sources:
+        must.append(_match("source", sources))
+    return Filter(must=must) if must else None
@@ -0,0 +1,191 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+from common.exception import AppException
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# Lower runs first
+_PRIORITY = {INTERACTIVE: 0, BULK: 1}
+
+# Concurrent encoder/Qdrant work items, and how many of them bulk work may
+# hold (the rest stay free for queries)
+SCHED_SLOTS = int(os.getenv("SCHED_SLOTS", "2"))
+SCHED_BULK_SLOTS = int(os.getenv("SCHED_BULK_SLOTS", str(max(1, SCHED_SLOTS - 1))))
+# Waiting work beyond these is rejected with 503 instead of queued
+SCHED_MAX_INTERACTIVE_QUEUE = int(os.getenv("SCHED_MAX_INTERACTIVE_QUEUE", "32"))
+SCHED_MAX_BULK_QUEUE = int(os.getenv("SCHED_MAX_BULK_QUEUE", "64"))
+# Longest a query waits for a slot before giving up with 503
+SCHED_INTERACTIVE_MAX_WAIT_S = float(os.getenv("SCHED_INTERACTIVE_MAX_WAIT_S", "5"))
+# Ingestion jobs (uploads/replaces) running at once; more get 429
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "2"))
+
+
+class Overloaded(AppException):
+    """Rejected for lack of capacity; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = 1.0):
+        super().__init__(message, status_code=status_code)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class PriorityScheduler:
+    """
+    Admission control for the shared encoder and Qdrant client.
+
+    Work runs inside `slot(work_class)`. There are `slots` slots; when one
+    frees up, waiting interactive work gets it before bulk work, and bulk
+    work never holds more than `bulk_slots` of them, so a query only ever
+    waits behind other queries or a single in-flight bulk batch. Bulk work
+    takes a slot per batch, which lets queries interleave with a long
+    ingestion.
+
+    Queues are bounded per class, and `job()` bounds the number of ingestion
+    jobs; both reject with `Overloaded` (and a Retry-After estimate) rather
+    than queue without limit.
+    """
+
+    def __init__(
+        self,
+        slots: int = SCHED_SLOTS,
+        bulk_slots: int = SCHED_BULK_SLOTS,
+        max_interactive_queue: int = SCHED_MAX_INTERACTIVE_QUEUE,
+        max_bulk_queue: int = SCHED_MAX_BULK_QUEUE,
+        interactive_max_wait: float = SCHED_INTERACTIVE_MAX_WAIT_S,
+        max_jobs: int = INGEST_MAX_JOBS,
+    ):
+        self.slots = slots
+        self.bulk_slots = min(bulk_slots, slots)
+        self.max_queue = {INTERACTIVE: max_interactive_queue, BULK: max_bulk_queue}
+        self.max_wait = {INTERACTIVE: interactive_max_wait, BULK: None}
+        self.max_jobs = max_jobs
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = []  # heap of (priority, seq) tickets
+        self._busy = 0
+        self._queued = {INTERACTIVE: 0, BULK: 0}
+        self._running = {INTERACTIVE: 0, BULK: 0}
+        self._rejected = {INTERACTIVE: 0, BULK: 0, "jobs": 0}
+        # Moving averages used for Retry-After hints
+        self._service_s = {INTERACTIVE: 0.1, BULK: 1.0}
+        self._job_s = 30.0
+        self._jobs = 0
+
+    @contextmanager
+    def slot(self, work_class: str, timeout: Optional[float] = None):
+        """
+        Hold one slot for the duration of the block. `timeout` bounds the
+        wait (further capped by the class's max wait).
+        """
+        self._acquire(work_class, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(work_class, time.monotonic() - started)
+
+    def _can_run(self, work_class: str) -> bool:
+        if self._busy >= self.slots:
+            return False
+        return work_class == INTERACTIVE or self._running[BULK] < self.bulk_slots
+
+    def _acquire(self, work_class: str, timeout: Optional[float]):
+        if work_class not in _PRIORITY:
+            raise AppException(f"Unknown work class '{work_class}'", status_code=500)
+        max_wait = self.max_wait[work_class]
+        if max_wait is not None:
+            timeout = max_wait if timeout is None else min(timeout, max_wait)
+
+        with self._cond:
+            if not self._waiting and self._can_run(work_class):
+                self._busy += 1
+                self._running[work_class] += 1
+                return
+            if self._queued[work_class] >= self.max_queue[work_class]:
+                self._rejected[work_class] += 1
+                raise Overloaded(f"Server busy: {work_class} queue is full", retry_after=self._retry_after(work_class))
+
+            ticket = (_PRIORITY[work_class], next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            self._queued[work_class] += 1
+            expires_at = None if timeout is None else time.monotonic() + timeout
+            try:
+                while not (self._waiting[0] == ticket and self._can_run(work_class)):
+                    remaining = None if expires_at is None else expires_at - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._rejected[work_class] += 1
+                        raise Overloaded(
+                            f"Server busy: no {work_class} capacity within {timeout:g}s",
+                            retry_after=self._retry_after(work_class),
+                        )
+                    self._cond.wait(remaining)
+                heapq.heappop(self._waiting)
+                self._busy += 1
+                self._running[work_class] += 1
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                raise
+            finally:
+                self._queued[work_class] -= 1
+                # The head of the queue may have changed either way
+                self._cond.notify_all()
+
+    def _release(self, work_class: str, held_s: float):
+        with self._cond:
+            self._busy -= 1
+            self._running[work_class] -= 1
+            self._service_s[work_class] = 0.8 * self._service_s[work_class] + 0.2 * held_s
+            self._cond.notify_all()
+
+    def _retry_after(self, work_class: str) -> float:
+        ahead = self._queued[INTERACTIVE] + (self._queued[BULK] if work_class == BULK else 0) + 1
+        return self._service_s[work_class] * ahead / self.slots
+
+    @contextmanager
+    def job(self):
+        """
+        Admit one ingestion job, or raise Overloaded (429) when `max_jobs`
+        are already running. Never waits.
+        """
+        with self._cond:
+            if self._jobs >= self.max_jobs:
+                self._rejected["jobs"] += 1
+                raise Overloaded(
+                    f"Too many ingestion jobs running ({self._jobs}/{self.max_jobs}), try again later",
+                    status_code=429,
+                    retry_after=self._job_s,
+                )
+            self._jobs += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._jobs -= 1
+                self._job_s = 0.8 * self._job_s + 0.2 * (time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "bulk_slots": self.bulk_slots,
+                "busy": self._busy,
+                "running": dict(self._running),
+                "queued": dict(self._queued),
+                "rejected": dict(self._rejected),
+                "ingest_jobs": {"active": self._jobs, "max": self.max_jobs},
+            }
+
+
+def slot(scheduler: Optional[PriorityScheduler], work_class: str, timeout: Optional[float] = None):
+    """`scheduler.slot(...)`, or a no-op when running without a scheduler."""
+    if scheduler is None:
+        return nullcontext()
+    return scheduler.slot(work_class, timeout=timeout)
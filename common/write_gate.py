@@ -0,0 +1,61 @@
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+
+class WriteGate:
+    """
+    Lets index writers (ingest, delete, replace, bulk upserts) run
+    concurrently inside `write()`, until a maintenance job calls `paused()`:
+    new writes then wait, and the job proceeds once the in-flight ones have
+    finished. Used by the re-index to reconcile and switch collections
+    without losing writes made in between.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._paused = False
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            while self._paused:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def paused(self):
+        with self._cond:
+            # One pause at a time; a second waits for the first to end
+            while self._paused:
+                self._cond.wait()
+            self._paused = True
+            while self._active:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._paused = False
+                self._cond.notify_all()
+
+
+def writing(gate: Optional[WriteGate]):
+    """`gate.write()`, or a no-op without a gate."""
+    if gate is None:
+        return nullcontext()
+    return gate.write()
+
+
+def pausing(gate: Optional[WriteGate]):
+    """`gate.paused()`, or a no-op without a gate."""
+    if gate is None:
+        return nullcontext()
+    return gate.paused()
@@ -0,0 +1,312 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from common.exception import AppException
+from common.logging import logger, new_trace_id, trace
+from common.qdrant_utils import build_filter
+from common.write_gate import writing
+from qdrant_client.http.models import FilterSelector
+
+# Journal next to the data unless told otherwise
+DEFAULT_JOURNAL = os.getenv("BULK_INGEST_JOURNAL", "data/bulk_ingest.journal.jsonl")
+_STOP = object()
+
+
+def find_pdfs(root: str) -> List[str]:
+    """Every *.pdf under `root`, in a stable order."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        found.extend(os.path.join(dirpath, name) for name in sorted(filenames) if name.lower().endswith(".pdf"))
+    return found
+
+
+def read_manifest(path: str) -> List[str]:
+    """One PDF path per line; blank lines and '#' comments are ignored."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+
+
+def _fingerprint(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class Journal:
+    """
+    Append-only JSONL checkpoint log. A document is "done" once all of its
+    points are upserted; "started" without "done" means an interrupted
+    document whose partial points must be cleared before it is redone.
+    Entries are keyed by absolute path and matched on a size/mtime
+    fingerprint, so a file edited since it was ingested is ingested again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Dict[str, Dict] = {}
+        self.started: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    if entry.get("event") == "done":
+                        self.done[entry["path"]] = entry
+                        self.started.pop(entry["path"], None)
+                    elif entry.get("event") == "started":
+                        self.started[entry["path"]] = entry
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, path: str, fingerprint: str) -> bool:
+        entry = self.done.get(path)
+        return entry is not None and entry.get("fingerprint") == fingerprint
+
+    def record(self, event: str, **fields):
+        entry = dict(fields, event=event, at=time.time())
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BulkIngester:
+    """
+    Offline ingestion of many PDFs through a ContextManager's agents, as a
+    three-stage pipeline:
+
+      extract (N threads) -> embed (1 thread) -> upsert (1 thread)
+
+    connected by bounded queues, so at most `queue_size` documents wait
+    between two stages and memory stays flat however many files there are.
+    Each document gets a stable doc_id derived from its path, which makes
+    re-ingesting a changed file a replacement rather than a duplicate.
+    """
+
+    def __init__(
+        self,
+        manager,
+        journal: Journal,
+        workers: int = 4,
+        queue_size: int = 8,
+        tenant: Optional[str] = None,
+        backend: Optional[str] = None,
+        upsert_batch_size: int = 256,
+        report_every: float = 5.0,
+    ):
+        self.manager = manager
+        self.journal = journal
+        self.workers = workers
+        self.tenant = tenant
+        self.backend = backend
+        self.upsert_batch_size = upsert_batch_size
+        self.report_every = report_every
+        self._todo: queue.Queue = queue.Queue()
+        self._extracted: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._embedded: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self.stats = {"total": 0, "skipped": 0, "done": 0, "failed": 0, "pages": 0, "chunks": 0}
+
+    def run(self, paths: List[str]) -> Dict:
+        pending = []
+        for path in dict.fromkeys(os.path.abspath(p) for p in paths):
+            try:
+                fingerprint = _fingerprint(path)
+            except OSError as e:
+                logger.warning(f"BulkIngester: cannot read '{path}' ({e}), skipping")
+                continue
+            if self.journal.is_done(path, fingerprint):
+                self.stats["skipped"] += 1
+            else:
+                # One trace per document, followed through all three stages
+                pending.append({"path": path, "fingerprint": fingerprint, "trace_id": new_trace_id(),
+                                "doc_id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"file://{path}"))})
+        self.stats["total"] = len(pending)
+        logger.info(f"BulkIngester: {len(pending)} documents to ingest, {self.stats['skipped']} already done")
+        if not pending:
+            return dict(self.stats)
+
+        self.manager._ensure_collection()
+        for item in pending:
+            self._todo.put(item)
+
+        extractors = [threading.Thread(target=self._extract_loop, name=f"extract-{i}", daemon=True)
+                      for i in range(self.workers)]
+        embedder = threading.Thread(target=self._embed_loop, name="embed", daemon=True)
+        upserter = threading.Thread(target=self._upsert_loop, name="upsert", daemon=True)
+        reporter = threading.Thread(target=self._report_loop, name="report", daemon=True)
+
+        self._started_at = time.monotonic()
+        for thread in extractors + [embedder, upserter, reporter]:
+            thread.start()
+        for thread in extractors:
+            thread.join()
+        self._extracted.put(_STOP)
+        embedder.join()
+        upserter.join()
+        self._finished.set()
+        reporter.join()
+        self._report(final=True)
+        return dict(self.stats)
+
+    # --- pipeline stages ----------------------------------------------------
+
+    def _extract_loop(self):
+        while True:
+            try:
+                item = self._todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                with trace(item["trace_id"]):
+                    pages = self.manager.ingestor.run(
+                        [item["path"]], doc_ids=[item["doc_id"]], backend=self.backend
+                    )["documents"]
+            except Exception as e:
+                self._fail(item, "extract", e)
+                continue
+            self._extracted.put((item, pages))
+
+    def _embed_loop(self):
+        while True:
+            entry = self._extracted.get()
+            if entry is _STOP:
+                self._embedded.put(_STOP)
+                return
+            item, pages = entry
+            try:
+                if not pages:
+                    raise AppException("no extractable text")
+                with trace(item["trace_id"]):
+                    points = self.manager.embedder.build_points(pages, tenant=self.tenant)
+            except Exception as e:
+                self._fail(item, "embed", e)
+                continue
+            self._embedded.put((item, len(pages), points))
+
+    def _upsert_loop(self):
+        qdrant = self.manager.qdrant
+        collection = self.manager.collection_name
+        while True:
+            entry = self._embedded.get()
+            if entry is _STOP:
+                return
+            item, page_count, points = entry
+            try:
+                self.journal.record("started", path=item["path"], doc_id=item["doc_id"])
+                with writing(self.manager.write_gate):
+                    # Points from an interrupted attempt, or from an older version
+                    # of the file, are replaced rather than duplicated
+                    if item["path"] in self.journal.started or item["path"] in self.journal.done:
+                        qdrant.delete(
+                            collection_name=collection,
+                            points_selector=FilterSelector(filter=build_filter(doc_ids=[item["doc_id"]], tenant=self.tenant)),
+                            wait=True,
+                        )
+                    for i in range(0, len(points), self.upsert_batch_size):
+                        qdrant.upsert(collection_name=collection, points=points[i : i + self.upsert_batch_size])
+            except Exception as e:
+                self._fail(item, "upsert", e)
+                continue
+            self.journal.record(
+                "done", path=item["path"], fingerprint=item["fingerprint"],
+                doc_id=item["doc_id"], pages=page_count, chunks=len(points),
+            )
+            with self._lock:
+                self.stats["done"] += 1
+                self.stats["pages"] += page_count
+                self.stats["chunks"] += len(points)
+
+    def _fail(self, item: Dict, stage: str, error: Exception):
+        message = error.message if isinstance(error, AppException) else str(error)
+        with trace(item["trace_id"]):
+            logger.warning(f"BulkIngester: {stage} failed for '{item['path']}': {message}")
+        self.journal.record("failed", path=item["path"], doc_id=item["doc_id"], stage=stage, error=message)
+        with self._lock:
+            self.stats["failed"] += 1
+
+    # --- progress -------------------------------------------------------------
+
+    def _report_loop(self):
+        while not self._finished.wait(self.report_every):
+            self._report()
+
+    def _report(self, final: bool = False):
+        with self._lock:
+            stats = dict(self.stats)
+        elapsed = max(time.monotonic() - self._started_at, 1e-6)
+        processed = stats["done"] + stats["failed"]
+        rate = processed / elapsed
+        eta = f"{(stats['total'] - processed) / rate:.0f}s" if rate else "?"
+        line = (
+            f"[{processed}/{stats['total']} docs | {stats['failed']} failed | "
+            f"{rate:.2f} docs/s, {stats['pages'] / elapsed:.1f} pages/s, {stats['chunks'] / elapsed:.1f} chunks/s | "
+            f"queued: extract {self._todo.qsize()}, embed {self._extracted.qsize()}, upsert {self._embedded.qsize()} | "
+            + (f"done in {elapsed:.0f}s]" if final else f"ETA {eta}]")
+        )
+        # Redraw in place on a terminal, one line per report otherwise
+        if sys.stderr.isatty() and not final:
+            sys.stderr.write("\r" + line)
+        else:
+            sys.stderr.write(("\n" if sys.stderr.isatty() else "") + line + "\n")
+        sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python -m context.bulk_ingest data/papers --workers 4
+    #   python -m context.bulk_ingest --manifest files.txt --tenant acme
+    # Re-running the same command resumes from the journal.
+    parser = argparse.ArgumentParser(description="Offline bulk ingestion of PDFs into Qdrant")
+    parser.add_argument("directory", nargs="?", help="Directory to walk for *.pdf files")
+    parser.add_argument("--manifest", help="File listing one PDF path per line")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL, help="Checkpoint journal (JSONL)")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel extraction threads")
+    parser.add_argument("--queue-size", type=int, default=8, help="Documents buffered between stages")
+    parser.add_argument("--tenant", default=None)
+    parser.add_argument("--backend", default=None, help="Extraction backend (default: EXTRACT_BACKEND)")
+    parser.add_argument("--report-every", type=float, default=5.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+    if bool(args.directory) == bool(args.manifest):
+        parser.error("give either a directory or --manifest")
+
+    from qdrant_client import QdrantClient
+    from context.context_manager import ContextManager
+
+    host = os.getenv("QDRANT_HOST", "localhost")
+    port = int(os.getenv("QDRANT_PORT", "6334"))
+    manager = ContextManager(QdrantClient(host=host, port=port, prefer_grpc=True))
+    # Offline: there are no queries to protect, so batches needn't take turns
+    manager.embedder.scheduler = None
+
+    paths = read_manifest(args.manifest) if args.manifest else find_pdfs(args.directory)
+    journal = Journal(args.journal)
+    try:
+        summary = BulkIngester(
+            manager, journal, workers=args.workers, queue_size=args.queue_size,
+            tenant=args.tenant, backend=args.backend, report_every=args.report_every,
+        ).run(paths)
+    except KeyboardInterrupt:
+        print("\nInterrupted; re-run the same command to resume.", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        journal.close()
+    print(json.dumps(summary))
+    sys.exit(1 if summary["failed"] else 0)
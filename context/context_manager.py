@@ -1,120 +1,733 @@
+from agents.encoders import load_encoder
 from agents.ingestion_agent import IngestionAgent
 from agents.rag_agent import LLMAgent
 from agents.retrieval_agent import RetrievalAgent
 from agents.vector_embedding_agent import VectorEmbeddingAgent
+from context.reindex import Reindexer
+from context.query_log import QueryLog
+from context.sessions import (
+    SESSION_HISTORY_TOKENS, SESSION_REUSE_MIN_SCORE, SessionStore, compact_history, is_follow_up,
+)
+from context.singleflight import SingleFlight
+from context.warmup import CacheWarmer
+from common.cache import TTLCache
+from common.config import COLLECTION_NAME, DEFAULT_TENANT
+from common.deadline import Deadline, DeadlineExceeded, MAX_QUERY_DEADLINE_S, RETRIEVAL_BUDGET_SHARE
 from common.exception import AppException
-from typing import List,Dict
+from common.scheduler import BULK, INTERACTIVE, Overloaded, PriorityScheduler, slot
+from common.write_gate import WriteGate, writing
+from typing import Dict, Iterator, List, Optional, Tuple
 from qdrant_client import QdrantClient
-from common.logging import logger
-from qdrant_client.http.models import VectorParams, Distance
+from common.logging import logger, trace
+from common.qdrant_utils import build_filter, ensure_collection, ensure_payload_indexes
+from qdrant_client.http.models import (
+    DeleteOperation,
+    FieldCondition,
+    Filter,
+    FilterSelector,
+    MatchValue,
+    PointsList,
+    UpsertOperation,
+)
+import os
+import threading
+import time
+import uuid
+
+# Returned without calling the LLM when no passage clears the score floor
+NO_ANSWER = "I don't know."
+# Query answers and retrievals, cached until the index changes (or the TTL,
+# which bounds staleness when another worker process changed the index)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL_S = float(os.getenv("QUERY_CACHE_TTL_S", "3600"))
+# Query vectors only depend on the text and the encoder
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+# Upper bound on how stale the in-memory vector count may get
+VECTOR_COUNT_TTL_S = float(os.getenv("VECTOR_COUNT_TTL_S", "60"))
 
 class ContextManager:
-    def __init__(self, qdrant_client: QdrantClient):
+    def __init__(self, qdrant_client: QdrantClient, collection_name: str = COLLECTION_NAME):
         self.qdrant = qdrant_client
-        self.collection_name ="pdf_chunks"
+        self.collection_name = collection_name
         self.ingestor = IngestionAgent()
-        self.embedder = VectorEmbeddingAgent(qdrant_client=self.qdrant)
-        self.retriever = RetrievalAgent(qdrant_client=self.qdrant)
+        # One encoder instance serves ingestion, retrieval and text re-indexing
+        self.encoder = load_encoder()
+        # Queries get the encoder and Qdrant ahead of ingestion batches
+        self.scheduler = PriorityScheduler()
+        # Index writes are held back while a re-index switches collections
+        self.write_gate = WriteGate()
+        self.embedder = VectorEmbeddingAgent(
+            collection_name=self.collection_name, qdrant_client=self.qdrant,
+            embedding_model=self.encoder, scheduler=self.scheduler, write_gate=self.write_gate,
+        )
+        self.embedding_cache = TTLCache(EMBEDDING_CACHE_SIZE)
+        self.retrieval_cache = TTLCache(QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL_S)
+        self.answer_cache = TTLCache(QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL_S)
+        # Bumped on every index change; results computed before it aren't cached
+        self._cache_generation = 0
+        self._cache_lock = threading.Lock()
+        self.retriever = RetrievalAgent(
+            collection_name=self.collection_name, qdrant_client=self.qdrant,
+            embedding_model=self.encoder, scheduler=self.scheduler,
+            embedding_cache=self.embedding_cache,
+        )
         self.llm_agent = LLMAgent()
+        self.reindexer = Reindexer(
+            self.qdrant,
+            alias=self.collection_name,
+            embedding_model=self.encoder,
+            on_switch=self._on_alias_switch,
+            scheduler=self.scheduler,
+            write_gate=self.write_gate,
+        )
+        # Identical questions asked concurrently share one retrieval + LLM call
+        self.query_flights = SingleFlight("query")
+        # Asked questions, replayed to re-warm the caches at startup and after
+        # index changes
+        self.query_log = QueryLog()
+        self.warmer = CacheWarmer(self, self.query_log)
+        # Multi-turn conversations (history + the last turn's contexts)
+        self.sessions = SessionStore()
         self._collection_initialized = False
-        
+        # Point count kept in memory and adjusted by ingest/delete/replace,
+        # so /status and the query guard never have to ask Qdrant
+        self._vector_count: Optional[int] = None
+        self._count_refreshed_at = 0.0
+        self._count_lock = threading.Lock()
+
+    @property
+    def vector_count(self) -> int:
+        # The periodic re-read only matters with several workers, where another
+        # process may have ingested or deleted since our last update
+        if self._vector_count is None or time.monotonic() - self._count_refreshed_at > VECTOR_COUNT_TTL_S:
+            return self.refresh_vector_count()
+        return self._vector_count
+
+    def refresh_vector_count(self) -> int:
+        """
+        Re-read the point count from Qdrant (startup and after an alias swap).
+        A missing collection counts as zero.
+        """
+        try:
+            count = self.qdrant.count(collection_name=self.collection_name, exact=True).count
+        except Exception as e:
+            try:
+                exists = self.qdrant.collection_exists(self.collection_name)
+            except Exception:
+                exists = True
+            if exists:
+                raise AppException("Error fetching Qdrant status", status_code=500, error_detail=e)
+            count = 0
+        with self._count_lock:
+            self._vector_count = count
+            self._count_refreshed_at = time.monotonic()
+        return count
+
+    def _adjust_vector_count(self, delta: int):
+        with self._count_lock:
+            if self._vector_count is not None:
+                self._vector_count = max(0, self._vector_count + delta)
 
     def _ensure_collection(self):
         """
         This helper is called right before inserting vectors into Qdrant.
-        It checks if the collection exists; if not, creates it. All exceptions
-        are wrapped in AppException so FastAPI handles them properly.
+        It checks if the collection (or the alias pointing at it) exists; if
+        not, creates a versioned collection behind an alias. The keyword
+        payload indexes used for tenant/doc_id/source filtering are (re)ensured
+        either way. All exceptions are wrapped in AppException so FastAPI
+        handles them properly.
         """
         if self._collection_initialized:
             return
 
         try:
-            exists = self.qdrant.collection_exists(self.collection_name)
+            target = ensure_collection(self.qdrant, self.collection_name)
         except Exception as e:
             # Qdrant might not be ready or the connection failed
             raise AppException(
-                f"ContextManager: cannot reach Qdrant to check collection '{self.collection_name}': {e}",
+                f"ContextManager: failed to ensure collection '{self.collection_name}': {e}",
                 status_code=500
             )
 
-        if not exists:
+        ensure_payload_indexes(self.qdrant, target)
+        self._collection_initialized = True
+
+    def ingest(
+        self,
+        file_paths: List[str],
+        tenant: Optional[str] = None,
+        source_names: Optional[List[str]] = None,
+        backend: Optional[str] = None,
+    ) -> Dict:
+        """
+        Ingest multiple PDFs, returning a list of page-level documents.
+        Points are tagged with `tenant` so queries can be scoped to it.
+        `backend` overrides the extraction backend ("auto" by default).
+        """
+        # Outside the API (CLI, scripts) this opens a trace of its own
+        with trace():
+            try:
+                #1. Extract pages
+                doc_res = self.ingestor.run(file_paths, source_names=source_names, backend=backend)
+                pages = doc_res["documents"]
+                self._ensure_collection()
+                #2. chunk and embed
+                embed_res= self.embedder.run(pages, tenant=tenant)
+                self._adjust_vector_count(embed_res['points_inserted'])
+                self._index_changed("ingest")
+                self.indexed= True
+                logger.info(
+                    "Ingested %d pages (%d chunks) into '%s'", len(pages), embed_res['points_inserted'], self.collection_name
+                )
+                return {
+                    "status": "Ingested",
+                    "pages": len(pages),
+                    "chunks": embed_res['points_inserted'],
+                    "doc_ids": list(dict.fromkeys(p["doc_id"] for p in pages))
+                }
+
+            except AppException:
+                raise
+            except Exception as e:
+                # Catch any unexpected error
+                raise AppException("Unexpected ingestion error", status_code=500, error_detail=e)
+
+    def list_documents(self, tenant: Optional[str] = None) -> List[Dict]:
+        """
+        Return one entry per indexed document with its page and chunk counts.
+        Only the small identifying payload fields are scrolled; vectors and
+        chunk text are never transferred.
+        """
+        docs: Dict[str, Dict] = {}
+        pages: Dict[str, set] = {}
+        offset = None
+        try:
+            while True:
+                # One bulk slot per page: a long listing yields to queries
+                # between pages instead of holding a slot throughout
+                with slot(self.scheduler, BULK):
+                    points, offset = self.qdrant.scroll(
+                        collection_name=self.collection_name,
+                        scroll_filter=build_filter(tenant=tenant),
+                        limit=1024,
+                        offset=offset,
+                        with_payload=["doc_id", "source", "tenant", "page_number", "page_end"],
+                        with_vectors=False,
+                    )
+                for point in points:
+                    payload = point.payload or {}
+                    doc_id = payload.get("doc_id")
+                    if doc_id is None:
+                        continue
+                    if doc_id not in docs:
+                        docs[doc_id] = {
+                            "doc_id": doc_id,
+                            "source": payload.get("source"),
+                            "tenant": payload.get("tenant") or DEFAULT_TENANT,
+                            "pages": 0,
+                            "chunks": 0,
+                        }
+                        pages[doc_id] = set()
+                    docs[doc_id]["chunks"] += 1
+                    # A chunk covers every page from page_number to page_end
+                    first = payload.get("page_number")
+                    last = payload.get("page_end") or first
+                    if isinstance(first, int) and isinstance(last, int):
+                        pages[doc_id].update(range(first, last + 1))
+                    else:
+                        pages[doc_id].add(first)
+                if offset is None:
+                    break
+        except Overloaded:
+            raise
+        except Exception as e:
+            if not self.qdrant.collection_exists(self.collection_name):
+                return []
+            raise AppException("ContextManager: failed to list documents", status_code=500, error_detail=e)
+
+        for doc_id, doc in docs.items():
+            doc["pages"] = len(pages[doc_id])
+        return list(docs.values())
+
+    def _count_document_points(self, doc_id: str, tenant: Optional[str] = None) -> int:
+        try:
+            return self.qdrant.count(
+                collection_name=self.collection_name,
+                count_filter=build_filter(tenant=tenant, doc_ids=[doc_id]),
+                exact=True,
+            ).count
+        except Exception as e:
+            raise AppException(f"ContextManager: failed to look up document '{doc_id}'", status_code=500, error_detail=e)
+
+    def delete_document(self, doc_id: str, tenant: Optional[str] = None) -> Dict:
+        """
+        Remove every chunk of `doc_id` in `tenant` (DEFAULT_TENANT when not
+        given) with a single filter-based delete on the indexed payload keys.
+        """
+        existing = self._count_document_points(doc_id, tenant)
+        if existing == 0:
+            raise AppException(f"Document '{doc_id}' not found", status_code=404)
+        with writing(self.write_gate), slot(self.scheduler, BULK):
             try:
-                # Recreate (or create) collection with default settings
-                params = VectorParams(size=384, distance=Distance.COSINE)
-                self.qdrant.recreate_collection(
+                self.qdrant.delete(
                     collection_name=self.collection_name,
-                    vectors_config=params,
+                    points_selector=FilterSelector(filter=build_filter(tenant=tenant, doc_ids=[doc_id])),
+                    wait=True,
                 )
-                logger.info(f"Created Qdrant collection '{self.collection_name}'.")
             except Exception as e:
-                raise AppException(
-                    f"ContextManager: failed to create collection '{self.collection_name}': {e}",
-                    status_code=500
+                raise AppException(f"ContextManager: failed to delete document '{doc_id}'", status_code=500, error_detail=e)
+        self._adjust_vector_count(-existing)
+        self._index_changed("delete")
+        logger.info("Deleted document '%s' (%d chunks) from '%s'", doc_id, existing, self.collection_name)
+        return {"status": "Deleted", "doc_id": doc_id, "chunks": existing}
+
+    def replace_document(
+        self,
+        doc_id: str,
+        file_path: str,
+        tenant: Optional[str] = None,
+        source_name: Optional[str] = None,
+    ) -> Dict:
+        """
+        Re-ingest `file_path` under the existing `doc_id` of `tenant`
+        (DEFAULT_TENANT when not given). The new revision's points and the
+        delete of every older revision are sent as one batched update, so
+        searches never see the document missing or duplicated.
+        """
+        tenant = tenant or DEFAULT_TENANT
+        doc_filter = build_filter(tenant=tenant, doc_ids=[doc_id])
+        try:
+            existing = self.qdrant.count(
+                collection_name=self.collection_name,
+                count_filter=doc_filter,
+                exact=True,
+            ).count
+        except Exception as e:
+            raise AppException(f"ContextManager: failed to look up document '{doc_id}'", status_code=500, error_detail=e)
+        if not existing:
+            raise AppException(f"Document '{doc_id}' not found", status_code=404)
+        previous_chunks = existing
+
+        pages = self.ingestor.run(
+            [file_path], doc_ids=[doc_id], source_names=[source_name] if source_name else None
+        )["documents"]
+        if not pages:
+            raise AppException(f"No extractable text in '{file_path}'", status_code=400)
+        self._ensure_collection()
+        revision = str(uuid.uuid4())
+        points = self.embedder.build_points(pages, tenant=tenant, revision=revision)
+
+        stale = Filter(
+            must=doc_filter.must,
+            must_not=[FieldCondition(key="revision", match=MatchValue(value=revision))],
+        )
+        with writing(self.write_gate), slot(self.scheduler, BULK):
+            try:
+                self.qdrant.batch_update_points(
+                    collection_name=self.collection_name,
+                    update_operations=[
+                        UpsertOperation(upsert=PointsList(points=points)),
+                        DeleteOperation(delete=FilterSelector(filter=stale)),
+                    ],
+                    wait=True,
                 )
+            except Exception as e:
+                raise AppException(f"ContextManager: failed to replace document '{doc_id}'", status_code=500, error_detail=e)
 
-        self._collection_initialized = True
+        self._adjust_vector_count(len(points) - previous_chunks)
+        self._index_changed("replace")
+        logger.info("Replaced document '%s' with revision %s (%d chunks)", doc_id, revision, len(points))
+        return {
+            "status": "Replaced",
+            "pages": len(pages),
+            "chunks": len(points),
+            "doc_ids": [doc_id]
+        }
+
+
+
+    def _check_available(self):
+        try:
+            available = self.vector_count
+        except AppException as e:
+            logger.exception("Error checking vector store before query")
+            raise AppException(
+                message="Error accessing vector store.",
+                status_code=500,
+                error_detail=e.error_detail
+            )
+        if available == 0:
+            # Don't turn a user away on a cached zero; confirm with Qdrant first
+            available = self.refresh_vector_count()
+        if available == 0:
+            raise AppException(
+                message="No documents available to query. Please ingest at least one document first.",
+                status_code=400
+            )
 
-    def ingest(self, file_paths: List[str]) -> Dict:
+    def query(
+        self,
+        question: str,
+        top_k: int = None,
+        tenant: Optional[str] = None,
+        doc_ids: Optional[List[str]] = None,
+        sources: Optional[List[str]] = None,
+        deadline: Optional[float] = None,
+        window: Optional[int] = None,
+    ) -> Dict:
         """
-        Ingest multiple PDFs, returning a list of page-level documents.
+        Answer `question` from the indexed chunks, optionally restricted to a
+        tenant and/or a subset of documents (by doc_id or source filename).
+        Concurrent identical requests are answered by a single pipeline run,
+        and answers are cached until the index changes. Every call is
+        recorded in the query log.
+
+        `deadline` (seconds, capped server-side) bounds the whole pipeline. If
+        generation runs out of time the retrieved contexts are still returned,
+        with status "generation timed out" and an empty answer. When no
+        passage is relevant enough the LLM is skipped and the answer is
+        "I don't know." with status "no relevant passages".
+
+        Each matched chunk is returned together with `window` neighbouring
+        chunks on either side (default RETRIEVAL_EXPAND_WINDOW; 0 disables).
         """
+        budget = Deadline.for_request(deadline)
+        filters = {"tenant": tenant, "doc_ids": doc_ids, "sources": sources}
+        with trace() as trace_id:
+            self._check_available()
+            key = _query_key(question, top_k, window=window, **filters)
+            started = time.perf_counter()
+            result = self.answer_cache.get(key)
+            cached = result is not None
+            if cached:
+                result = dict(result)
+            else:
+                # The deadline is part of the flight key so nobody inherits a
+                # shorter budget's timeout
+                result = self.query_flights.do(
+                    key + (budget.seconds,), lambda: self._answer(question, top_k, budget, window, **filters)
+                )
+            self._log_query(question, key, result, started, cached, trace_id)
+            return result
+
+    def _retrieve(self, question: str, top_k: int, budget: Deadline, window: Optional[int] = None,
+                  work_class: str = INTERACTIVE, **filters) -> List[Dict]:
+        key = _query_key(question, top_k, window=window, **filters)
+        hits = self.retrieval_cache.get(key)
+        if hits is not None:
+            return hits
+        generation = self._cache_generation
+        stage = budget.stage(RETRIEVAL_BUDGET_SHARE)
         try:
-            #1. Extract pages
-            doc_res = self.ingestor.run(file_paths)
-            pages = doc_res["documents"]
-            self._ensure_collection()
-            #2. chunk and embed
-            embed_res= self.embedder.run(pages)
-            print(len(pages))
-            print(embed_res['points_inserted'])
-            self.indexed= True
-            logger.info("Ingested %d documents into '%s'", len(pages), self.collection_name)
-            return {
-                "status": "Ingested",
-                "pages": len(pages),
-                "chunks": embed_res['points_inserted']
-            }
-             
-        except Exception as e:
-            # Catch any unexpected error
-            raise AppException("Unexpected ingestion error",e)
-        
+            hits = self.retriever.run(
+                question, top_k, timeout=stage.remaining(), window=window, work_class=work_class, **filters
+            )["results"]
+        except Overloaded:
+            raise
+        except AppException as e:
+            if stage.expired():
+                raise DeadlineExceeded("Retrieval timed out", error_detail=e.error_detail)
+            raise
+        if budget.expired():
+            raise DeadlineExceeded("Retrieval timed out")
+        self._cache_put(self.retrieval_cache, key, hits, generation)
+        return hits
+
+    def _answer(self, question: str, top_k: int, budget: Deadline, window: Optional[int] = None,
+                work_class: str = INTERACTIVE, **filters) -> Dict:
+        generation = self._cache_generation
+        # 1. Retrieve top-K contexts (widened to their neighbouring chunks)
+        hits = self._retrieve(question, top_k, budget, window, work_class, **filters)
+        if not hits:
+            result = {"answer": NO_ANSWER, "contexts": [], "status": "no relevant passages"}
+        else:
+            # 2. Generate answer via LLM with whatever time is left
+            try:
+                answer = self.llm_agent.run(question, hits, timeout=budget.remaining())["answer"]
+            except DeadlineExceeded as e:
+                logger.warning(f"ContextManager: {e.message}; returning contexts only")
+                return {"answer": "", "contexts": hits, "status": "generation timed out"}
+            result = {"answer": answer, "contexts": hits, "status": "ok"}
+        self._cache_put(self.answer_cache, _query_key(question, top_k, window=window, **filters), result, generation)
+        return dict(result)
+
+    def query_stream(
+        self,
+        question: str,
+        top_k: int = None,
+        tenant: Optional[str] = None,
+        doc_ids: Optional[List[str]] = None,
+        sources: Optional[List[str]] = None,
+        deadline: Optional[float] = None,
+        window: Optional[int] = None,
+    ) -> Iterator[Dict]:
+        """
+        Streaming variant of `query`. Yields {"type": "contexts"} once, then
+        {"type": "token"} events as the answer is generated, then
+        {"type": "done"} with the full answer and status. Identical
+        concurrent requests attach to the same token stream, replaying what
+        was already sent; a cached answer is sent as a single token. On
+        deadline expiry the stream ends with the partial answer and status
+        "generation timed out".
 
+        Admission and retrieval run before this returns, so overload (503),
+        retrieval timeouts (504) and other retrieval errors surface as the
+        response status; only generation is streamed.
+        """
+        budget = Deadline.for_request(deadline)
+        filters = {"tenant": tenant, "doc_ids": doc_ids, "sources": sources}
+        with trace() as trace_id:
+            self._check_available()
+            key = _query_key(question, top_k, window=window, **filters)
+            started = time.perf_counter()
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                events = _replay(cached)
+            else:
+                generation = self._cache_generation
+                hits = self._retrieve(question, top_k, budget, window, **filters)
+                # The producer thread inherits this trace
+                events = self.query_flights.stream(
+                    key + (budget.seconds,), lambda: self._answer_stream(question, key, hits, budget, generation)
+                )
+            return self._logged_stream(question, key, events, started, cached is not None, trace_id)
 
-    def query(self, question: str, top_k: int = None) -> Dict:
-        if not self._collection_initialized:
+    def _answer_stream(self, question: str, key: tuple, hits: List[Dict], budget: Deadline,
+                       generation: int) -> Iterator[Dict]:
+        yield {"type": "contexts", "contexts": hits}
+        if not hits:
+            answer, status = NO_ANSWER, "no relevant passages"
+        else:
+            parts = []
+            status = "ok"
             try:
-                count_resp = self.qdrant.count(collection_name=self.collection_name)
-                if count_resp.count == 0:
-                    raise AppException(
-                        message="No documents available to query. Please ingest at least one document first.",
-                        status_code=400
-                    )
-                # switch flag if embeddings exist
-                self.indexed = True
+                for text in self.llm_agent.generate_stream(question, hits, timeout=budget.remaining()):
+                    parts.append(text)
+                    yield {"type": "token", "text": text}
+            except DeadlineExceeded as e:
+                logger.warning(f"ContextManager: {e.message}; ending stream early")
+                status = "generation timed out"
+            answer = "".join(parts).strip()
+        if status != "generation timed out":
+            self._cache_put(self.answer_cache, key, {"answer": answer, "contexts": hits, "status": status}, generation)
+        yield {"type": "done", "answer": answer, "status": status}
+
+    def _logged_stream(self, question: str, key: tuple, events: Iterator[Dict], started: float,
+                       cached: bool, trace_id: str) -> Iterator[Dict]:
+        contexts: List[Dict] = []
+        for event in events:
+            if event["type"] == "contexts":
+                contexts = event["contexts"]
+            elif event["type"] == "done":
+                self._log_query(question, key, {"contexts": contexts, "status": event["status"]},
+                                started, cached, trace_id)
+            yield event
+
+    def _log_query(self, question: str, key: tuple, result: Dict, started: float, cached: bool, trace_id: str):
+        normalized, top_k, tenant, doc_ids, sources, window = key
+        self.query_log.record(
+            question=question, key=normalized, top_k=top_k, tenant=tenant,
+            doc_ids=list(doc_ids) or None, sources=list(sources) or None, window=window,
+            latency_ms=round((time.perf_counter() - started) * 1000, 1), cached=cached,
+            status=result.get("status"), hits=[c.get("point_id") for c in result.get("contexts", [])],
+            trace_id=trace_id,
+        )
+
+    # --- chat sessions --------------------------------------------------------
+
+    def create_session(self, tenant: Optional[str] = None, doc_ids: Optional[List[str]] = None,
+                       sources: Optional[List[str]] = None) -> Dict:
+        """Start a conversation; every turn searches within these filters."""
+        return _session_view(self.sessions.create(tenant=tenant, doc_ids=doc_ids, sources=sources))
+
+    def get_session(self, session_id: str) -> Dict:
+        return _session_view(self.sessions.get(session_id))
+
+    def delete_session(self, session_id: str) -> Dict:
+        self.sessions.delete(session_id)
+        return {"status": "Deleted", "session_id": session_id}
+
+    def chat(
+        self,
+        session_id: str,
+        question: str,
+        top_k: Optional[int] = None,
+        deadline: Optional[float] = None,
+        window: Optional[int] = None,
+    ) -> Dict:
+        """
+        Answer the next turn of a session. A follow-up first re-ranks the
+        previous turn's contexts against the question and, if any is still
+        relevant enough, is answered from them without a search; otherwise
+        it is searched, together with the previous question if it is short
+        or refers back to it. Earlier turns
+        reach the LLM as a history compacted to SESSION_HISTORY_TOKENS.
+        Turns bypass the answer cache, since the history shapes the answer.
+        """
+        budget = Deadline.for_request(deadline)
+        with trace():
+            session = self.sessions.get(session_id)
+            self._check_available()
+            with session["lock"]:
+                filters = {"tenant": session["tenant"], "doc_ids": session["doc_ids"], "sources": session["sources"]}
+                previous = session["turns"][-1] if session["turns"] else None
+                hits, reused = self._session_contexts(question, previous, top_k, budget, window, **filters)
+                if not hits:
+                    answer, status = NO_ANSWER, "no relevant passages"
+                else:
+                    try:
+                        answer = self.llm_agent.run(
+                            question, hits, timeout=budget.remaining(),
+                            history=compact_history(session["turns"], SESSION_HISTORY_TOKENS),
+                        )["answer"]
+                        status = "ok"
+                    except DeadlineExceeded as e:
+                        logger.warning(f"ContextManager: {e.message}; returning contexts only")
+                        answer, status = "", "generation timed out"
+                self.sessions.add_turn(session, {
+                    "question": question,
+                    "answer": answer,
+                    "status": status,
+                    "chunk_ids": [c["chunk_id"] for c in hits],
+                    "reused_contexts": reused,
+                    "contexts": hits,
+                    "ts": time.time(),
+                })
                 logger.info(
-                    "Detected %d existing vectors in '%s', enabling queries.",
-                    count_resp.count,
-                    self.collection_name
+                    f"ContextManager: session turn {session['turn_count']} answered from "
+                    f"{'previous' if reused else 'new'} contexts ({len(hits)})"
                 )
-            except AppException:
+                return {
+                    "session_id": session_id,
+                    "turn": session["turn_count"],
+                    "answer": answer,
+                    "contexts": hits,
+                    "status": status,
+                    "reused_contexts": reused,
+                }
+
+    def _session_contexts(self, question: str, previous: Optional[Dict], top_k: Optional[int], budget: Deadline,
+                          window: Optional[int] = None, **filters) -> Tuple[List[Dict], bool]:
+        """The contexts for a turn, and whether they were reused from the previous one."""
+        if previous and previous.get("contexts"):
+            # Re-ranked against the follow-up alone: a follow-up about
+            # something else ("and on page 4?") should not match them
+            stage = budget.stage(RETRIEVAL_BUDGET_SHARE)
+            try:
+                reranked = self.retriever.rerank(question, previous["contexts"], timeout=stage.remaining())
+            except Overloaded:
                 raise
-            except Exception as e:
-                logger.exception("Error checking vector store before query")
-                raise AppException(
-                    message="Error accessing vector store.",
-                    status_code=500,
-                    error_detail=e
-                )
+            except AppException as e:
+                if stage.expired():
+                    raise DeadlineExceeded("Retrieval timed out", error_detail=e.error_detail)
+                raise
+            kept = [c for c in reranked if c["score"] >= SESSION_REUSE_MIN_SCORE]
+            if kept:
+                return (kept if top_k is None else kept[:top_k]), True
+        # A short or referring follow-up ("and the second one?") is searched
+        # with the question before; a self-contained one, e.g. a change of
+        # topic after the rerank rejected the previous contexts, on its own
+        search = question
+        if previous is not None and is_follow_up(question):
+            search = f"{previous['question']} {question}"
+        return self._retrieve(search, top_k, budget, window, **filters), False
+
+    # --- caches ---------------------------------------------------------------
+
+    def _cache_put(self, cache: TTLCache, key: tuple, value, generation: int):
+        # Results computed against an index that has changed since are dropped
+        with self._cache_lock:
+            if generation == self._cache_generation:
+                cache.put(key, value)
+
+    def _index_changed(self, reason: str):
+        """
+        Invalidate cached retrievals and answers after the index changed
+        (query embeddings stay valid) and schedule a warm-up to refill them.
+        """
+        with self._cache_lock:
+            self._cache_generation += 1
+            self.retrieval_cache.clear()
+            self.answer_cache.clear()
+        self.warmer.trigger(reason)
+
+    def _on_alias_switch(self):
+        self.refresh_vector_count()
+        self._index_changed("reindex")
+
+    def warm(
+        self,
+        question: str,
+        top_k: Optional[int] = None,
+        tenant: Optional[str] = None,
+        doc_ids: Optional[List[str]] = None,
+        sources: Optional[List[str]] = None,
+        window: Optional[int] = None,
+        answer: bool = True,
+    ) -> bool:
+        """
+        Fill the query-embedding, retrieval and (with `answer`) answer caches
+        for one question, as bulk work so live queries go first. Not
+        recorded in the query log. Returns False if it was already cached.
+        """
+        filters = {"tenant": tenant, "doc_ids": doc_ids, "sources": sources}
+        key = _query_key(question, top_k, window=window, **filters)
+        if key in (self.answer_cache if answer else self.retrieval_cache):
+            return False
+        self._check_available()
+        budget = Deadline(MAX_QUERY_DEADLINE_S)
+        if answer:
+            self._answer(question, top_k, budget, window, BULK, **filters)
+        else:
+            self._retrieve(question, top_k, budget, window, BULK, **filters)
+        return True
+
+    def cache_stats(self) -> Dict:
+        return {
+            "query_embeddings": self.embedding_cache.stats(),
+            "retrievals": self.retrieval_cache.stats(),
+            "answers": self.answer_cache.stats(),
+        }
+
+
+def _session_view(session: Dict) -> Dict:
+    """A session as returned by the API (no lock, no stored contexts)."""
+    return {
+        "session_id": session["session_id"],
+        "tenant": session["tenant"],
+        "doc_ids": session["doc_ids"],
+        "sources": session["sources"],
+        "created_at": session["created_at"],
+        "turn_count": session["turn_count"],
+        "turns": [{k: v for k, v in turn.items() if k != "contexts"} for turn in session["turns"]],
+    }
+
+
+def _replay(result: Dict) -> Iterator[Dict]:
+    """A cached answer as stream events."""
+    yield {"type": "contexts", "contexts": result["contexts"]}
+    if result["answer"]:
+        yield {"type": "token", "text": result["answer"]}
+    yield {"type": "done", "answer": result["answer"], "status": result["status"]}
+
 
-        # 1. Retrieve top-K contexts
-        hits = self.retriever.run(question, top_k)["results"]
-        # 2. Generate answer via LLM
-        answer = self.llm_agent.run(question, hits)["answer"]
-        return {"answer": answer, "contexts": hits}
+def _query_key(question: str, top_k: Optional[int], tenant: Optional[str] = None,
+               doc_ids: Optional[List[str]] = None, sources: Optional[List[str]] = None,
+               window: Optional[int] = None) -> tuple:
+    """
+    Requests are identical when they differ only in case or whitespace of
+    the question and in the order of their filter values.
+    """
+    return (
+        " ".join(question.split()).casefold(),
+        top_k,
+        tenant,
+        tuple(sorted(set(doc_ids or ()))),
+        tuple(sorted(set(sources or ()))),
+        window,
+    )
 
 if __name__ == "__main__":
-    import os
     manager= ContextManager()
     BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     doc_dir=os.path.join(BASE_DIR,"data")
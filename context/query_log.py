@@ -0,0 +1,202 @@
+import argparse
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+
+from common.logging import logger
+
+# Where answered questions are recorded (JSON lines); "" disables capture
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "data/query_log.jsonl")
+# The log is rotated to <path>.1 at this size; together the two files are
+# the history warm-up replays from
+QUERY_LOG_MAX_MB = float(os.getenv("QUERY_LOG_MAX_MB", "50"))
+# Entries waiting for the writer thread; beyond this they are dropped
+QUERY_LOG_QUEUE_SIZE = 10000
+# Most recent entries whose counts are kept in memory for `top`; older ones
+# no longer count towards warm-up
+QUERY_LOG_TOP_WINDOW = int(os.getenv("QUERY_LOG_TOP_WINDOW", "200000"))
+
+# Fields that identify a distinct request for replay
+_REQUEST_FIELDS = ("top_k", "tenant", "doc_ids", "sources", "window")
+
+
+class QueryLog:
+    """
+    Append-only record of answered questions: the normalized question, the
+    request's filters, latency, whether it was served from cache, and the
+    point ids of the hits. `record` never blocks the request; a writer
+    thread appends the entries. `top` ranks requests from per-request
+    counts kept in memory over the last `window` entries: the log is read
+    once, here, and `record` keeps the counts current.
+    """
+
+    def __init__(self, path: str = QUERY_LOG_PATH, max_bytes: int = int(QUERY_LOG_MAX_MB * 1024 * 1024),
+                 window: int = QUERY_LOG_TOP_WINDOW):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._queue: queue.Queue = queue.Queue(QUERY_LOG_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {"recorded": 0, "dropped": 0}
+        # (group key, ts, uncached latency) per entry, oldest first, and the
+        # running totals per group over them
+        self._window: deque = deque()
+        self._window_size = window
+        self._groups: Dict[tuple, Dict] = {}
+        if self.enabled:
+            for entry in self.entries():
+                self._count(entry)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def record(self, **entry):
+        if not self.enabled:
+            return
+        entry.setdefault("ts", time.time())
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_loop, name="query-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            return
+        with self._lock:
+            self._count(entry)
+
+    def _count(self, entry: Dict):
+        """Add `entry` to the in-memory counts, evicting the oldest beyond the window."""
+        if "key" not in entry or self._window_size <= 0:
+            return
+        request = {field: entry.get(field) for field in _REQUEST_FIELDS}
+        group_key = (entry["key"],) + tuple(json.dumps(request[f], sort_keys=True) for f in _REQUEST_FIELDS)
+        group = self._groups.get(group_key)
+        if group is None:
+            group = self._groups[group_key] = {
+                "group_key": group_key, "count": 0, "latency_sum": 0.0, "latency_n": 0, **request,
+            }
+        # One key tuple shared by all of the group's entries in the window
+        group_key = group["group_key"]
+        ts = entry.get("ts", 0)
+        latency = None if entry.get("cached") else entry.get("latency_ms")
+        group["question"] = entry.get("question", entry["key"])
+        group["last_ts"] = ts
+        self._add(group, 1, latency)
+        self._window.append((group_key, ts, latency))
+        while len(self._window) > self._window_size:
+            old_key, _, old_latency = self._window.popleft()
+            old = self._groups[old_key]
+            self._add(old, -1, old_latency)
+            if not old["count"]:
+                del self._groups[old_key]
+
+    @staticmethod
+    def _add(group: Dict, sign: int, latency: Optional[float]):
+        group["count"] += sign
+        if latency is not None:
+            group["latency_sum"] += sign * latency
+            group["latency_n"] += sign
+
+    def _write_loop(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        while True:
+            entries = [self._queue.get()]
+            # Write whatever else is already waiting in the same append
+            while len(entries) < 512:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._rotate_if_needed()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(e, default=str) + "\n" for e in entries))
+                with self._lock:
+                    self._stats["recorded"] += len(entries)
+            except OSError as e:
+                logger.warning(f"QueryLog: failed to write {len(entries)} entries to '{self.path}': {e}")
+            finally:
+                for _ in entries:
+                    self._queue.task_done()
+
+    def _rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+        except FileNotFoundError:
+            pass
+
+    def flush(self):
+        """Wait until everything recorded so far is on disk."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def entries(self) -> Iterator[Dict]:
+        """Every logged entry, oldest first."""
+        for path in (self.path + ".1", self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+    def top(self, n: int, max_age_s: Optional[float] = None) -> List[Dict]:
+        """
+        The `n` most frequently asked distinct requests (normalized question
+        plus filters), most frequent first. Each comes with its latest
+        original wording, its count and its mean uncached latency.
+        """
+        if not self.enabled:
+            return []
+        since = None if max_age_s is None else time.time() - max_age_s
+        with self._lock:
+            groups = {key: dict(group) for key, group in self._groups.items()}
+            if since is not None:
+                # Take out the window's entries older than the cutoff; the
+                # latest question and timestamp of a group are never among them
+                for group_key, ts, latency in self._window:
+                    if ts >= since:
+                        break
+                    self._add(groups[group_key], -1, latency)
+        ranked = sorted(
+            (g for g in groups.values() if g["count"] > 0),
+            key=lambda g: (g["count"], g["last_ts"]), reverse=True,
+        )[:n]
+        for group in ranked:
+            del group["group_key"]
+            total, count = group.pop("latency_sum"), group.pop("latency_n")
+            group["mean_latency_ms"] = round(total / count, 1) if count else None
+        return ranked
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, path=self.path, queued=self._queue.qsize())
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python -m context.query_log top -n 20 [--days 7]
+    parser = argparse.ArgumentParser(description="Inspect the query log")
+    parser.add_argument("command", choices=["top"])
+    parser.add_argument("-n", type=int, default=20)
+    parser.add_argument("--days", type=float, default=None, help="Only look at the last N days")
+    parser.add_argument("--path", default=QUERY_LOG_PATH)
+    args = parser.parse_args()
+
+    log = QueryLog(args.path)
+    for rank, entry in enumerate(log.top(args.n, None if args.days is None else args.days * 86400), start=1):
+        latency = f"{entry['mean_latency_ms']:.0f} ms" if entry["mean_latency_ms"] is not None else "-"
+        print(f"{rank:3d}. {entry['count']:6d}x  {latency:>8}  {entry['question']}")
@@ -0,0 +1,376 @@
+import argparse
+import contextvars
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+    Distance,
+    Filter,
+    FilterSelector,
+    PointStruct,
+    VectorParams,
+)
+
+from common.config import COLLECTION_NAME, DEFAULT_TENANT
+from common.exception import AppException
+from common.logging import logger
+from common.scheduler import BULK, Overloaded, PriorityScheduler, slot
+from common.write_gate import WriteGate, pausing
+from common.qdrant_utils import (
+    build_filter,
+    collection_versions,
+    ensure_payload_indexes,
+    resolve_collection,
+    versioned_name,
+)
+
+# How many versioned collections (active one included) survive a re-index
+KEEP_VERSIONS = int(os.getenv("REINDEX_KEEP_VERSIONS", "2"))
+# Default copy rate limit so a rebuild doesn't compete with live queries
+DEFAULT_MAX_POINTS_PER_SEC = float(os.getenv("REINDEX_MAX_POINTS_PER_SEC", "500"))
+# Catch-up passes over documents written during the copy before the final,
+# write-blocking pass (which then has little left to do)
+MAX_SYNC_PASSES = 5
+
+
+class Reindexer:
+    """
+    Rebuilds the collection behind the `alias` into a new `<alias>_v<N>`
+    collection in the background, then repoints the alias in one atomic
+    alias update. Agents only ever address the alias, so queries keep hitting
+    the complete old index until the switch.
+
+    Documents written during the copy are re-synced until a pass finds none;
+    the last pass and the switch run with `write_gate` paused, so no write
+    lands in the old collection after it was reconciled. Writes from other
+    processes (e.g. a separate bulk ingester) are not held back.
+
+    Modes:
+      * "vectors" – copy stored vectors and payloads (collection parameter changes)
+      * "text"    – re-encode each chunk's stored text (embedding model changes)
+    """
+
+    MODES = ("vectors", "text")
+
+    def __init__(
+        self,
+        qdrant_client: QdrantClient,
+        alias: str = COLLECTION_NAME,
+        embedding_model=None,
+        on_switch: Optional[Callable[[], object]] = None,
+        scheduler: Optional[PriorityScheduler] = None,
+        write_gate: Optional[WriteGate] = None,
+    ):
+        self.qdrant = qdrant_client
+        self.alias = alias
+        self.embedding_model = embedding_model
+        # Each copied batch is admitted as bulk work, behind live queries
+        self.scheduler = scheduler
+        self.write_gate = write_gate
+        # Called after every alias switch (e.g. to refresh cached counts)
+        self.on_switch = on_switch
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._state: Dict = {"state": "idle"}
+
+    def _update(self, **fields):
+        with self._lock:
+            self._state.update(fields)
+
+    def status(self) -> Dict:
+        with self._lock:
+            state = dict(self._state)
+        try:
+            state["active_collection"] = resolve_collection(self.qdrant, self.alias)
+            state["versions"] = [name for _, name in collection_versions(self.qdrant, self.alias)]
+        except Exception as e:
+            logger.warning(f"Reindexer: unable to read collection state ({e})")
+        return state
+
+    def start(self, **kwargs) -> Dict:
+        """
+        Launch `run` on a background thread; only one re-index may run at a time.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                raise AppException("A re-index is already running", status_code=409)
+            self._state = {"state": "running", "copied": 0}
+            # Logs under the trace of whoever started it
+            context = contextvars.copy_context()
+            self._thread = threading.Thread(
+                target=context.run, args=(self._run_in_background,), kwargs=kwargs, name="reindex", daemon=True
+            )
+            self._thread.start()
+        return self.status()
+
+    def _run_in_background(self, **kwargs):
+        try:
+            self.run(**kwargs)
+        except Exception as e:
+            logger.exception("Reindexer: re-index failed")
+            message = e.message if isinstance(e, AppException) else str(e)
+            self._update(state="failed", error=message, finished_at=time.time())
+
+    def run(
+        self,
+        mode: str = "vectors",
+        batch_size: int = 256,
+        max_points_per_sec: float = DEFAULT_MAX_POINTS_PER_SEC,
+        vectors_config: Optional[VectorParams] = None,
+    ) -> Dict:
+        if mode not in self.MODES:
+            raise AppException(f"Reindexer: unknown mode '{mode}', expected one of {self.MODES}")
+        if mode == "text" and self.embedding_model is None:
+            raise AppException("Reindexer: mode 'text' needs an embedding model", status_code=500)
+
+        source = resolve_collection(self.qdrant, self.alias)
+        if source is None:
+            raise AppException(f"Reindexer: nothing to re-index, '{self.alias}' does not exist", status_code=404)
+
+        versions = collection_versions(self.qdrant, self.alias)
+        target = versioned_name(self.alias, versions[-1][0] + 1 if versions else 1)
+        if vectors_config is None:
+            vectors_config = VectorParams(size=self._vector_size(mode, source), distance=Distance.COSINE)
+
+        total = self.qdrant.count(collection_name=source, exact=True).count
+        self._update(
+            state="running", mode=mode, source=source, target=target,
+            total=total, copied=0, started_at=time.time(), finished_at=None,
+        )
+        logger.info(f"Reindexer: rebuilding '{source}' into '{target}' ({total} points, mode={mode}).")
+
+        self.qdrant.create_collection(collection_name=target, vectors_config=vectors_config)
+        ensure_payload_indexes(self.qdrant, target)
+
+        try:
+            copied = self._copy(source, target, mode, batch_size, max_points_per_sec)
+            # Writes that reached the old collection while we were copying
+            synced = 0
+            for _ in range(MAX_SYNC_PASSES):
+                changed = self._sync(source, target, mode, batch_size, max_points_per_sec)
+                synced += changed
+                if not changed:
+                    break
+            # Hold writes back for the last pass and the switch, unthrottled
+            # to keep the pause short
+            with pausing(self.write_gate):
+                synced += self._sync(source, target, mode, batch_size, 0)
+                self.point_alias(target, previous=source)
+        except Exception:
+            if self.qdrant.collection_exists(source):
+                self.qdrant.delete_collection(target)
+            else:
+                # A failed legacy migration: `target` is the only full copy left
+                logger.error(f"Reindexer: '{source}' is gone, keeping '{target}'; point alias '{self.alias}' at it.")
+            raise
+
+        pruned = self.prune()
+        self._update(state="completed", copied=copied, synced_documents=synced, finished_at=time.time())
+        logger.info(f"Reindexer: '{self.alias}' now points to '{target}' ({copied} points copied).")
+        return {"source": source, "target": target, "copied": copied, "synced_documents": synced, "pruned": pruned}
+
+    def rollback(self) -> Dict:
+        """
+        Point the alias back at the newest collection version older than the
+        active one.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                raise AppException("Cannot roll back while a re-index is running", status_code=409)
+
+        active = resolve_collection(self.qdrant, self.alias)
+        versions = collection_versions(self.qdrant, self.alias)
+        active_version = next((v for v, name in versions if name == active), None)
+        older = [name for v, name in versions if active_version is not None and v < active_version]
+        if not older:
+            raise AppException(f"Reindexer: no previous version of '{self.alias}' to roll back to", status_code=409)
+
+        self.point_alias(older[-1], previous=active)
+        logger.info(f"Reindexer: rolled '{self.alias}' back from '{active}' to '{older[-1]}'.")
+        return {"previous": active, "active_collection": older[-1]}
+
+    def _vector_size(self, mode: str, source: str) -> int:
+        if mode == "text":
+            return self.embedding_model.get_sentence_embedding_dimension()
+        vectors = self.qdrant.get_collection(source).config.params.vectors
+        return vectors.size
+
+    def _copy(
+        self,
+        source: str,
+        target: str,
+        mode: str,
+        batch_size: int,
+        max_points_per_sec: float,
+        scroll_filter: Optional[Filter] = None,
+    ) -> int:
+        copied = 0
+        started = time.monotonic()
+        offset = None
+        while True:
+            points, offset = self.qdrant.scroll(
+                collection_name=source,
+                scroll_filter=scroll_filter,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=(mode == "vectors"),
+            )
+            if points:
+                self._write_batch(target, points, mode)
+                copied += len(points)
+                if scroll_filter is None:
+                    self._update(copied=copied)
+                self._throttle(started, copied, max_points_per_sec)
+            if offset is None:
+                return copied
+
+    def _write_batch(self, target: str, points, mode: str):
+        """Re-encode (text mode) and upsert one batch in a BULK scheduler slot."""
+        while True:
+            try:
+                with slot(self.scheduler, BULK):
+                    self.qdrant.upsert(collection_name=target, points=self._rebuild(points, mode), wait=True)
+                return
+            except Overloaded as e:
+                # A background rebuild just waits its turn
+                time.sleep(e.retry_after)
+
+    def _rebuild(self, points, mode: str) -> List[PointStruct]:
+        # Chunks stored before tenants were stamped join the default tenant,
+        # the only one unscoped requests can still reach
+        payloads = [{"tenant": DEFAULT_TENANT, **(p.payload or {})} for p in points]
+        if mode == "vectors":
+            return [PointStruct(id=p.id, vector=p.vector, payload=payload) for p, payload in zip(points, payloads)]
+        texts = [payload.get("text", "") for payload in payloads]
+        vectors = self.embedding_model.encode(texts)
+        return [
+            PointStruct(id=p.id, vector=vector.tolist(), payload=payload)
+            for p, vector, payload in zip(points, vectors, payloads)
+        ]
+
+    @staticmethod
+    def _throttle(started: float, copied: int, max_points_per_sec: float):
+        if max_points_per_sec <= 0:
+            return
+        ahead = copied / max_points_per_sec - (time.monotonic() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    def _revisions(self, collection: str) -> Dict[str, set]:
+        revisions: Dict[str, set] = {}
+        offset = None
+        while True:
+            points, offset = self.qdrant.scroll(
+                collection_name=collection,
+                limit=1024,
+                offset=offset,
+                with_payload=["doc_id", "revision"],
+                with_vectors=False,
+            )
+            for p in points:
+                payload = p.payload or {}
+                revisions.setdefault(payload.get("doc_id"), set()).add(payload.get("revision"))
+            if offset is None:
+                return revisions
+
+    def _sync(self, source: str, target: str, mode: str, batch_size: int, max_points_per_sec: float) -> int:
+        """
+        Reconcile documents added, replaced or deleted in `source` during the
+        copy, comparing the per-document revision sets of both collections.
+        """
+        before = self._revisions(source)
+        after = self._revisions(target)
+        changed = [doc_id for doc_id in set(before) | set(after) if before.get(doc_id) != after.get(doc_id)]
+        for doc_id in changed:
+            if doc_id is None:
+                continue
+            doc_filter = build_filter(doc_ids=[doc_id], all_tenants=True)
+            self.qdrant.delete(collection_name=target, points_selector=FilterSelector(filter=doc_filter), wait=True)
+            if doc_id in before:
+                self._copy(source, target, mode, batch_size, max_points_per_sec, scroll_filter=doc_filter)
+        if changed:
+            logger.info(f"Reindexer: re-synced {len(changed)} documents changed during the copy.")
+        return len(changed)
+
+    def point_alias(self, target: str, previous: Optional[str]):
+        """
+        Atomically repoint the alias at `target` (`previous` is the
+        collection it currently resolves to).
+        """
+        operations = []
+        if previous == self.alias:
+            # Pre-alias installs: the old index is a real collection named like
+            # the alias, so it has to go before the alias can take its name.
+            # Searches fail from the delete until the alias exists (the update
+            # below, retried); `target` already holds every point.
+            logger.warning(f"Reindexer: dropping legacy collection '{self.alias}' to replace it with an alias.")
+            self.qdrant.delete_collection(self.alias)
+        elif previous is not None:
+            operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=self.alias)))
+        operations.append(
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=self.alias))
+        )
+        attempts = 3 if previous == self.alias else 1
+        for attempt in range(1, attempts + 1):
+            try:
+                self.qdrant.update_collection_aliases(change_aliases_operations=operations)
+                break
+            except Exception as e:
+                if attempt == attempts:
+                    raise AppException(
+                        f"Reindexer: failed to point '{self.alias}' at '{target}'", status_code=500, error_detail=e
+                    )
+                time.sleep(1)
+        if self.on_switch is not None:
+            self.on_switch()
+
+    def prune(self) -> List[str]:
+        """Delete collection versions beyond the newest KEEP_VERSIONS, never the active one."""
+        active = resolve_collection(self.qdrant, self.alias)
+        stale = [name for _, name in collection_versions(self.qdrant, self.alias)[:-KEEP_VERSIONS]]
+        pruned = [name for name in stale if name != active]
+        for name in pruned:
+            self.qdrant.delete_collection(name)
+            logger.info(f"Reindexer: deleted old collection '{name}'.")
+        return pruned
+
+
+if __name__ == "__main__":
+    # Usage: python -m context.reindex {run,rollback,status} [--mode text] [--rate 500]
+    parser = argparse.ArgumentParser(description="Zero-downtime re-index of the Qdrant collection")
+    parser.add_argument("command", choices=["run", "rollback", "status"])
+    parser.add_argument("--mode", choices=Reindexer.MODES, default="vectors")
+    parser.add_argument("--rate", type=float, default=DEFAULT_MAX_POINTS_PER_SEC,
+                        help="Max points copied per second (0 = unthrottled)")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    host = os.getenv("QDRANT_HOST", "localhost")
+    port = int(os.getenv("QDRANT_PORT", "6334"))
+    client = QdrantClient(host=host, port=port, prefer_grpc=True)
+
+    model = None
+    if args.command == "run" and args.mode == "text":
+        from agents.encoders import load_encoder
+        model = load_encoder()
+
+    reindexer = Reindexer(client, embedding_model=model)
+    try:
+        if args.command == "run":
+            print(reindexer.run(mode=args.mode, batch_size=args.batch_size, max_points_per_sec=args.rate))
+        elif args.command == "rollback":
+            print(reindexer.rollback())
+        else:
+            print(reindexer.status())
+    except AppException as e:
+        print(f"Error: {e}")
+        if e.error_detail:
+            print(f"Detail: {e.error_detail}")
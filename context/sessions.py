@@ -0,0 +1,115 @@
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from common.cache import TTLCache
+from common.exception import AppException
+
+# Sessions without a turn for this long are forgotten
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "86400"))
+# Sessions kept in memory; beyond this the least recently used are evicted
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+# Turns stored per session; the history sent to the LLM is compacted further
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "50"))
+# Budget for earlier turns in the prompt (~4 characters per token)
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "800"))
+# A follow-up is answered from the previous turn's contexts, re-ranked,
+# when at least one of them is this similar to it; otherwise it is searched
+SESSION_REUSE_MIN_SCORE = float(os.getenv("SESSION_REUSE_MIN_SCORE", "0.5"))
+# Follow-ups this short (in words) are searched together with the previous
+# question, as are longer ones referring back to it; others stand alone
+SESSION_FOLLOW_UP_MAX_WORDS = int(os.getenv("SESSION_FOLLOW_UP_MAX_WORDS", "5"))
+
+# Words by which a follow-up refers to the previous turn
+_ANAPHORA = {"it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "she", "his", "her",
+             "there", "same", "such", "above", "former", "latter"}
+
+
+class SessionStore:
+    """
+    In-memory chat sessions: the filters a conversation is scoped to and
+    its turns (question, answer, status, chunk ids). Only the latest turn
+    keeps its full contexts, for the next turn to re-rank. Sessions live in
+    the API process, so several workers need sticky routing.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl: float = SESSION_TTL_S,
+                 max_turns: int = SESSION_MAX_TURNS):
+        self.max_turns = max_turns
+        self._sessions = TTLCache(max_sessions, ttl=ttl)
+
+    def create(self, tenant: Optional[str] = None, doc_ids: Optional[List[str]] = None,
+               sources: Optional[List[str]] = None) -> Dict:
+        session = {
+            "session_id": uuid.uuid4().hex,
+            "tenant": tenant,
+            "doc_ids": doc_ids,
+            "sources": sources,
+            "created_at": time.time(),
+            "turns": [],
+            "turn_count": 0,
+            # One turn at a time, so each sees the one before it
+            "lock": threading.Lock(),
+        }
+        self._sessions.put(session["session_id"], session)
+        return session
+
+    def get(self, session_id: str) -> Dict:
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise AppException(f"Session '{session_id}' not found (or expired)", status_code=404)
+        return session
+
+    def add_turn(self, session: Dict, turn: Dict):
+        if session["turns"]:
+            session["turns"][-1].pop("contexts", None)
+        session["turns"].append(turn)
+        del session["turns"][:-self.max_turns]
+        session["turn_count"] += 1
+        # Re-storing restarts the idle timeout
+        self._sessions.put(session["session_id"], session)
+
+    def delete(self, session_id: str):
+        if self._sessions.pop(session_id) is None:
+            raise AppException(f"Session '{session_id}' not found (or expired)", status_code=404)
+
+    def stats(self) -> Dict:
+        return self._sessions.stats()
+
+
+def is_follow_up(question: str) -> bool:
+    """Whether `question` likely only makes sense with the previous one."""
+    words = re.findall(r"[a-z']+", question.lower())
+    return len(words) <= SESSION_FOLLOW_UP_MAX_WORDS or any(w in _ANAPHORA for w in words)
+
+
+def _tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def compact_history(turns: List[Dict], budget: int = SESSION_HISTORY_TOKENS) -> str:
+    """
+    Earlier turns as prompt text within `budget` tokens, newest first in
+    priority: recent turns keep question and answer, older ones only their
+    question, and the oldest are left out with a note saying how many.
+    """
+    lines: List[str] = []
+    used, kept = 0, 0
+    for turn in reversed(turns):
+        full = f"User: {turn['question']}\nAssistant: {turn['answer'] or '(no answer)'}"
+        short = f"User: {turn['question']}"
+        if used + _tokens(full) <= budget:
+            lines.append(full)
+            used += _tokens(full)
+        elif used + _tokens(short) <= budget:
+            lines.append(short)
+            used += _tokens(short)
+        else:
+            break
+        kept += 1
+    if kept < len(turns):
+        lines.append(f"({len(turns) - kept} earlier turns omitted)")
+    return "\n".join(reversed(lines))
@@ -0,0 +1,193 @@
+import contextvars
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+
+from common.logging import get_trace_id, logger
+
+
+class _Call:
+    """Outcome of one in-flight call, shared by its leader and followers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.trace_id = get_trace_id()
+
+
+class _Broadcast:
+    """
+    Append-only event buffer written by one producer thread. Every subscriber
+    replays what was produced before it attached, then follows live events.
+    Once the last subscriber has gone before the end, it is `abandoned`.
+    """
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.finished = False
+        self.abandoned = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.subscribers = 0
+        self.trace_id = get_trace_id()
+        self._cond = threading.Condition()
+
+    def attach(self) -> bool:
+        """Count one more subscriber; False if the stream was already abandoned."""
+        with self._cond:
+            if self.abandoned:
+                return False
+            self.subscribers += 1
+            return True
+
+    def _detach(self):
+        with self._cond:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished:
+                self.abandoned = True
+
+    def publish(self, item: Any):
+        with self._cond:
+            self.items.append(item)
+            self._cond.notify_all()
+
+    def close(self, error: Optional[BaseException] = None):
+        with self._cond:
+            self.finished = True
+            self.error = error
+            self._cond.notify_all()
+
+    def subscribe(self) -> Iterator[Any]:
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self.items) and not self.finished:
+                        self._cond.wait()
+                    if index < len(self.items):
+                        item = self.items[index]
+                        index += 1
+                    elif self.error is not None:
+                        raise self.error
+                    else:
+                        return
+                yield item
+        finally:
+            self._detach()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller (the
+    leader) runs the work, callers arriving while it is in flight wait for
+    and receive the leader's result or exception. Nothing is cached; once the
+    leader finishes, the next call with the same key runs again.
+
+    `stream` does the same for generators. The producer runs on its own
+    thread so a disconnecting leader does not cut off its followers; once
+    every subscriber has disconnected it is closed at its next event, and a
+    later call with the key starts a new one.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+        self._stats = {
+            "leaders": 0, "coalesced": 0, "errors": 0,
+            "stream_leaders": 0, "stream_coalesced": 0, "stream_abandoned": 0,
+        }
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+            else:
+                call.followers += 1
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            logger.debug(f"{self.name}: joining in-flight call of trace {call.trace_id}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+            if call.followers:
+                logger.info(f"{self.name}: served {call.followers} coalesced callers from one call")
+        return call.result
+
+    def stream(self, key: Hashable, produce: Callable[[], Iterable[Any]]) -> Iterator[Any]:
+        """
+        Return an iterator over the events of `produce()`, sharing one
+        producer between all concurrent subscribers of `key`.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            if broadcast is not None and not broadcast.attach():
+                # Its producer is winding down with nobody listening
+                broadcast = None
+            if broadcast is None:
+                broadcast = self._streams[key] = _Broadcast()
+                broadcast.attach()
+                self._stats["stream_leaders"] += 1
+                # The producer logs under the leader's trace
+                context = contextvars.copy_context()
+                threading.Thread(
+                    target=context.run, args=(self._pump, key, broadcast, produce),
+                    name=f"{self.name}-stream", daemon=True,
+                ).start()
+            else:
+                broadcast.followers += 1
+                self._stats["stream_coalesced"] += 1
+                logger.debug(f"{self.name}: joining in-flight stream of trace {broadcast.trace_id}")
+        return broadcast.subscribe()
+
+    def _pump(self, key: Hashable, broadcast: _Broadcast, produce: Callable[[], Iterable[Any]]):
+        error = None
+        events = iter(produce())
+        try:
+            for item in events:
+                if broadcast.abandoned:
+                    logger.info(f"{self.name}: every subscriber disconnected, stopping the stream")
+                    with self._lock:
+                        self._stats["stream_abandoned"] += 1
+                    break
+                broadcast.publish(item)
+        except BaseException as e:
+            error = e
+            with self._lock:
+                self._stats["errors"] += 1
+        finally:
+            # Closing a generator producer lets it cancel its own work (e.g. the LLM call)
+            close = getattr(events, "close", None)
+            if close is not None:
+                close()
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            broadcast.close(error)
+            if broadcast.followers:
+                logger.info(f"{self.name}: streamed to {broadcast.followers} coalesced subscribers from one call")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls) + len(self._streams)
+        return stats
@@ -0,0 +1,263 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, OptimizersConfigDiff, PointStruct, VectorParams
+
+from common.config import COLLECTION_NAME, DEFAULT_TENANT
+from common.exception import AppException
+from common.logging import logger
+from common.qdrant_utils import collection_versions, ensure_payload_indexes, resolve_collection, versioned_name
+from context.reindex import Reindexer
+
+FORMAT = "pdf-rag-snapshot"
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+VECTORS = "vectors.f32"
+PAYLOADS = "payloads.jsonl"
+# Little-endian float32 regardless of the exporting machine
+VECTOR_DTYPE = np.dtype("<f4")
+# Qdrant's default, restored once the bulk load is done
+INDEXING_THRESHOLD = 20000
+HASH_BLOCK = 8 * 1024 * 1024
+
+
+def export_snapshot(client: QdrantClient, out_dir: str, collection: str = COLLECTION_NAME,
+                    batch_size: int = 1024) -> Dict:
+    """
+    Dump every point of `collection` (or the collection behind that alias)
+    into `out_dir`:
+
+      vectors.f32     count x dim float32, row-major, no header (np.memmap-able)
+      payloads.jsonl  one {"id", "payload"} object per line, same order
+      manifest.json   shape, distance, encoder and sha256 of both files
+
+    The manifest is written last, so a directory without one is an
+    incomplete export.
+    """
+    source = resolve_collection(client, collection)
+    if source is None:
+        raise AppException(f"Snapshot: collection '{collection}' does not exist", status_code=404)
+    params = client.get_collection(source).config.params.vectors
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    vector_hash, payload_hash = hashlib.sha256(), hashlib.sha256()
+    count = 0
+    started = time.monotonic()
+    with open(os.path.join(out_dir, VECTORS), "wb") as vectors_file, \
+            open(os.path.join(out_dir, PAYLOADS), "wb") as payloads_file:
+        offset = None
+        while True:
+            points, offset = client.scroll(
+                collection_name=source, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+            )
+            if points:
+                block = np.asarray([p.vector for p in points], dtype=VECTOR_DTYPE)
+                if block.shape[1] != params.size:
+                    raise AppException(f"Snapshot: point dimension {block.shape[1]} != collection size {params.size}")
+                data = block.tobytes()
+                vectors_file.write(data)
+                vector_hash.update(data)
+                lines = "".join(json.dumps({"id": p.id, "payload": p.payload or {}}) + "\n" for p in points)
+                data = lines.encode("utf-8")
+                payloads_file.write(data)
+                payload_hash.update(data)
+                count += len(points)
+            if offset is None:
+                break
+
+    from agents.encoders import EMBEDDING_MODEL
+    manifest = {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "collection": collection,
+        "source_collection": source,
+        "count": count,
+        "dim": params.size,
+        "distance": params.distance.value,
+        "dtype": VECTOR_DTYPE.str,
+        "encoder": EMBEDDING_MODEL,
+        "vectors_sha256": vector_hash.hexdigest(),
+        "payloads_sha256": payload_hash.hexdigest(),
+        "created_at": time.time(),
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"Snapshot: exported {count} points from '{source}' to '{out_dir}' in {time.monotonic() - started:.1f}s")
+    return manifest
+
+
+def read_manifest(snapshot_dir: str, verify: bool = True) -> Dict:
+    path = os.path.join(snapshot_dir, MANIFEST)
+    if not os.path.exists(path):
+        raise AppException(f"Snapshot: no {MANIFEST} in '{snapshot_dir}' (incomplete export?)", status_code=404)
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT or manifest.get("version") != FORMAT_VERSION:
+        raise AppException(f"Snapshot: unsupported format {manifest.get('format')} v{manifest.get('version')}")
+
+    expected_bytes = manifest["count"] * manifest["dim"] * VECTOR_DTYPE.itemsize
+    actual_bytes = os.path.getsize(os.path.join(snapshot_dir, VECTORS))
+    if actual_bytes != expected_bytes:
+        raise AppException(f"Snapshot: {VECTORS} is {actual_bytes} bytes, expected {expected_bytes}")
+    if verify:
+        for name, key in ((VECTORS, "vectors_sha256"), (PAYLOADS, "payloads_sha256")):
+            if _sha256(os.path.join(snapshot_dir, name)) != manifest[key]:
+                raise AppException(f"Snapshot: checksum mismatch for {name}")
+    return manifest
+
+
+def open_vectors(snapshot_dir: str, manifest: Dict) -> np.memmap:
+    """The snapshot's vectors as a read-only (count, dim) memory map."""
+    return np.memmap(
+        os.path.join(snapshot_dir, VECTORS), dtype=VECTOR_DTYPE, mode="r",
+        shape=(manifest["count"], manifest["dim"]),
+    )
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _batches(snapshot_dir: str, vectors: np.memmap, batch_size: int) -> Iterator[Tuple[int, List[PointStruct]]]:
+    with open(os.path.join(snapshot_dir, PAYLOADS), encoding="utf-8") as payloads:
+        row = 0
+        batch: List[PointStruct] = []
+        for line in payloads:
+            record = json.loads(line)
+            # Exports from before tenants were stored join the default tenant
+            payload = {"tenant": DEFAULT_TENANT, **record["payload"]}
+            batch.append(PointStruct(id=record["id"], vector=vectors[row].tolist(), payload=payload))
+            row += 1
+            if len(batch) == batch_size:
+                yield row, batch
+                batch = []
+        if batch:
+            yield row, batch
+
+
+def import_snapshot(client: QdrantClient, snapshot_dir: str, alias: str = COLLECTION_NAME,
+                    batch_size: int = 1024, workers: int = 8, verify: bool = True) -> Dict:
+    """
+    Bulk-load a snapshot into a new `<alias>_v<N>` collection and point the
+    alias at it once every point is in, so a live node keeps serving its
+    current index until the switch (and can roll back with the re-indexer).
+
+    Vectors are read through a memory map and sent as `workers` parallel
+    upserts of `batch_size` points, with HNSW indexing paused until the load
+    completes.
+    """
+    manifest = read_manifest(snapshot_dir, verify=verify)
+    from agents.encoders import EMBEDDING_MODEL
+    if manifest.get("encoder") != EMBEDDING_MODEL:
+        logger.warning(
+            f"Snapshot: vectors were made with '{manifest.get('encoder')}', "
+            f"this node encodes queries with '{EMBEDDING_MODEL}'"
+        )
+
+    previous = resolve_collection(client, alias)
+    versions = collection_versions(client, alias)
+    target = versioned_name(alias, versions[-1][0] + 1 if versions else 1)
+    client.create_collection(
+        collection_name=target,
+        vectors_config=VectorParams(size=manifest["dim"], distance=Distance(manifest["distance"])),
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=0),
+    )
+    ensure_payload_indexes(client, target)
+
+    vectors = open_vectors(snapshot_dir, manifest)
+    loaded = 0
+    lock = threading.Lock()
+    started = time.monotonic()
+    # Bounds how many batches are materialized ahead of the upserts
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def upsert(batch: List[PointStruct]):
+        nonlocal loaded
+        try:
+            client.upsert(collection_name=target, points=batch, wait=True)
+            with lock:
+                loaded += len(batch)
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot") as pool:
+            futures = []
+            for row, batch in _batches(snapshot_dir, vectors, batch_size):
+                slots.acquire()
+                futures.append(pool.submit(upsert, batch))
+                if row % (batch_size * 50) < batch_size:
+                    logger.info(f"Snapshot: queued {row}/{manifest['count']} points")
+            for future in futures:
+                future.result()
+        count = client.count(collection_name=target, exact=True).count
+        if count != manifest["count"]:
+            raise AppException(f"Snapshot: loaded {count} points, manifest has {manifest['count']}", status_code=500)
+        client.update_collection(
+            collection_name=target, optimizer_config=OptimizersConfigDiff(indexing_threshold=INDEXING_THRESHOLD)
+        )
+    except Exception:
+        client.delete_collection(target)
+        raise
+
+    reindexer = Reindexer(client, alias=alias)
+    reindexer.point_alias(target, previous=previous)
+    pruned = reindexer.prune()
+    elapsed = time.monotonic() - started
+    logger.info(f"Snapshot: imported {loaded} points into '{target}' in {elapsed:.1f}s "
+                f"({loaded / max(elapsed, 1e-6):.0f} points/s); '{alias}' now points to it")
+    return {"target": target, "previous": previous, "points": loaded, "seconds": round(elapsed, 1), "pruned": pruned}
+
+
+def _client(local_path: Optional[str]) -> QdrantClient:
+    if local_path:
+        return QdrantClient(path=local_path)
+    host = os.getenv("QDRANT_HOST", "localhost")
+    port = int(os.getenv("QDRANT_PORT", "6334"))
+    return QdrantClient(host=host, port=port, prefer_grpc=True)
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python -m context.snapshot export snapshots/2024-06-01
+    #   python -m context.snapshot import snapshots/2024-06-01 --workers 8
+    #   python -m context.snapshot import snapshots/2024-06-01 --local-path data/qdrant
+    parser = argparse.ArgumentParser(description="Export/import the vector index as a portable snapshot")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("directory", help="Snapshot directory")
+    parser.add_argument("--collection", default=COLLECTION_NAME, help="Collection or alias")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=8, help="Parallel upserts (import)")
+    parser.add_argument("--local-path", default=None, help="Use an embedded local Qdrant store at this path")
+    parser.add_argument("--no-verify", action="store_true", help="Skip checksum verification (import)")
+    args = parser.parse_args()
+
+    client = _client(args.local_path)
+    try:
+        if args.command == "export":
+            print(json.dumps(export_snapshot(client, args.directory, args.collection, args.batch_size), indent=2))
+        else:
+            print(json.dumps(import_snapshot(
+                client, args.directory, args.collection,
+                batch_size=args.batch_size, workers=args.workers, verify=not args.no_verify,
+            ), indent=2))
+    except AppException as e:
+        print(f"Error: {e}")
+        if e.error_detail:
+            print(f"Detail: {e.error_detail}")
+        raise SystemExit(1)
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from common.exception import AppException
+from common.logging import logger, trace
+from common.scheduler import Overloaded
+
+# How many of the most frequent logged questions are replayed (0 disables)
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "50"))
+# Also generate (and cache) answers, not just embeddings and retrievals;
+# off by default as it costs one LLM call per replayed question that isn't
+# cached yet, after every index change (up to WARMUP_TOP_N calls each time)
+WARMUP_ANSWERS = os.getenv("WARMUP_ANSWERS", "false").lower() in ("1", "true", "yes")
+# Only replay questions asked within this many days
+WARMUP_MAX_AGE_DAYS = float(os.getenv("WARMUP_MAX_AGE_DAYS", "7"))
+# Quiet period after an index change before replaying, so a burst of
+# uploads triggers a single warm-up
+WARMUP_DELAY_S = float(os.getenv("WARMUP_DELAY_S", "10"))
+
+
+class CacheWarmer:
+    """
+    Replays the most frequent questions from the query log through
+    `manager.warm`, on a background thread and at bulk priority, so live
+    queries always go first. Triggered at startup and after every index
+    change; triggers arriving while a replay runs restart it afterwards
+    (the caches it filled were just invalidated).
+    """
+
+    def __init__(
+        self,
+        manager,
+        query_log,
+        top_n: int = WARMUP_TOP_N,
+        answers: bool = WARMUP_ANSWERS,
+        max_age_s: float = WARMUP_MAX_AGE_DAYS * 86400,
+        delay: float = WARMUP_DELAY_S,
+    ):
+        self.manager = manager
+        self.query_log = query_log
+        self.top_n = top_n
+        self.answers = answers
+        self.max_age_s = max_age_s
+        self.delay = delay
+        self._cond = threading.Condition()
+        self._due_at: Optional[float] = None
+        self._reason: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"runs": 0, "warmed": 0, "skipped": 0, "failed": 0, "running": False, "last_run": None}
+
+    def trigger(self, reason: str, delay: Optional[float] = None):
+        """Schedule a replay `delay` seconds from now (default: the quiet period)."""
+        if self.top_n <= 0 or not self.query_log.enabled:
+            return
+        due_at = time.monotonic() + (self.delay if delay is None else delay)
+        with self._cond:
+            self._due_at = due_at
+            self._reason = reason
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="cache-warmup", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._due_at is None or self._due_at > time.monotonic():
+                    self._cond.wait(None if self._due_at is None else self._due_at - time.monotonic())
+                reason, self._due_at = self._reason, None
+            with trace():
+                try:
+                    self._run(reason)
+                except Exception:
+                    # Keep the thread alive: later index changes still warm up
+                    logger.exception(f"CacheWarmer: replay ({reason}) failed")
+
+    def _pending(self) -> bool:
+        with self._cond:
+            return self._due_at is not None
+
+    def _run(self, reason: str):
+        started = time.monotonic()
+        entries = self.query_log.top(self.top_n, self.max_age_s)
+        self._stats["running"] = True
+        warmed = skipped = failed = 0
+        try:
+            for entry in entries:
+                if self._pending():
+                    # The index changed again; start over after the quiet period
+                    logger.info(f"CacheWarmer: replay ({reason}) superseded after {warmed} questions")
+                    return
+                try:
+                    if self.manager.warm(
+                        entry["question"], top_k=entry.get("top_k"), tenant=entry.get("tenant"),
+                        doc_ids=entry.get("doc_ids"), sources=entry.get("sources"),
+                        window=entry.get("window"), answer=self.answers,
+                    ):
+                        warmed += 1
+                    else:
+                        skipped += 1
+                except Overloaded as e:
+                    # Live traffic has the capacity; wait and move on
+                    failed += 1
+                    time.sleep(e.retry_after)
+                except AppException as e:
+                    failed += 1
+                    if e.status_code == 400:
+                        # Nothing indexed (or a question that is no longer valid)
+                        logger.info(f"CacheWarmer: stopping replay ({reason}): {e.message}")
+                        return
+                    logger.warning(f"CacheWarmer: failed to warm a question: {e.message}")
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"CacheWarmer: failed to warm a question: {e}")
+        finally:
+            self._stats["running"] = False
+            self._stats["runs"] += 1
+            self._stats["warmed"] += warmed
+            self._stats["skipped"] += skipped
+            self._stats["failed"] += failed
+            self._stats["last_run"] = {
+                "reason": reason, "questions": len(entries), "warmed": warmed,
+                "seconds": round(time.monotonic() - started, 1),
+            }
+        logger.info(
+            f"CacheWarmer: replayed {len(entries)} questions ({reason}): {warmed} warmed, "
+            f"{skipped} already cached, {failed} failed in {time.monotonic() - started:.1f}s"
+        )
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return dict(self._stats, pending=self._due_at is not None)
@@ -1,29 +1,107 @@
+import time
 import requests
-from config import UPLOAD_URL, QUERY_URL, STATUS_URL
-from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import UPLOAD_URL, QUERY_URL, STATUS_URL, SESSIONS_URL, STATUS_CACHE_TTL, QUERY_DEADLINE_S
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+
+
+def _build_session() -> requests.Session:
+    """
+    One keep-alive session per Streamlit process. Idempotent GETs are retried
+    with exponential backoff on connection errors and 502/503/504; uploads
+    are never retried automatically.
+    """
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Module state survives Streamlit reruns, so the pool is reused across them
+_session = _build_session()
+_status_cache = {"has_vectors": None, "checked_at": 0.0}
+
 
 class APIClient:
     @staticmethod
-    def upload_pdfs(file_paths: list[Path]) -> dict:
-        files = [("files", (p.name, open(p, 'rb'), "application/pdf")) for p in file_paths]
-        resp = requests.post(UPLOAD_URL, files=files, timeout=60)
+    def upload_pdfs(uploaded_files: list[UploadedFile]) -> dict:
+        # Stream Streamlit's in-memory uploads straight to the API; the backend
+        # owns storage, so nothing is written to disk on this side.
+        for uf in uploaded_files:
+            uf.seek(0)
+        files = [("files", (uf.name, uf, "application/pdf")) for uf in uploaded_files]
+        resp = _session.post(UPLOAD_URL, files=files, timeout=60)
+        resp.raise_for_status()
+        data = resp.json()
+        if data.get("chunks", 0) > 0:
+            _status_cache.update(has_vectors=True, checked_at=time.monotonic())
+        return data
+
+    @staticmethod
+    def query(q: str, top_k: int | None, tenant: str | None = None,
+              doc_ids: list[str] | None = None, sources: list[str] | None = None,
+              deadline: float = QUERY_DEADLINE_S) -> dict:
+        params = {"q": q, "deadline": deadline}
+        # Without top_k the backend picks the number of contexts by score
+        if top_k:
+            params["top_k"] = top_k
+        # Optional scoping; list values are sent as repeated query params
+        if tenant:
+            params["tenant"] = tenant
+        if doc_ids:
+            params["doc_id"] = doc_ids
+        if sources:
+            params["source"] = sources
+        # The backend answers (possibly degraded) by the deadline; the slack
+        # covers transfer and queueing
+        resp = _session.get(QUERY_URL, params=params, timeout=deadline + 5)
         resp.raise_for_status()
         return resp.json()
 
     @staticmethod
-    def query(q: str, top_k: int) -> dict:
-        params = {"q": q, "top_k": top_k}
-        resp = requests.get(QUERY_URL, params=params, timeout=60)
+    def create_session(tenant: str | None = None) -> str:
+        """Start a server-side chat session and return its id."""
+        params = {"tenant": tenant} if tenant else None
+        resp = _session.post(SESSIONS_URL, params=params, timeout=10)
+        resp.raise_for_status()
+        return resp.json()["session_id"]
+
+    @staticmethod
+    def chat(session_id: str, q: str, top_k: int | None, deadline: float = QUERY_DEADLINE_S) -> dict:
+        """
+        Ask the next question of a session; the backend keeps the history.
+        Raises requests.HTTPError (404) when the session has expired.
+        """
+        params = {"q": q, "deadline": deadline}
+        if top_k:
+            params["top_k"] = top_k
+        resp = _session.post(f"{SESSIONS_URL}/{session_id}/turns", params=params, timeout=deadline + 5)
         resp.raise_for_status()
         return resp.json()
-    
+
 
     @staticmethod
-    def has_vectors() -> bool:
+    def has_vectors(max_age: float = STATUS_CACHE_TTL) -> bool:
         """
-        Check if the vector store has any embeddings.
+        Check if the vector store has any embeddings. The answer is cached for
+        `max_age` seconds so Streamlit reruns don't each hit /status.
         """
-        resp = requests.get(STATUS_URL, timeout=60)
+        cached = _status_cache["has_vectors"]
+        if cached is not None and time.monotonic() - _status_cache["checked_at"] < max_age:
+            return cached
+        resp = _session.get(STATUS_URL, timeout=10)
         resp.raise_for_status()
         data = resp.json()
-        return data.get("count", 0) > 0
\ No newline at end of file
+        has_vectors = data.get("count", 0) > 0
+        _status_cache.update(has_vectors=has_vectors, checked_at=time.monotonic())
+        return has_vectors
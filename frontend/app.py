@@ -1,6 +1,5 @@
 # frontend/app.py
 import streamlit as st
-from helpers import clear_temp_dir
 from ui import render_ingest, render_chat
 
 
@@ -9,9 +8,7 @@ def main():
     st.title("🗂️ PDF RAG Q&A")
     st.write("Upload PDF files, ingest them, then ask questions in a chat interface.")
 
-    # Reset temp folder on cold start
     if 'initialized' not in st.session_state:
-        clear_temp_dir()
         st.session_state.initialized = True
         st.session_state.ingested = False
         st.session_state.history = []
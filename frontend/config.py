@@ -1,13 +1,14 @@
 import os
-from pathlib import Path
 
 # API endpoints
 API_BASE   = os.getenv("API_BASE", "http://localhost:8000")
 UPLOAD_URL = f"{API_BASE}/upload"
 QUERY_URL  = f"{API_BASE}/query"
 STATUS_URL   = f"{API_BASE}/status" 
-# Local storage
-TMP_DIR = Path(os.getenv("TMP_DIR", "./data/temp_pdfs"))
-
+SESSIONS_URL = f"{API_BASE}/sessions"
 # Defaults
-DEFAULT_TOP_K = int(os.getenv("DEFAULT_TOP_K", 3))
\ No newline at end of file
+DEFAULT_TOP_K = int(os.getenv("DEFAULT_TOP_K", 3))
+# Seconds a /status answer is reused across Streamlit reruns
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", 30))
+# End-to-end budget requested for each question (the backend caps it)
+QUERY_DEADLINE_S = float(os.getenv("QUERY_DEADLINE_S", 30))
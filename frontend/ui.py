@@ -1,7 +1,7 @@
+import requests
 import streamlit as st
 from config import DEFAULT_TOP_K
 from api_client import APIClient
-from helpers import save_uploaded_files
 
 # Ingestion UI
 def render_ingest():
@@ -10,13 +10,29 @@ def render_ingest():
     if uploaded and st.button("Ingest Documents"):
         with st.spinner("Uploading and ingesting..."):
             try:
-                paths = save_uploaded_files(uploaded)
-                data = APIClient.upload_pdfs(paths)
+                data = APIClient.upload_pdfs(uploaded)
                 st.success(f"Ingested {data['pages']} pages, {data['chunks']} chunks.")
                 st.session_state.ingested = True
             except Exception as e:
                 st.error(f"Ingestion failed: {e}")
 
+def _ask(question: str, top_k: int | None) -> dict:
+    """
+    Ask within the backend chat session (started on first use), so
+    follow-ups are answered with the conversation so far. An expired session
+    is replaced once; its history is gone on the server side.
+    """
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = APIClient.create_session()
+    try:
+        return APIClient.chat(st.session_state.session_id, question, top_k)
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        st.info("The previous conversation expired; starting a new one.")
+        st.session_state.session_id = APIClient.create_session()
+        return APIClient.chat(st.session_state.session_id, question, top_k)
+
 # Chat UI
 def render_chat():
     try:
@@ -32,14 +48,19 @@ def render_chat():
         st.session_state.history = []
     if "top_k" not in st.session_state:
         st.session_state.top_k = DEFAULT_TOP_K
+    if st.button("New conversation"):
+        st.session_state.history = []
+        st.session_state.pop("session_id", None)
 
     with st.form("qa_form", clear_on_submit=True):
         question = st.text_input("Your question: ")
+        adaptive = st.checkbox("Choose the number of contexts by relevance", value=True)
         top_k    = st.slider(
             "Number of contexts to retrieve:",
             min_value=1, 
             max_value=10,         
-            key="top_k"
+            key="top_k",
+            disabled=adaptive
         )
         submitted = st.form_submit_button("Send")
 
@@ -49,11 +70,13 @@ def render_chat():
             else:
                 with st.spinner("Thinking..."):
                     try:
-                        result = APIClient.query(question, top_k)
+                        result = _ask(question, None if adaptive else top_k)
                         st.session_state.history.append({
                             "user": question,
                             "answer": result["answer"],
-                            "contexts": result["contexts"]
+                            "contexts": result["contexts"],
+                            "status": result.get("status", "ok"),
+                            "reused_contexts": result.get("reused_contexts", False)
                         })
                        
                     except Exception as e:
@@ -61,7 +84,15 @@ def render_chat():
 
     for entry in st.session_state.history:
         st.markdown(f"**You: {entry['user']}")
-        st.markdown(f"**Bot: {entry['answer']}")
+        if entry.get("status", "ok") == "no relevant passages":
+            st.markdown(f"**Bot: {entry['answer']}")
+            st.caption("No passage in the indexed documents was relevant enough to answer from.")
+        elif entry.get("status", "ok") != "ok":
+            st.warning(f"No answer ({entry['status']}); the retrieved sources are shown below.")
+        else:
+            st.markdown(f"**Bot: {entry['answer']}")
+        if entry.get("reused_contexts"):
+            st.caption("Answered from the previous question's sources.")
         with st.expander("Show Sources"):
             for ctx in entry["contexts"]:
                 txt = ctx["text"].replace("\n", " ")
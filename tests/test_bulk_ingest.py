@@ -0,0 +1,142 @@
+import os
+import uuid
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointStruct
+
+from common.config import EMBEDDING_DIM
+from common.qdrant_utils import ensure_collection
+from context.bulk_ingest import BulkIngester, Journal, find_pdfs
+
+COLLECTION = "chunks"
+
+
+class _Ingestor:
+    def run(self, paths, doc_ids=None, backend=None):
+        with open(paths[0], encoding="utf-8") as f:
+            pages = f.read().split("\f")
+        return {"documents": [
+            {"page": i + 1, "text": text, "source": os.path.basename(paths[0]), "doc_id": doc_ids[0]}
+            for i, text in enumerate(pages)
+        ]}
+
+
+class _Embedder:
+    def build_points(self, pages, tenant=None):
+        revision = uuid.uuid4().hex
+        return [
+            PointStruct(
+                id=str(uuid.uuid4()),
+                vector=[1.0] * EMBEDDING_DIM,
+                payload={"doc_id": page["doc_id"], "revision": revision, "tenant": tenant, "text": page["text"]},
+            )
+            for page in pages
+        ]
+
+
+class _Manager:
+    """The parts of ContextManager the bulk ingester uses."""
+
+    def __init__(self):
+        self.qdrant = QdrantClient(":memory:")
+        ensure_collection(self.qdrant, COLLECTION)
+        self.collection_name = COLLECTION
+        self.ingestor = _Ingestor()
+        self.embedder = _Embedder()
+        self.write_gate = None
+
+    def _ensure_collection(self):
+        pass
+
+    def doc_points(self, doc_id):
+        points, _ = self.qdrant.scroll(collection_name=COLLECTION, limit=100, with_payload=True)
+        return [p for p in points if p.payload["doc_id"] == doc_id]
+
+
+def _write(path, pages):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\f".join(pages))
+
+
+def _ingest(manager, journal_path, root, tenant="acme"):
+    journal = Journal(journal_path)
+    try:
+        return BulkIngester(manager, journal, workers=2, tenant=tenant, report_every=60).run(find_pdfs(root))
+    finally:
+        journal.close()
+
+
+def _doc_id(path):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"file://{os.path.abspath(path)}"))
+
+
+def test_journal_replays_done_and_interrupted_entries(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path)
+    journal.record("started", path="/a.pdf", doc_id="a")
+    journal.record("done", path="/a.pdf", doc_id="a", fingerprint="10:1")
+    journal.record("started", path="/b.pdf", doc_id="b")
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"event": "done", "pa')  # torn by a crash
+
+    replayed = Journal(path)
+    assert replayed.is_done("/a.pdf", "10:1")
+    assert not replayed.is_done("/a.pdf", "11:2")
+    assert set(replayed.started) == {"/b.pdf"}
+    replayed.close()
+
+
+def test_a_second_run_skips_finished_documents(tmp_path):
+    root = tmp_path / "docs"
+    for name in ("one", "two", "sub/three"):
+        _write(str(root / f"{name}.pdf"), [f"{name} page 1", f"{name} page 2"])
+    manager = _Manager()
+    journal_path = str(tmp_path / "journal.jsonl")
+
+    first = _ingest(manager, journal_path, str(root))
+    second = _ingest(manager, journal_path, str(root))
+
+    assert (first["done"], first["chunks"]) == (3, 6)
+    assert (second["total"], second["skipped"]) == (0, 3)
+    assert manager.qdrant.count(collection_name=COLLECTION, exact=True).count == 6
+
+
+def test_interrupted_document_is_replaced_not_duplicated(tmp_path):
+    root = tmp_path / "docs"
+    path = str(root / "report.pdf")
+    _write(path, ["page 1", "page 2", "page 3"])
+    manager = _Manager()
+    journal_path = str(tmp_path / "journal.jsonl")
+    # A crash after one batch: journal says started, one stray point stored
+    journal = Journal(journal_path)
+    journal.record("started", path=os.path.abspath(path), doc_id=_doc_id(path))
+    journal.close()
+    manager.qdrant.upsert(collection_name=COLLECTION, points=[PointStruct(
+        id=str(uuid.uuid4()), vector=[1.0] * EMBEDDING_DIM,
+        payload={"doc_id": _doc_id(path), "revision": "partial", "tenant": "acme", "text": "page 1"},
+    )])
+
+    stats = _ingest(manager, journal_path, str(root))
+
+    assert stats["done"] == 1
+    points = manager.doc_points(_doc_id(path))
+    assert len(points) == 3
+    assert "partial" not in {p.payload["revision"] for p in points}
+
+
+def test_edited_file_is_ingested_again_in_place(tmp_path):
+    root = tmp_path / "docs"
+    path = str(root / "notes.pdf")
+    _write(path, ["v1 page 1", "v1 page 2"])
+    manager = _Manager()
+    journal_path = str(tmp_path / "journal.jsonl")
+    _ingest(manager, journal_path, str(root))
+
+    _write(path, ["v2 page 1"])
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    stats = _ingest(manager, journal_path, str(root))
+
+    assert stats["done"] == 1
+    assert [p.payload["text"] for p in manager.doc_points(_doc_id(path))] == ["v2 page 1"]
@@ -0,0 +1,92 @@
+import threading
+import time
+
+from common.cache import TTLCache
+from context.context_manager import ContextManager
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(4, ttl=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.08)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_stats_count_hits_and_misses_but_not_membership_checks():
+    cache = TTLCache(4)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("missing")
+    assert "a" in cache
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_pop_and_clear():
+    cache = TTLCache(4)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
+    cache.clear()
+    assert "b" not in cache
+
+
+def test_zero_size_cache_stores_nothing():
+    cache = TTLCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+class _Warmer:
+    def __init__(self):
+        self.reasons = []
+
+    def trigger(self, reason):
+        self.reasons.append(reason)
+
+
+def _manager():
+    # Only the cache bookkeeping; no encoder, Qdrant or LLM
+    manager = ContextManager.__new__(ContextManager)
+    manager.retrieval_cache = TTLCache(8)
+    manager.answer_cache = TTLCache(8)
+    manager._cache_generation = 0
+    manager._cache_lock = threading.Lock()
+    manager.warmer = _Warmer()
+    return manager
+
+
+def test_index_change_clears_results_and_schedules_a_warm_up():
+    manager = _manager()
+    manager._cache_put(manager.answer_cache, ("q",), "answer", manager._cache_generation)
+    assert manager.answer_cache.get(("q",)) == "answer"
+
+    manager._index_changed("delete")
+
+    assert ("q",) not in manager.answer_cache
+    assert manager.warmer.reasons == ["delete"]
+
+
+def test_result_computed_before_an_index_change_is_not_cached():
+    manager = _manager()
+    generation = manager._cache_generation
+    # The index changes while the answer is being generated
+    manager._index_changed("ingest")
+    manager._cache_put(manager.answer_cache, ("q",), "stale answer", generation)
+    assert ("q",) not in manager.answer_cache
+
+    manager._cache_put(manager.answer_cache, ("q",), "fresh answer", manager._cache_generation)
+    assert manager.answer_cache.get(("q",)) == "fresh answer"
@@ -0,0 +1,52 @@
+import pytest
+
+from agents.chunker import DocumentChunker
+from common.exception import AppException
+
+
+class _WordTokenizer:
+    """One token per whitespace-separated word."""
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [list(range(len(text.split()))) for text in texts]}
+
+
+def _sentences(count, words=8):
+    return " ".join(f"Sentence {i} " + "word " * (words - 3) + "end." for i in range(count))
+
+
+def test_overlap_must_be_smaller_than_chunk():
+    with pytest.raises(AppException):
+        DocumentChunker(_WordTokenizer(), max_tokens=32, overlap_tokens=32)
+
+
+def test_chunks_respect_the_token_budget_and_overlap():
+    chunker = DocumentChunker(_WordTokenizer(), max_tokens=40, overlap_tokens=10, min_tokens=5)
+    chunks = chunker.chunk_document([{"page": 1, "text": _sentences(30)}])
+
+    assert len(chunks) > 1
+    assert all(c["token_count"] <= 40 for c in chunks)
+    assert chunks[0]["overlap_tokens"] == 0
+    assert all(0 < c["overlap_tokens"] <= 10 for c in chunks[1:])
+
+
+def test_dropping_the_overlap_stitches_the_text_back_together():
+    text = _sentences(30)
+    chunker = DocumentChunker(_WordTokenizer(), max_tokens=40, overlap_tokens=10, min_tokens=5)
+    chunks = chunker.chunk_document([{"page": 1, "text": text}])
+
+    stitched = " ".join(c["text"][c["overlap_chars"]:].strip() for c in chunks)
+    assert stitched.split() == text.split()
+
+
+def test_paragraph_cut_by_a_page_break_spans_both_pages():
+    chunker = DocumentChunker(_WordTokenizer(), max_tokens=200, overlap_tokens=10, min_tokens=5)
+    pages = [
+        {"page": 1, "text": "The method continues on the next page and"},
+        {"page": 2, "text": "ends here with a full stop."},
+    ]
+    chunks = chunker.chunk_document(pages)
+
+    assert len(chunks) == 1
+    assert (chunks[0]["page_start"], chunks[0]["page_end"]) == (1, 2)
+    assert "and ends here" in chunks[0]["text"]
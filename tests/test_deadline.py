@@ -0,0 +1,24 @@
+import time
+
+from common.deadline import MAX_QUERY_DEADLINE_S, Deadline
+
+
+def test_requested_deadline_is_capped():
+    assert Deadline.for_request(MAX_QUERY_DEADLINE_S * 10).seconds == MAX_QUERY_DEADLINE_S
+    assert Deadline.for_request(2).seconds == 2
+
+
+def test_stage_takes_a_share_of_the_total_budget():
+    deadline = Deadline(10)
+    stage = deadline.stage(0.3)
+    assert 2.9 < stage.remaining() <= 3
+
+
+def test_stage_never_outlives_its_parent():
+    deadline = Deadline(0.1)
+    time.sleep(0.06)
+    stage = deadline.stage(0.9)
+    assert stage.remaining() <= deadline.remaining() + 1e-3
+    time.sleep(0.06)
+    assert deadline.expired() and stage.expired()
+    assert stage.remaining() == 0.0
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from agents.llm_clients import HedgedClient, LLMClient, StubLLMClient, load_llm_client
+from common.exception import AppException
+
+PROMPT = "Passages:\n[Source: a.pdf, page 1]\nThe quick brown fox jumps.\n---\n\nQuestion: What jumps?\nAnswer:"
+
+
+def test_stub_answers_deterministically_from_the_passages():
+    stub = StubLLMClient(latency_s=0, tokens_per_s=0, tokens=4)
+    answer = "".join(stub.stream(PROMPT))
+
+    assert answer == "".join(StubLLMClient(latency_s=0, tokens_per_s=0, tokens=4).stream(PROMPT))
+    assert answer.startswith("[stub ") and answer.endswith(" The quick brown")
+    assert "Source" not in answer
+
+
+def test_stub_without_passages_does_not_know():
+    stub = StubLLMClient(latency_s=0, tokens_per_s=0)
+    assert "".join(stub.stream("Question: anything?")).endswith(" I don't know.")
+
+
+def test_calls_are_recorded_in_the_latency_stats():
+    stub = StubLLMClient(latency_s=0, tokens_per_s=0, tokens=3)
+    list(stub.stream(PROMPT))
+    stream = stub.stream(PROMPT)
+    next(stream)
+    stream.close()
+
+    stats = stub.stats()
+    assert (stats["backend"], stats["calls"], stats["errors"], stats["tokens"]) == ("stub", 2, 0, 4)
+    # Only the completed call has a total time
+    assert stats["total_ms"]["p50"] is not None
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(AppException):
+        load_llm_client("openai")
+
+
+class _ScriptedClient(LLMClient):
+    """Backend whose n-th call waits delays[n] before answering (or fails)."""
+
+    name = "scripted"
+
+    def __init__(self, delays, fail=()):
+        super().__init__()
+        self.delays = list(delays)
+        self.fail = set(fail)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _stream(self, prompt, system, timeout=None):
+        with self._lock:
+            call = self.calls
+            self.calls += 1
+        time.sleep(self.delays[call])
+        if call in self.fail:
+            raise RuntimeError(f"call {call} failed")
+        yield f"answer {call}"
+        yield " done"
+
+
+def _hedged(backend, **kwargs):
+    client = HedgedClient(backend, percentile=50, min_delay_s=0.05, min_samples=1, **kwargs)
+    # One fast call on record, so a first token later than 50 ms is slow
+    backend.latency.record(0.01, 0.02, 2)
+    return client
+
+
+def test_no_hedging_until_enough_latency_samples():
+    backend = _ScriptedClient([0.1])
+    client = HedgedClient(backend, min_samples=20)
+    assert "".join(client.stream(PROMPT)) == "answer 0 done"
+    assert backend.calls == 1
+    assert client.stats()["hedging"]["hedged"] == 0
+
+
+def test_slow_first_attempt_is_hedged_and_the_faster_one_wins():
+    backend = _ScriptedClient([1.0, 0.0])
+    client = _hedged(backend)
+
+    started = time.monotonic()
+    assert "".join(client.stream(PROMPT)) == "answer 1 done"
+    assert time.monotonic() - started < 0.8
+    assert client.stats()["hedging"] == {"hedged": 1, "hedge_wins": 1, "delay_ms": 50.0}
+
+
+def test_a_failed_attempt_falls_back_to_the_other():
+    backend = _ScriptedClient([0.2, 0.3], fail={0})
+    assert "".join(_hedged(backend).stream(PROMPT)) == "answer 1 done"
+
+
+def test_error_is_raised_when_every_attempt_fails():
+    backend = _ScriptedClient([0.2, 0.2], fail={0, 1})
+    with pytest.raises(RuntimeError):
+        "".join(_hedged(backend).stream(PROMPT))
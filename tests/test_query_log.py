@@ -0,0 +1,51 @@
+import json
+import time
+
+from context.query_log import QueryLog
+
+
+def _entry(key, ts, latency_ms=100.0, cached=False, top_k=5):
+    return {"question": key.capitalize() + "?", "key": key, "top_k": top_k, "tenant": None, "doc_ids": None,
+            "sources": None, "window": None, "latency_ms": latency_ms, "cached": cached, "ts": ts}
+
+
+def test_top_ranks_logged_and_recorded_questions_without_rereading_the_log(tmp_path):
+    path = tmp_path / "log.jsonl"
+    now = time.time()
+    path.write_text("".join(json.dumps(e) + "\n" for e in (
+        _entry("a", now - 30), _entry("b", now - 20, latency_ms=300.0), _entry("b", now - 10, cached=True),
+    )))
+    log = QueryLog(str(path))
+    path.unlink()  # the counts were loaded at construction
+
+    log.record(**_entry("a", now))
+    log.record(**_entry("a", now, top_k=10))
+    log.flush()
+
+    top = log.top(10)
+    assert [(e["question"], e["top_k"], e["count"]) for e in top] == [("A?", 5, 2), ("B?", 5, 2), ("A?", 10, 1)]
+    assert top[0]["mean_latency_ms"] == 100.0
+    assert top[1]["mean_latency_ms"] == 300.0  # the cached hit is not a latency sample
+
+
+def test_top_only_counts_entries_within_max_age(tmp_path):
+    now = time.time()
+    log = QueryLog(str(tmp_path / "log.jsonl"))
+    for ts in (now - 1000, now - 1000, now - 1000):
+        log._count(_entry("old", ts, latency_ms=500.0))
+    log._count(_entry("mixed", now - 1000, latency_ms=500.0))
+    log._count(_entry("mixed", now - 5, latency_ms=100.0))
+    log._count(_entry("new", now - 4))
+
+    top = log.top(10, max_age_s=60)
+    assert [(e["question"], e["count"], e["mean_latency_ms"]) for e in top] == [("New?", 1, 100.0), ("Mixed?", 1, 100.0)]
+    # Ageing out is per call; the counts themselves are untouched
+    assert log.top(1)[0]["question"] == "Old?"
+
+
+def test_counts_are_bounded_to_the_window(tmp_path):
+    log = QueryLog(str(tmp_path / "log.jsonl"), window=3)
+    for i, key in enumerate(["a", "a", "b", "c", "c"]):
+        log._count(_entry(key, i))
+    assert {e["question"]: e["count"] for e in log.top(10)} == {"B?": 1, "C?": 2}
+    assert len(log._window) == 3 and set(k[0] for k in log._groups) == {"b", "c"}
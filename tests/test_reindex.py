@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+
+from common.config import DEFAULT_TENANT, EMBEDDING_DIM
+from common.exception import AppException
+from common.qdrant_utils import ensure_collection, resolve_collection
+from common.write_gate import WriteGate
+from context.reindex import Reindexer
+
+ALIAS = "chunks"
+
+
+def _points(count, doc_id="doc-1", **payload):
+    return [
+        PointStruct(
+            id=i,
+            vector=[float(i + 1)] + [0.5] * (EMBEDDING_DIM - 1),
+            payload={"doc_id": doc_id, "revision": "r1", "text": f"chunk {i}", **payload},
+        )
+        for i in range(count)
+    ]
+
+
+def _client_with_points(count=3):
+    client = QdrantClient(":memory:")
+    ensure_collection(client, ALIAS)
+    client.upsert(collection_name=ALIAS, points=_points(count, tenant="acme"))
+    return client
+
+
+def test_run_copies_into_a_new_version_and_switches_the_alias():
+    client = _client_with_points()
+    switches = []
+    reindexer = Reindexer(client, alias=ALIAS, on_switch=lambda: switches.append(1))
+
+    result = reindexer.run(max_points_per_sec=0)
+
+    assert (result["source"], result["target"], result["copied"]) == ("chunks_v1", "chunks_v2", 3)
+    assert resolve_collection(client, ALIAS) == "chunks_v2"
+    assert client.count(collection_name=ALIAS, exact=True).count == 3
+    assert switches == [1]
+    assert reindexer.status()["versions"] == ["chunks_v1", "chunks_v2"]
+
+
+def test_rollback_points_the_alias_at_the_previous_version():
+    client = _client_with_points()
+    reindexer = Reindexer(client, alias=ALIAS)
+    reindexer.run(max_points_per_sec=0)
+
+    assert reindexer.rollback() == {"previous": "chunks_v2", "active_collection": "chunks_v1"}
+    assert resolve_collection(client, ALIAS) == "chunks_v1"
+    # Nothing older than v1 to go back to
+    with pytest.raises(AppException) as info:
+        reindexer.rollback()
+    assert info.value.status_code == 409
+
+
+def test_old_versions_beyond_the_kept_ones_are_pruned():
+    client = _client_with_points()
+    reindexer = Reindexer(client, alias=ALIAS)
+    reindexer.run(max_points_per_sec=0)
+    result = reindexer.run(max_points_per_sec=0)
+
+    assert result["pruned"] == ["chunks_v1"]
+    assert reindexer.status()["versions"] == ["chunks_v2", "chunks_v3"]
+
+
+def test_legacy_collection_is_replaced_by_an_alias_and_tenants_filled_in():
+    client = QdrantClient(":memory:")
+    client.create_collection(ALIAS, vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE))
+    client.upsert(collection_name=ALIAS, points=_points(2))
+
+    Reindexer(client, alias=ALIAS).run(max_points_per_sec=0)
+
+    assert resolve_collection(client, ALIAS) == "chunks_v1"
+    points, _ = client.scroll(collection_name=ALIAS, with_payload=True)
+    assert {p.payload["tenant"] for p in points} == {DEFAULT_TENANT}
+
+
+def test_missing_collection_is_a_404():
+    with pytest.raises(AppException) as info:
+        Reindexer(QdrantClient(":memory:"), alias=ALIAS).run()
+    assert info.value.status_code == 404
+
+
+def test_paused_gate_waits_for_writes_in_flight_and_holds_new_ones():
+    gate = WriteGate()
+    events = []
+    writing = threading.Event()
+    finish_write = threading.Event()
+
+    def writer(tag, hold=None):
+        with gate.write():
+            events.append(f"{tag} writing")
+            if hold is not None:
+                writing.set()
+                hold.wait()
+        events.append(f"{tag} done")
+
+    first = threading.Thread(target=writer, args=("first", finish_write))
+    first.start()
+    writing.wait()
+
+    def pause():
+        with gate.paused():
+            events.append("paused")
+            time.sleep(0.05)
+            events.append("resuming")
+
+    pauser = threading.Thread(target=pause)
+    pauser.start()
+    time.sleep(0.05)
+    assert "paused" not in events
+    finish_write.set()
+    while "paused" not in events:
+        time.sleep(0.005)
+    second = threading.Thread(target=writer, args=("second",))
+    second.start()
+    for thread in (first, pauser, second):
+        thread.join(timeout=2)
+
+    assert events.index("first done") < events.index("paused")
+    assert events.index("resuming") < events.index("second writing")
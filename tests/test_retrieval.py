@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+from agents.retrieval_agent import _cutoff, _expand, _spans
+from common.qdrant_utils import chunk_point_id
+
+
+def _hit(index, score, doc_id="doc", revision="r1", count=10, **payload):
+    return SimpleNamespace(id=f"{doc_id}-{index}", score=score, payload={
+        "doc_id": doc_id, "revision": revision, "chunk_index": index, "chunk_count": count, **payload,
+    })
+
+
+def _result(hit):
+    return {"text": f"hit {hit.payload['chunk_index']}", "score": hit.score,
+            "page_number": 1, "page_end": 1, "chunk_index": hit.payload["chunk_index"]}
+
+
+def test_spans_widen_each_hit_and_clamp_to_the_document():
+    spans = _spans([_hit(0, 0.9), _hit(9, 0.8)], window=2)
+    assert [(s["lo"], s["hi"], s["hits"]) for s in spans] == [(0, 2, [0]), (7, 9, [1])]
+
+
+def test_overlapping_or_touching_spans_merge():
+    spans = _spans([_hit(5, 0.9), _hit(3, 0.8), _hit(8, 0.7)], window=1)
+    assert [(s["lo"], s["hi"], sorted(s["hits"])) for s in spans] == [(2, 9, [0, 1, 2])]
+
+
+def test_spans_never_merge_across_documents_or_revisions():
+    hits = [_hit(4, 0.9), _hit(4, 0.8, doc_id="other"), _hit(5, 0.7, revision="r2")]
+    spans = _spans(hits, window=1)
+    assert len(spans) == 3
+
+
+def test_hits_without_adjacency_get_no_span():
+    legacy = SimpleNamespace(id="x", score=0.9, payload={"doc_id": "doc", "text": "old chunk"})
+    assert _spans([legacy], window=1) == []
+
+
+def _chunk(index, text, overlap="", page=1):
+    return {"text": overlap + text, "token_count": len((overlap + text).split()),
+            "overlap_chars": len(overlap), "overlap_tokens": len(overlap.split()),
+            "page_number": page, "page_end": page, "chunk_index": index}
+
+
+def test_expand_stitches_the_span_without_repeating_overlap():
+    hits = [_hit(1, 0.9), _hit(2, 0.6)]
+    results = [_result(h) for h in hits]
+    spans = _spans(hits, window=1)
+    chunks = {
+        chunk_point_id("doc", "r1", 0): _chunk(0, "Alpha beta.", page=1),
+        chunk_point_id("doc", "r1", 1): _chunk(1, "Gamma delta.", overlap="beta. ", page=1),
+        chunk_point_id("doc", "r1", 2): _chunk(2, "Epsilon.", overlap="delta. ", page=2),
+        chunk_point_id("doc", "r1", 3): _chunk(3, "Zeta.", page=3),
+    }
+
+    expanded = _expand(results, spans, chunks)
+
+    assert len(expanded) == 1
+    assert expanded[0]["text"] == "Alpha beta. Gamma delta. Epsilon. Zeta."
+    assert expanded[0]["score"] == 0.9
+    assert (expanded[0]["page_number"], expanded[0]["page_end"]) == (1, 3)
+    assert expanded[0]["chunk_span"] == [0, 3]
+    assert expanded[0]["token_count"] == 6
+
+
+def test_expand_skips_chunks_gone_since_the_search():
+    hits = [_hit(1, 0.9)]
+    chunks = {chunk_point_id("doc", "r1", 2): _chunk(2, "Only survivor.", overlap="x ")}
+    expanded = _expand([_result(hits[0])], _spans(hits, window=1), chunks)
+    # Without its predecessor, the overlap is kept
+    assert expanded[0]["text"] == "x Only survivor."
+
+    assert _expand([_result(hits[0])], _spans(hits, window=1), {})[0]["text"] == "hit 1"
+
+
+def _scored(*scores):
+    return [SimpleNamespace(id=i, score=score, payload={}) for i, score in enumerate(scores)]
+
+
+def test_cutoff_stops_at_the_first_large_relative_drop():
+    hits = _scored(0.9, 0.85, 0.8, 0.4, 0.39)
+    assert [h.score for h in _cutoff(hits, gap=0.25, min_k=1)] == [0.9, 0.85, 0.8]
+
+
+def test_cutoff_keeps_everything_without_a_large_drop():
+    hits = _scored(0.9, 0.8, 0.7, 0.6)
+    assert _cutoff(hits, gap=0.25, min_k=1) == hits
+
+
+def test_cutoff_always_keeps_min_k_hits():
+    hits = _scored(0.9, 0.3, 0.1)
+    assert len(_cutoff(hits, gap=0.25, min_k=1)) == 1
+    assert len(_cutoff(hits, gap=0.25, min_k=2)) == 2
+    assert len(_cutoff(hits, gap=0.25, min_k=3)) == 3
+    assert _cutoff([], gap=0.25, min_k=1) == []
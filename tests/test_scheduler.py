@@ -0,0 +1,161 @@
+import contextlib
+import threading
+import time
+import uuid
+
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointStruct
+
+from common.config import EMBEDDING_DIM
+from common.qdrant_utils import ensure_collection
+from common.scheduler import BULK, INTERACTIVE, Overloaded, PriorityScheduler, slot
+from context.context_manager import ContextManager
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.005)
+
+
+def test_slot_without_scheduler_is_a_no_op():
+    with slot(None, BULK):
+        pass
+
+
+def test_unknown_work_class_is_rejected():
+    scheduler = PriorityScheduler(slots=1)
+    with pytest.raises(Exception) as info:
+        with scheduler.slot("batch"):
+            pass
+    assert info.value.status_code == 500
+
+
+def test_bulk_work_never_holds_every_slot():
+    scheduler = PriorityScheduler(slots=2, bulk_slots=1, max_bulk_queue=0)
+    with scheduler.slot(BULK):
+        # The second bulk batch has to queue, and its queue holds nothing
+        with pytest.raises(Overloaded) as info:
+            with scheduler.slot(BULK):
+                pass
+        assert info.value.status_code == 503
+        # ...while a query still gets the free slot right away
+        with scheduler.slot(INTERACTIVE):
+            assert scheduler.stats()["running"] == {INTERACTIVE: 1, BULK: 1}
+    assert scheduler.stats()["rejected"][BULK] == 1
+
+
+def test_full_interactive_queue_rejects_with_retry_after():
+    scheduler = PriorityScheduler(slots=1, max_interactive_queue=0)
+    with scheduler.slot(INTERACTIVE):
+        with pytest.raises(Overloaded) as info:
+            with scheduler.slot(INTERACTIVE):
+                pass
+    assert info.value.status_code == 503
+    assert info.value.retry_after >= 1
+
+
+def test_query_gives_up_after_its_max_wait():
+    scheduler = PriorityScheduler(slots=1, interactive_max_wait=0.05)
+    with scheduler.slot(BULK):
+        started = time.monotonic()
+        with pytest.raises(Overloaded):
+            with scheduler.slot(INTERACTIVE, timeout=10):
+                pass
+        assert time.monotonic() - started < 1
+    stats = scheduler.stats()
+    assert stats["queued"] == {INTERACTIVE: 0, BULK: 0}
+    assert stats["busy"] == 0
+
+
+def test_waiting_query_runs_before_waiting_bulk_work():
+    scheduler = PriorityScheduler(slots=1, bulk_slots=1)
+    order = []
+    release = threading.Event()
+
+    def holder():
+        with scheduler.slot(BULK):
+            release.wait()
+
+    def worker(work_class, tag):
+        with scheduler.slot(work_class):
+            order.append(tag)
+
+    threads = [threading.Thread(target=holder)]
+    threads[0].start()
+    _wait_for(lambda: scheduler.stats()["busy"] == 1)
+    threads.append(threading.Thread(target=worker, args=(BULK, "bulk")))
+    threads[-1].start()
+    _wait_for(lambda: scheduler.stats()["queued"][BULK] == 1)
+    threads.append(threading.Thread(target=worker, args=(INTERACTIVE, "query")))
+    threads[-1].start()
+    _wait_for(lambda: scheduler.stats()["queued"][INTERACTIVE] == 1)
+
+    release.set()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == ["query", "bulk"]
+
+
+def test_ingestion_jobs_beyond_the_limit_get_429():
+    scheduler = PriorityScheduler(max_jobs=1)
+    with scheduler.job():
+        with pytest.raises(Overloaded) as info:
+            with scheduler.job():
+                pass
+    assert info.value.status_code == 429
+    assert scheduler.stats()["rejected"]["jobs"] == 1
+    # The slot frees up once the running job ends
+    with scheduler.job():
+        assert scheduler.stats()["ingest_jobs"]["active"] == 1
+
+
+class _RecordingScheduler:
+    """Records the work class of every slot taken; refuses them once `full`."""
+
+    def __init__(self):
+        self.classes = []
+        self.full = False
+
+    def slot(self, work_class, timeout=None):
+        if self.full:
+            raise Overloaded("Server busy", retry_after=1.0)
+        self.classes.append(work_class)
+        return contextlib.nullcontext()
+
+
+def _document_manager():
+    qdrant = QdrantClient(":memory:")
+    ensure_collection(qdrant, "docs")
+    qdrant.upsert(collection_name="docs", points=[
+        PointStruct(id=str(uuid.uuid4()), vector=[0.1] * EMBEDDING_DIM,
+                    payload={"doc_id": "doc", "source": "doc.pdf", "page_number": page})
+        for page in (1, 2)
+    ])
+    manager = ContextManager.__new__(ContextManager)
+    manager.qdrant = qdrant
+    manager.collection_name = "docs"
+    manager.scheduler = _RecordingScheduler()
+    manager.write_gate = None
+    manager._adjust_vector_count = lambda delta: None
+    manager._index_changed = lambda reason: None
+    return manager
+
+
+def test_document_listing_and_deletes_take_bulk_slots():
+    manager = _document_manager()
+    assert [d["chunks"] for d in manager.list_documents()] == [2]
+    assert manager.scheduler.classes == [BULK]
+
+    manager.delete_document("doc")
+    assert manager.scheduler.classes == [BULK, BULK]
+    assert manager.list_documents() == []
+
+
+def test_document_listing_is_shed_not_failed_when_bulk_work_is_full():
+    manager = _document_manager()
+    manager.scheduler.full = True
+    with pytest.raises(Overloaded):
+        manager.list_documents()
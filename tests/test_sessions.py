@@ -0,0 +1,103 @@
+import pytest
+
+from common.exception import AppException
+from context.context_manager import ContextManager
+from context.sessions import SessionStore, compact_history, is_follow_up
+
+
+def _turn(question, answer):
+    return {"question": question, "answer": answer}
+
+
+def test_compact_history_keeps_everything_within_budget():
+    turns = [_turn("What is RAG?", "Retrieval-augmented generation."), _turn("Who uses it?", "")]
+    assert compact_history(turns, 100) == (
+        "User: What is RAG?\nAssistant: Retrieval-augmented generation.\n"
+        "User: Who uses it?\nAssistant: (no answer)"
+    )
+
+
+def test_compact_history_drops_old_answers_then_old_turns():
+    turns = [_turn(f"question {i}", "a long answer " * 10) for i in range(4)]
+    history = compact_history(turns, 50)
+    lines = history.splitlines()
+    # The newest turn keeps its answer, the one before only its question
+    assert lines[-2:] == ["User: question 3", "Assistant: " + "a long answer " * 10]
+    assert "User: question 2" in lines and "Assistant" not in history.split("User: question 3")[0]
+    assert lines[0].endswith("earlier turns omitted)")
+
+
+def test_short_or_referring_questions_are_follow_ups():
+    assert is_follow_up("And on page 4?")
+    assert is_follow_up("How does this compare with the results reported last year?")
+    assert not is_follow_up("What are the installation requirements for the server?")
+
+
+class _Retriever:
+    def __init__(self, score):
+        self.score = score
+
+    def rerank(self, question, contexts, timeout=None):
+        return [dict(c, score=self.score) for c in contexts]
+
+
+class _LLM:
+    def __init__(self):
+        self.histories = []
+
+    def run(self, question, contexts, timeout=None, history=None):
+        self.histories.append(history)
+        return {"answer": f"answer to {question}"}
+
+
+def _manager(rerank_score):
+    manager = ContextManager.__new__(ContextManager)
+    manager.sessions = SessionStore()
+    manager.retriever = _Retriever(rerank_score)
+    manager.llm_agent = _LLM()
+    manager.searches = []
+    manager._check_available = lambda: None
+
+    def retrieve(question, top_k, budget, window=None, **filters):
+        manager.searches.append(question)
+        return [{"chunk_id": f"c{len(manager.searches)}", "text": "passage", "score": 0.9}]
+
+    manager._retrieve = retrieve
+    return manager
+
+
+def test_follow_up_is_answered_from_the_previous_contexts_when_still_relevant():
+    manager = _manager(rerank_score=0.9)
+    session_id = manager.create_session()["session_id"]
+
+    first = manager.chat(session_id, "What are the installation requirements for the server?")
+    second = manager.chat(session_id, "And for the client?")
+
+    assert not first["reused_contexts"] and second["reused_contexts"]
+    assert manager.searches == ["What are the installation requirements for the server?"]
+    assert [c["chunk_id"] for c in second["contexts"]] == ["c1"]
+    assert manager.llm_agent.histories[1].startswith("User: What are the installation requirements")
+
+
+def test_rejected_follow_up_is_searched_with_the_previous_question_only_if_it_depends_on_it():
+    manager = _manager(rerank_score=0.1)
+    session_id = manager.create_session()["session_id"]
+
+    manager.chat(session_id, "What are the installation requirements for the server?")
+    manager.chat(session_id, "How is the licensing of the enterprise edition handled?")
+    manager.chat(session_id, "And the price?")
+
+    assert manager.searches[1] == "How is the licensing of the enterprise edition handled?"
+    assert manager.searches[2] == "How is the licensing of the enterprise edition handled? And the price?"
+
+
+def test_unknown_session_is_not_found_even_when_nothing_is_indexed():
+    manager = _manager(rerank_score=0.9)
+
+    def unavailable():
+        raise AppException("No documents indexed", status_code=400)
+
+    manager._check_available = unavailable
+    with pytest.raises(AppException) as e:
+        manager.chat("missing", "What is RAG?")
+    assert e.value.status_code == 404
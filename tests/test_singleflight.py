@@ -0,0 +1,166 @@
+import threading
+import time
+
+import pytest
+
+from context.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight("test")
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("q", work)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(flights.do("q", work))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    deadline = time.monotonic() + 2
+    while flights.stats()["coalesced"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(timeout=2)
+
+    assert results == ["answer"] * 4
+    assert len(calls) == 1
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_do_fans_the_leaders_error_out_to_followers():
+    flights = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait()
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            flights.do("q", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    deadline = time.monotonic() + 2
+    while flights.stats()["coalesced"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    release.set()
+    leader.join(timeout=2)
+    follower.join(timeout=2)
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+    assert flights.stats()["errors"] == 1
+    # Nothing is cached: the next call runs again
+    assert flights.do("q", lambda: "retry") == "retry"
+
+
+def test_stream_replays_earlier_events_to_late_subscribers():
+    flights = SingleFlight("test")
+    first_sent = threading.Event()
+    release = threading.Event()
+
+    def produce():
+        yield 1
+        first_sent.set()
+        release.wait()
+        yield 2
+
+    leader = flights.stream("q", produce)
+    first_sent.wait()
+    follower = flights.stream("q", produce)
+    release.set()
+
+    assert list(leader) == [1, 2]
+    assert list(follower) == [1, 2]
+    assert flights.stats()["stream_leaders"] == 1
+    assert flights.stats()["stream_coalesced"] == 1
+
+
+def test_stream_error_reaches_every_subscriber_after_its_events():
+    flights = SingleFlight("test")
+    release = threading.Event()
+
+    def produce():
+        yield "contexts"
+        release.wait()
+        raise RuntimeError("llm down")
+
+    subscribers = [flights.stream("q", produce), flights.stream("q", produce)]
+    release.set()
+    for events in subscribers:
+        received = []
+        with pytest.raises(RuntimeError, match="llm down"):
+            for event in events:
+                received.append(event)
+        assert received == ["contexts"]
+    assert flights.stats()["errors"] == 1
+
+
+def test_stream_stops_once_every_subscriber_has_disconnected():
+    flights = SingleFlight("test")
+    produced = []
+    closed = threading.Event()
+    # One permit per event, so the producer can't run ahead of the test
+    permits = threading.Semaphore(0)
+
+    def produce():
+        try:
+            for i in range(100):
+                permits.acquire()
+                produced.append(i)
+                yield i
+        finally:
+            closed.set()
+
+    leader = flights.stream("q", produce)
+    follower = flights.stream("q", produce)
+    permits.release()
+    assert next(leader) == 0 and next(follower) == 0
+    leader.close()
+    follower.close()
+    for _ in range(100):
+        permits.release()
+
+    assert closed.wait(2)
+    assert len(produced) < 100
+    assert flights.stats()["stream_abandoned"] == 1
+    # A later call with the key starts a fresh producer
+    assert list(flights.stream("q", lambda: iter([1, 2]))) == [1, 2]
+
+
+def test_stream_keeps_running_while_one_subscriber_remains():
+    flights = SingleFlight("test")
+    release = threading.Event()
+
+    def produce():
+        yield 1
+        release.wait()
+        yield 2
+
+    leader = flights.stream("q", produce)
+    follower = flights.stream("q", produce)
+    assert next(leader) == 1
+    leader.close()
+    release.set()
+
+    assert list(follower) == [1, 2]
+    assert flights.stats()["stream_abandoned"] == 0
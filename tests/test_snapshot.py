@@ -0,0 +1,80 @@
+import os
+
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointStruct
+
+from common.config import DEFAULT_TENANT, EMBEDDING_DIM
+from common.exception import AppException
+from common.qdrant_utils import ensure_collection, resolve_collection
+from context.snapshot import PAYLOADS, export_snapshot, import_snapshot, read_manifest
+
+ALIAS = "chunks"
+
+
+def _vector(i):
+    return [float(i % 7) / 7 + 0.01 * j for j in range(EMBEDDING_DIM)]
+
+
+def _source(count=25, **payload):
+    client = QdrantClient(":memory:")
+    ensure_collection(client, ALIAS)
+    client.upsert(collection_name=ALIAS, points=[
+        PointStruct(id=i, vector=_vector(i), payload={"doc_id": f"doc-{i % 3}", "text": f"chunk {i}", **payload})
+        for i in range(count)
+    ])
+    return client
+
+
+def _all_points(client):
+    points, _ = client.scroll(collection_name=ALIAS, limit=1000, with_payload=True, with_vectors=True)
+    return {p.id: p for p in points}
+
+
+def test_export_import_round_trip(tmp_path):
+    source = _source(tenant="acme")
+    manifest = export_snapshot(source, str(tmp_path), collection=ALIAS, batch_size=10)
+    assert (manifest["count"], manifest["dim"]) == (25, EMBEDDING_DIM)
+
+    target = QdrantClient(":memory:")
+    # The in-memory client is not thread-safe, so upserts go one at a time
+    result = import_snapshot(target, str(tmp_path), alias=ALIAS, batch_size=7, workers=1)
+
+    assert (result["target"], result["points"]) == ("chunks_v1", 25)
+    assert resolve_collection(target, ALIAS) == "chunks_v1"
+    exported, imported = _all_points(source), _all_points(target)
+    assert exported.keys() == imported.keys()
+    for point_id, point in exported.items():
+        assert imported[point_id].payload == point.payload
+        assert imported[point_id].vector == pytest.approx(point.vector, rel=1e-6)
+
+
+def test_import_keeps_the_previous_version_for_rollback(tmp_path):
+    export_snapshot(_source(), str(tmp_path), collection=ALIAS)
+    node = _source(count=2)
+
+    result = import_snapshot(node, str(tmp_path), alias=ALIAS, workers=1)
+
+    assert (result["previous"], result["target"]) == ("chunks_v1", "chunks_v2")
+    assert node.count(collection_name=ALIAS, exact=True).count == 25
+    assert node.collection_exists("chunks_v1")
+
+
+def test_payloads_without_a_tenant_get_the_default_one(tmp_path):
+    export_snapshot(_source(count=3), str(tmp_path), collection=ALIAS)
+    target = QdrantClient(":memory:")
+    import_snapshot(target, str(tmp_path), alias=ALIAS, workers=1)
+    assert {p.payload["tenant"] for p in _all_points(target).values()} == {DEFAULT_TENANT}
+
+
+def test_tampered_or_incomplete_snapshots_are_refused(tmp_path):
+    export_snapshot(_source(count=3), str(tmp_path), collection=ALIAS)
+    with open(os.path.join(tmp_path, PAYLOADS), "a", encoding="utf-8") as f:
+        f.write("\n")
+    with pytest.raises(AppException, match="checksum"):
+        read_manifest(str(tmp_path))
+
+    os.remove(os.path.join(tmp_path, "manifest.json"))
+    with pytest.raises(AppException) as info:
+        import_snapshot(QdrantClient(":memory:"), str(tmp_path), alias=ALIAS)
+    assert info.value.status_code == 404
@@ -0,0 +1,75 @@
+import asyncio
+import io
+import os
+
+import pytest
+from starlette.datastructures import UploadFile
+
+from backend.storage import MB, UploadStore
+from common.exception import AppException
+
+
+def _pdf(size, fill=b"a", name="doc.pdf"):
+    return UploadFile(io.BytesIO(b"%PDF-" + fill * (size - 5)), filename=name)
+
+
+def _save(store, upload):
+    return asyncio.run(store.save(upload))
+
+
+def test_identical_uploads_are_stored_once(tmp_path):
+    store = UploadStore(str(tmp_path), max_file_bytes=MB, quota_bytes=10 * MB)
+    first = _save(store, _pdf(1000, name="a.pdf"))
+    second = _save(store, _pdf(1000, name="copy of a.pdf"))
+
+    assert first["path"] == second["path"] and first["sha256"] == second["sha256"]
+    assert second["filename"] == "copy of a.pdf"
+    assert store.usage_bytes() == 1000
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_non_pdf_and_oversized_files_are_rejected(tmp_path):
+    store = UploadStore(str(tmp_path), max_file_bytes=1000, quota_bytes=10 * MB)
+    with pytest.raises(AppException) as info:
+        _save(store, UploadFile(io.BytesIO(b"plain text"), filename="notes.txt"))
+    assert info.value.status_code == 415
+    with pytest.raises(AppException) as info:
+        _save(store, _pdf(1001))
+    assert info.value.status_code == 413
+    # Nothing of either upload is left behind or counted
+    assert store.usage_bytes() == 0
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_quota_counts_stored_bytes_and_frees_them_on_gc(tmp_path):
+    store = UploadStore(str(tmp_path), max_file_bytes=MB, quota_bytes=2500, retention_hours=1)
+    _save(store, _pdf(1000, b"a"))
+    _save(store, _pdf(1000, b"b"))
+    with pytest.raises(AppException) as info:
+        _save(store, _pdf(1000, b"c"))
+    assert info.value.status_code == 507
+    assert store.usage_bytes() == 2000
+
+    store.retention_seconds = -1
+    assert store.gc() == 2
+    assert store.usage_bytes() == 0
+    _save(store, _pdf(1000, b"c"))
+
+
+def test_concurrent_uploads_never_exceed_the_quota(tmp_path):
+    store = UploadStore(str(tmp_path), max_file_bytes=3 * MB, quota_bytes=5 * MB)
+
+    async def upload_all():
+        uploads = [store.save(_pdf(2 * MB, bytes([ord("a") + i]))) for i in range(4)]
+        return await asyncio.gather(*uploads, return_exceptions=True)
+
+    results = asyncio.run(upload_all())
+    stored = [r for r in results if isinstance(r, dict)]
+    assert stored
+    assert all(isinstance(r, dict) or r.status_code == 507 for r in results)
+    assert store.usage_bytes() == sum(r["size"] for r in stored) <= 5 * MB
+
+
+def test_usage_is_measured_from_disk_at_startup(tmp_path):
+    _save(UploadStore(str(tmp_path)), _pdf(1000))
+    assert UploadStore(str(tmp_path)).usage_bytes() == 1000